@@ -5,6 +5,7 @@ __author__ = 'Bill Bollenbacher'
 from mi.core.log import log
 from mi.core.exceptions import ServerError
 from mi.core.exceptions import NotImplementedException, InstrumentException
+from mi.core.watchdog import get_watchdog
 
 import time
 import gevent
@@ -76,6 +77,7 @@ class TcpServer(object):
     PORT_RANGE_UPPER = 8010
     close_reason = SessionCloseReasons.client_closed
     activity_seen = False
+    last_activity = 0
     server_ready_to_send = False
     stop_server = False
 
@@ -159,6 +161,7 @@ class TcpServer(object):
         log.debug("TcpServer._write(): data = " + str(data))
         if self.connection_socket:
             self.activity_seen = True;
+            self.last_activity = time.time()
             MSGLEN = len(data)
             total_sent = 0
             while total_sent < MSGLEN:
@@ -224,6 +227,7 @@ class TcpServer(object):
                     # one way that the socket can indicate that the client has closed the connection
                     self._exit_handler(SessionCloseReasons.client_closed)
                 self.activity_seen = True;
+                self.last_activity = time.time()
                 return input_data
             except gevent.socket.error, error:
                 if error.errno == errno.EAGAIN or error.errno == errno.EWOULDBLOCK:
@@ -460,10 +464,13 @@ class DirectAccessServer(object):
         else:
             raise ServerError("DirectAccessServer.__init__(): Unsupported direct access type")
 
-        log.debug("DirectAccessServer.__init__(): starting timer greenlet")
-        self.timer = gevent.spawn(self._timer_greenlet, 
-                                  session_timeout=session_timeout,
-                                  inactivity_timeout=inactivity_timeout)
+        log.debug("DirectAccessServer.__init__(): starting session and inactivity timers")
+        self.inactivity_timeout = inactivity_timeout
+        self.start_time = time.time()
+        watchdog = get_watchdog()
+        self.session_timer = watchdog.register(session_timeout, self._session_timeout, name='DA session')
+        self.inactivity_timer = watchdog.register(inactivity_timeout, self._inactivity_timeout,
+                                                  name='DA inactivity')
                 
     # public methods
     
@@ -490,7 +497,7 @@ class DirectAccessServer(object):
     # private methods
     
     def _stop(self, reason):
-        # can be called by timer greenlet or by parent interface stop() method
+        # can be called by the watchdog timers or by parent interface stop() method
         if self.already_stopping == True:
             log.debug("DirectAccessServer.stop(): already stopping")
             return
@@ -502,46 +509,32 @@ class DirectAccessServer(object):
             # pass in reason so server can tell parent via callback if necessary
             self.server.stop(reason)
             del self.server
-        if self.timer and reason == SessionCloseReasons.parent_closed:
-            # timer didn't initiate the stop, so kill it
-            log.debug("DirectAccessServer.stop(): stopping timer")
-            try:
-                self.timer.kill()
-            except Exception as ex:
-                # can happen if timer already closed session (race condition)
-                log.debug("DirectAccessServer.stop(): exception caught for timer kill: " + str(ex))
-        
+        log.debug("DirectAccessServer.stop(): stopping timers")
+        self.session_timer.cancel()
+        self.inactivity_timer.cancel()
 
-    def _timer_greenlet(self, session_timeout, inactivity_timeout):
-        # implements session and inactivity timeouts
-        # do NOT add parent callback to this greenlet
+
+    def _session_timeout(self):
+        # called on the watchdog thread, do NOT add parent callbacks here
         # ALL callbacks to the parent should be handled by the server greenlet
-        log.debug("DirectAccessServer._timer_greenlet(): started - sessionTO=%d, inactivityTO=%d"
-                  %(session_timeout, inactivity_timeout))
-        session_start_time = inactivity_start_time = time.time()
-        try:
-            while True:
-                gevent.sleep(1)
-                timenow = time.time()
-
-                if ((timenow - session_start_time) > session_timeout):
-                    log.debug("DirectAccessServer._timer_greenlet(): session exceeded session timeout of %d seconds"
-                              %session_timeout)
-                    # indicate to the server that it should shut down; the server will inform the parent of the shutdown
-                    self._stop(SessionCloseReasons.session_timeout)
-                    break
-
-                if self.server.any_activity():
-                    # activity detected so reset the inactivity start time
-                    inactivity_start_time = time.time() 
-                elif ((timenow - inactivity_start_time) > inactivity_timeout):
-                    log.debug("DirectAccessServer._timer_greenlet(): session exceeded inactivity timeout of %d seconds"
-                              %inactivity_timeout)
-                    # indicate to the server that it should shut down; the server will inform the parent of the shutdown
-                    self._stop(reason=SessionCloseReasons.inactivity_timeout)
-                    break
-        except:
-            # to detect a kill() from the DA server
-            pass
-        log.debug("DirectAccessServer._timer_greenlet(): stopped ")
+        log.debug("DirectAccessServer._session_timeout(): session exceeded session timeout of %d seconds",
+                  self.session_timer.timeout)
+        # indicate to the server that it should shut down; the server will inform the parent of the shutdown
+        self._stop(SessionCloseReasons.session_timeout)
+
+
+    def _inactivity_timeout(self):
+        # called on the watchdog thread, the server only records the time of the last activity
+        # so the timer is pushed back here for as long as there was activity
+        server = self.server
+        if self.already_stopping or server is None:
+            return
+        idle = time.time() - max(server.last_activity, self.start_time)
+        if idle < self.inactivity_timeout:
+            self.inactivity_timer.reset(self.inactivity_timeout - idle)
+            return
+        log.debug("DirectAccessServer._inactivity_timeout(): session exceeded inactivity timeout of %d seconds",
+                  self.inactivity_timeout)
+        # indicate to the server that it should shut down; the server will inform the parent of the shutdown
+        self._stop(reason=SessionCloseReasons.inactivity_timeout)
                      
\ No newline at end of file
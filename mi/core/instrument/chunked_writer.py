@@ -0,0 +1,391 @@
+"""
+@package mi.core.instrument.chunked_writer
+@file /mi-instrument/mi/core/instrument/chunked_writer.py
+@brief Streaming NetCDF4 and Parquet output of data particles
+
+Particles are accumulated per stream in a StreamColumns block and written
+out as a compressed chunk (a NetCDF4 append along the unlimited row dimension
+or a Parquet row group) every chunk_rows rows, so peak memory is bounded by
+the chunk size rather than the size of the input.
+
+Each stream is written to <stream>.nc or <stream>.parquet. If a later chunk
+can not be stored in the file already started (a parameter changes shape or
+can not be cast to the stored type) the writer rolls over to a new part,
+<stream>_1.nc, <stream>_2.nc, etc.
+"""
+import os
+
+import numpy as np
+
+from mi.core.instrument.particle_accumulator import StreamColumns, ROW_DIMENSION
+from mi.logging import log
+
+DEFAULT_CHUNK_ROWS = 100000
+DEFAULT_COMPRESSION_LEVEL = 4
+# upper bound on the size of a single NetCDF (HDF5) chunk
+MAX_CHUNK_BYTES = 4 * 1024 * 1024
+
+
+class IncompatibleChunk(Exception):
+    """
+    Raised when a chunk can not be appended to the current output part
+    """
+
+
+class StreamWriter(object):
+    """
+    Base class for the chunked writer of a single stream
+    """
+    extension = None
+
+    def __init__(self, stream, output_path=None, chunk_rows=None, compression_level=None):
+        self.stream = stream
+        self.output_path = output_path if output_path is not None else os.getcwd()
+        self.chunk_rows = chunk_rows if chunk_rows else DEFAULT_CHUNK_ROWS
+        self.compression_level = compression_level if compression_level is not None else DEFAULT_COMPRESSION_LEVEL
+        self.columns = StreamColumns()
+        self.part = 0
+        self.rows_written = 0
+        self.paths = []
+        self._open = False
+
+    def add_particle(self, particle):
+        self.columns.append_particle(particle)
+        if len(self.columns) >= self.chunk_rows:
+            self.flush()
+
+    def add_sample(self, sample):
+        self.columns.append(sample)
+        if len(self.columns) >= self.chunk_rows:
+            self.flush()
+
+    def add_columns(self, columns):
+        self.columns.extend(columns)
+        if len(self.columns) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Write out the accumulated rows, if any
+        """
+        columns = self.columns
+        if not len(columns):
+            return
+
+        self.columns = StreamColumns()
+        if self._open:
+            try:
+                self._append(columns)
+                self.rows_written += len(columns)
+                return
+            except IncompatibleChunk as e:
+                log.warn('Unable to append to %s (%s), starting a new part', self.paths[-1], e)
+                self._close()
+                self._open = False
+                self.part += 1
+
+        path = self._part_path()
+        self.paths.append(path)
+        self._create(path, columns)
+        self._open = True
+        self.rows_written += len(columns)
+
+    def close(self):
+        self.flush()
+        if self._open:
+            self._close()
+            self._open = False
+
+    def _part_path(self):
+        if self.part:
+            name = '%s_%d.%s' % (self.stream, self.part, self.extension)
+        else:
+            name = '%s.%s' % (self.stream, self.extension)
+        return os.path.join(self.output_path, name)
+
+    def _create(self, path, columns):
+        raise NotImplementedError
+
+    def _append(self, columns):
+        raise NotImplementedError
+
+    def _close(self):
+        raise NotImplementedError
+
+
+def _from_booleans(values, missing):
+    """
+    Return an object column of booleans (and missing values) as int8, or None
+    if the column holds anything else
+    """
+    present = values if missing is None else values[~missing]
+    if not len(present) or not all(isinstance(value, (bool, np.bool_)) for value in present):
+        return None
+    return np.array([bool(value) for value in values], dtype=np.int8)
+
+
+def _as_strings(values):
+    """
+    Convert an object column to strings, missing values become empty strings
+    """
+    result = np.empty(len(values), dtype=np.object_)
+    for index, value in enumerate(values):
+        if value is None:
+            result[index] = ''
+        elif isinstance(value, unicode):
+            result[index] = value.encode('utf-8')
+        else:
+            result[index] = str(value)
+    return result
+
+
+class NetcdfStreamWriter(StreamWriter):
+    """
+    Write a stream to a NetCDF4 file with an unlimited row dimension.
+    Array valued parameters get one fixed dimension per axis, named as in
+    StreamColumns.to_dataset. Variables are zlib compressed and chunked
+    along the row dimension.
+    """
+    extension = 'nc'
+
+    # netCDF types for each of the column kinds
+    _TYPES = {'b': 'i1', 'i': 'i8', 'f': 'f8', 'O': str}
+
+    def __init__(self, *args, **kwargs):
+        super(NetcdfStreamWriter, self).__init__(*args, **kwargs)
+        self.dataset = None
+
+    def _create(self, path, columns):
+        import netCDF4
+        self.dataset = netCDF4.Dataset(path, 'w', format='NETCDF4')
+        self.dataset.createDimension(ROW_DIMENSION, None)
+        self._write(columns, 0)
+
+    def _append(self, columns):
+        self._write(columns, len(self.dataset.dimensions[ROW_DIMENSION]))
+
+    def _close(self):
+        self.dataset.close()
+        self.dataset = None
+
+    def _write(self, columns, start):
+        end = start + len(columns)
+        prepared = []
+        # check every column before writing so a rollover leaves the file consistent
+        for key in sorted(columns.columns):
+            column = columns.columns[key]
+            variable = self.dataset.variables.get(key)
+            if variable is None:
+                variable = self._variable_spec(key, column)
+            prepared.append((key, variable, self._prepare(key, column, len(columns), variable)))
+
+        for key, variable, values in prepared:
+            if isinstance(variable, tuple):
+                variable = self._create_variable(key, *variable)
+            variable[start:end] = values
+
+    def _variable_spec(self, key, column):
+        kind = column.kind if column.kind is not None else 'O'
+        if kind == 'O':
+            # booleans with missing values are stored in an object column
+            rows = column.size
+            if _from_booleans(column.values(rows), column.missing(rows)) is not None:
+                kind = 'b'
+            return self._TYPES[kind], ()
+        return self._TYPES[kind], column.shape
+
+    def _create_variable(self, key, datatype, shape):
+        dims = [ROW_DIMENSION]
+        for axis, size in enumerate(shape, 1):
+            dim = '%s_dim_%d' % (key, axis)
+            self.dataset.createDimension(dim, size)
+            dims.append(dim)
+
+        if datatype is str:
+            return self.dataset.createVariable(key, datatype, dims)
+
+        import netCDF4
+        dtype = np.dtype(datatype)
+        row_bytes = dtype.itemsize * int(np.prod(shape))
+        chunksizes = (max(1, min(self.chunk_rows, MAX_CHUNK_BYTES // row_bytes)),) + tuple(shape)
+        # set the fill value explicitly so readers mask the missing values
+        fill_value = netCDF4.default_fillvals[dtype.str[1:]]
+        return self.dataset.createVariable(key, datatype, dims, zlib=True, complevel=self.compression_level,
+                                           shuffle=True, chunksizes=chunksizes, fill_value=fill_value)
+
+    def _prepare(self, key, column, rows, variable):
+        """
+        Return the values of column in a form which can be stored in variable
+        """
+        values = column.values(rows)
+        missing = column.missing(rows)
+
+        if isinstance(variable, tuple):
+            datatype, shape = variable
+        else:
+            datatype, shape = variable.dtype, variable.shape[1:]
+
+        if datatype is str:
+            return _as_strings(values)
+
+        if values.dtype == np.object_:
+            booleans = _from_booleans(values, missing)
+            if booleans is not None:
+                values = booleans
+
+        if values.dtype == np.object_ or values.shape[1:] != tuple(shape):
+            raise IncompatibleChunk('%s can not be stored as %s%r' % (key, datatype, tuple(shape)))
+
+        datatype = np.dtype(datatype)
+        if datatype.kind == 'f':
+            return values.astype(datatype)
+
+        if values.dtype.kind == 'f':
+            present = ~missing if missing is not None else slice(None)
+            if not np.all(np.mod(values[present], 1) == 0):
+                raise IncompatibleChunk('%s has non integral values' % key)
+            values = np.where(np.isnan(values), 0, values)
+
+        values = values.astype(datatype)
+        if missing is not None and missing.any():
+            mask = np.broadcast_to(missing.reshape((-1,) + (1,) * (values.ndim - 1)), values.shape)
+            values = np.ma.masked_array(values, mask=mask)
+        return values
+
+
+class ParquetStreamWriter(StreamWriter):
+    """
+    Write a stream to a Parquet file, one row group per chunk.
+    Array valued parameters are stored as list columns.
+    """
+    extension = 'parquet'
+
+    def __init__(self, *args, **kwargs):
+        super(ParquetStreamWriter, self).__init__(*args, **kwargs)
+        self.writer = None
+
+    def _create(self, path, columns):
+        import pyarrow.parquet as pq
+        table = self._table(columns)
+        self.writer = pq.ParquetWriter(path, table.schema, compression='snappy')
+        self.writer.write_table(table)
+
+    def _append(self, columns):
+        self.writer.write_table(self._conform(self._table(columns)))
+
+    def _close(self):
+        self.writer.close()
+        self.writer = None
+
+    @staticmethod
+    def _array(values, missing):
+        import pyarrow as pa
+        if values.ndim > 1:
+            rows = len(values)
+            width = int(np.prod(values.shape[1:]))
+            offsets = np.arange(0, (rows + 1) * width, width, dtype=np.int32)
+            return pa.ListArray.from_arrays(pa.array(offsets), pa.array(values.reshape(-1)))
+
+        if values.dtype == np.object_:
+            try:
+                return pa.array(values, from_pandas=True)
+            except (TypeError, pa.ArrowException):
+                # mixed types, store the string form
+                return pa.array(_as_strings(values), mask=missing)
+
+        return pa.array(values, mask=missing)
+
+    def _table(self, columns):
+        import pyarrow as pa
+        rows = len(columns)
+        names = sorted(columns.columns)
+        arrays = []
+        for name in names:
+            column = columns.columns[name]
+            arrays.append(self._array(column.values(rows), column.missing(rows)))
+        return pa.Table.from_arrays(arrays, names=names)
+
+    def _conform(self, table):
+        """
+        Return table with the schema of the open file, missing columns are null
+        """
+        import pyarrow as pa
+        schema = self.writer.schema.to_arrow_schema() if hasattr(self.writer.schema, 'to_arrow_schema') \
+            else self.writer.schema
+        names = set(table.schema.names)
+        extra = names.difference(schema.names)
+        if extra:
+            raise IncompatibleChunk('new parameters %s' % ', '.join(sorted(extra)))
+
+        arrays = []
+        for field in schema:
+            if field.name not in names:
+                arrays.append(pa.array([None] * table.num_rows, type=field.type))
+                continue
+
+            column = table.column(field.name)
+            array = column.chunk(0) if hasattr(column, 'chunk') else column.data.chunk(0)
+            if array.type != field.type:
+                try:
+                    array = array.cast(field.type)
+                except (pa.ArrowException, NotImplementedError) as e:
+                    raise IncompatibleChunk('%s: %s' % (field.name, e))
+            arrays.append(array)
+        return pa.Table.from_arrays(arrays, schema=schema)
+
+
+class ChunkedWriter(object):
+    """
+    Route particles to one StreamWriter per stream. Offers the same add_particle
+    and add_sample interface as ParticleAccumulator.
+    """
+    def __init__(self, writer_class, output_path=None, chunk_rows=None, compression_level=None):
+        self.writer_class = writer_class
+        self.output_path = output_path
+        self.chunk_rows = chunk_rows
+        self.compression_level = compression_level
+        self.writers = {}
+        if output_path and not os.path.isdir(output_path):
+            os.makedirs(output_path)
+
+    def _writer(self, stream):
+        writer = self.writers.get(stream)
+        if writer is None:
+            writer = self.writers[stream] = self.writer_class(stream, self.output_path, self.chunk_rows,
+                                                              self.compression_level)
+        return writer
+
+    def add_particle(self, stream, particle):
+        self._writer(stream).add_particle(particle)
+
+    def add_sample(self, stream, sample):
+        self._writer(stream).add_sample(sample)
+
+    def add_columns(self, stream, columns):
+        self._writer(stream).add_columns(columns)
+
+    def __len__(self):
+        return sum(writer.rows_written + len(writer.columns) for writer in self.writers.itervalues())
+
+    def flush(self):
+        for writer in self.writers.itervalues():
+            writer.flush()
+
+    def close(self):
+        for stream in sorted(self.writers):
+            writer = self.writers[stream]
+            writer.close()
+            log.info('Wrote %d %s rows to %s', writer.rows_written, stream, ', '.join(writer.paths))
+
+
+WRITERS = {
+    'netcdf': NetcdfStreamWriter,
+    'parquet': ParquetStreamWriter,
+}
+
+
+def chunked_writer(fmt, output_path=None, chunk_rows=None, compression_level=None):
+    """
+    Return a ChunkedWriter for the named format ('netcdf' or 'parquet')
+    """
+    return ChunkedWriter(WRITERS[fmt], output_path, chunk_rows, compression_level)
@@ -11,9 +11,92 @@
 __author__ = 'Steve Foley'
 __license__ = 'Apache 2.0'
 
+import bisect
+from collections import deque
+
+import re
+import sre_compile
+import sre_parse
+
 from mi.core.log import get_logger
 log = get_logger()
 
+_regex_widths = {}
+_combined_regexes = {}
+# matches numbered or named backreferences, which break when patterns are joined
+_BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+
+
+def incremental_sieve(sieve_fn):
+    """
+    Mark a sieve function as accepting the scan_from keyword argument. See StringChunker.
+    """
+    sieve_fn.incremental = True
+    return sieve_fn
+
+
+def is_incremental_sieve(sieve_fn):
+    """
+    Determine if a sieve function (or a functools.partial wrapping one) accepts scan_from
+    """
+    while sieve_fn is not None:
+        if getattr(sieve_fn, 'incremental', False):
+            return True
+        sieve_fn = getattr(sieve_fn, 'func', None)
+    return False
+
+
+def regex_max_width(regex):
+    """
+    Return the longest string the compiled regex can match, or None if unbounded
+    """
+    key = (regex.pattern, regex.flags)
+    if key not in _regex_widths:
+        _, max_width = sre_parse.parse(regex.pattern, regex.flags).getwidth()
+        _regex_widths[key] = max_width if max_width < sre_compile.MAXREPEAT else None
+    return _regex_widths[key]
+
+
+def regex_scan_start(regex, scan_from):
+    """
+    Return the index a regex must be re-run from to find every match ending after scan_from
+    """
+    if scan_from <= 0:
+        return 0
+    max_width = regex_max_width(regex)
+    if max_width is None:
+        return 0
+    return max(0, scan_from - max_width + 1)
+
+
+def combine_regexes(regex_list):
+    """
+    Join a list of compiled regexes into as few alternation regexes as possible.
+    Only regexes sharing the same flags and containing no backreferences are joined,
+    anything else (or any group which fails to compile) is returned unchanged.
+    """
+    key = tuple((regex.pattern, regex.flags) for regex in regex_list)
+    if key not in _combined_regexes:
+        by_flags = {}
+        combined = []
+        for regex in regex_list:
+            if _BACKREFERENCE.search(regex.pattern):
+                combined.append(regex)
+            else:
+                by_flags.setdefault(regex.flags, []).append(regex)
+
+        for flags, regexes in by_flags.iteritems():
+            if len(regexes) == 1:
+                combined.extend(regexes)
+                continue
+            try:
+                combined.append(re.compile('|'.join('(?:%s)' % regex.pattern for regex in regexes), flags))
+            except re.error:
+                combined.extend(regexes)
+
+        _combined_regexes[key] = combined
+    return _combined_regexes[key]
+
 
 class StringChunker(object):
     """
@@ -22,13 +105,19 @@ class StringChunker(object):
     data. In the process it aggregates data fragments into whole chunks and
     breaks apart collections of data segments so they can be broken into
     individual blocks.
+
+    Internally the buffer is a growable bytearray with a read cursor. Consumed
+    data is only compacted out of the bytearray once it makes up more than half
+    of the storage, so consuming a chunk does not copy the remaining buffer.
+    Timestamps are kept as a list of absolute stream offsets which is searched
+    with bisect and trimmed the same way as the buffer.
     """
+    # Minimum number of consumed bytes/timestamps before we bother compacting
+    _COMPACT_THRESHOLD = 4096
+
     def __init__(self, data_sieve_fn, max_buff_size=8192):
         """
         Initialize the buffer and indexing structures
-        The lists keep track of the start and stop index values (inclusive)
-        of the particular type in the data buffer. The lists are tuples with
-        (start, stop)
 
         @param data_sieve_fn A function that takes in a chunk of raw data (in
             whatever format is needed by the Chunker subclass) and spits out
@@ -39,13 +128,54 @@ class StringChunker(object):
             If no data is present, return and empty list. If multiple data
             blocks are found, the returned list will contain multiple tuples,
             IN SEQUENTIAL ORDER and WITHOUT OVERLAP.
+
+            A sieve function may optionally be marked incremental with the
+            incremental_sieve decorator. Incremental sieves are also
+            passed scan_from, the index of the first byte they have not been
+            shown before, and only need to report matches ending after it.
+            They are handed a read-only buffer over the pending data rather
+            than a str, so the pending data is not copied on every add_chunk.
         """
         self.sieve = data_sieve_fn
         self.max_buff_size = max_buff_size
+        self._incremental = is_incremental_sieve(data_sieve_fn)
+
+        self.chunks = deque()
+        self._reset()
+
+    def _reset(self):
+        # raw storage, the first _head bytes have already been consumed
+        self._data = bytearray()
+        self._head = 0
+        # absolute stream offset of self._data[self._head]
+        self._offset = 0
+        # absolute stream offset up to which the sieve has seen the data
+        self._scanned = 0
+        # absolute start offsets and timestamps of each added chunk
+        self._time_starts = []
+        self._time_values = []
+        self._time_head = 0
+
+    @property
+    def buffer(self):
+        """
+        The unconsumed contents of the buffer
+        """
+        return str(self._data[self._head:])
 
-        self.buffer = ""
-        self.timestamps = []
-        self.chunks = []
+    @property
+    def timestamps(self):
+        """
+        List of (start, stop, timestamp) for each raw chunk still (partially)
+        present in the buffer, with indexes relative to the start of the buffer
+        """
+        end = self._offset + len(self._data) - self._head
+        starts = self._time_starts
+        result = []
+        for index in xrange(self._time_head, len(starts)):
+            stop = starts[index + 1] if index + 1 < len(starts) else end
+            result.append((starts[index] - self._offset, stop - self._offset, self._time_values[index]))
+        return result
 
     def add_chunk(self, raw_data, timestamp):
         """
@@ -53,37 +183,36 @@ class StringChunker(object):
         @param raw_data Input data (string)
         @param timestamp The time (in NTP4 float format) that the data was collected at the port agent
         """
-        start_index = len(self.buffer)
-        end_index = start_index + len(raw_data)
+        if not raw_data:
+            return
+
+        buffered = len(self._data) - self._head
+        end_index = buffered + len(raw_data)
 
         # check the size of the buffer. If we have exceeded max_buff_size then drop the oldest data.
         if end_index > self.max_buff_size:
             oversize = end_index - self.max_buff_size
             log.warn('Chunker buffer has grown beyond specified limit (%d), truncating %d bytes',
                      self.max_buff_size, oversize)
+            self._consume(min(oversize, buffered))
 
-            self._rebase_times(oversize)
-            self.buffer = self.buffer[oversize:]
-            start_index -= oversize
-            end_index -= oversize
-
-        self.timestamps.append((start_index, end_index, timestamp))
-        self.buffer += raw_data
+        self._time_starts.append(self._offset + len(self._data) - self._head)
+        self._time_values.append(timestamp)
+        self._data.extend(raw_data)
         self._make_chunks()
 
     def get_next_data(self):
         """
         Yield a chunk (timestamp, data) if there are any available
         """
-        if len(self.chunks) == 0:
+        if not self.chunks:
             return None, None
 
-        return self.chunks.pop(0)
+        return self.chunks.popleft()
 
     def clean(self):
-        self.chunks = []
-        self.timestamps = []
-        self.buffer = ''
+        self.chunks.clear()
+        self._reset()
 
     @staticmethod
     def _prune_overlaps(results):
@@ -114,57 +243,92 @@ class StringChunker(object):
         """
         Given an index into the buffer, find the corresponding timestamp
         """
-        for start, stop, timestamp in self.timestamps:
-            if start <= index < stop:
-                return timestamp
-        log.error('Failed to find timestamp for chunk!')
-        return 0
+        position = bisect.bisect_right(self._time_starts, self._offset + index, self._time_head) - 1
+        if position < self._time_head or index >= len(self._data) - self._head:
+            log.error('Failed to find timestamp for chunk!')
+            return 0
+        return self._time_values[position]
 
     def _rebase_times(self, index):
         """
-        Buffer is going to be pruned, adjust all timestamp indexes to match
+        Buffer is going to be pruned, drop all timestamps which end before index
         """
-        new_times = []
-        for start, stop, timestamp in self.timestamps:
-            if stop <= index:
-                continue
-            start -= index
-            stop -= index
-            new_times.append((start, stop, timestamp))
-        self.timestamps = new_times
+        new_offset = self._offset + index
+        position = bisect.bisect_right(self._time_starts, new_offset, self._time_head) - 1
+        # an index at the very end of the buffer drops every timestamp
+        if index >= len(self._data) - self._head:
+            position = len(self._time_starts)
+        self._time_head = max(position, self._time_head)
+
+        if self._time_head > self._COMPACT_THRESHOLD and self._time_head * 2 > len(self._time_starts):
+            del self._time_starts[:self._time_head]
+            del self._time_values[:self._time_head]
+            self._time_head = 0
+
+    def _consume(self, count):
+        """
+        Drop count bytes from the front of the buffer
+        """
+        self._rebase_times(count)
+        self._head += count
+        self._offset += count
+        self._scanned = max(self._scanned, self._offset)
+
+        if self._head == len(self._data):
+            del self._data[:]
+            self._head = 0
+        elif self._head > self._COMPACT_THRESHOLD and self._head * 2 > len(self._data):
+            del self._data[:self._head]
+            self._head = 0
 
     def _make_chunks(self):
         """
         Run the buffer through our sieve function. Generate a chunk (timestamp, data) for
         each non-overlapping result found. Prune the buffer to the index of the last found data.
         """
-        results = sorted(self.sieve(self.buffer))
-        results = self._prune_overlaps(results)
+        if self._incremental:
+            # slicing the view copies only the chunks found
+            raw_data = buffer(self._data, self._head)
+            results = self.sieve(raw_data, scan_from=self._scanned - self._offset)
+        else:
+            raw_data = self.buffer
+            results = self.sieve(raw_data)
+        self._scanned = self._offset + len(raw_data)
+
+        results = self._prune_overlaps(sorted(results))
 
         end = 0
         for start, end in results:
-            chunk = self.buffer[start:end]
+            chunk = raw_data[start:end]
             timestamp = self._find_timestamp(start)
             self.chunks.append((timestamp, chunk))
 
         if end > 0:
-            self._rebase_times(end)
-            self.buffer = self.buffer[end:]
+            self._consume(end)
 
     @staticmethod
-    def regex_sieve_function(raw_data, regex_list=None):
+    @incremental_sieve
+    def regex_sieve_function(raw_data, regex_list=None, scan_from=0, combine=False):
         """
         Generate a sieve function given a list of regexes.
         Intended to be used with partial function application, as so:
         StringChunker(partial(self._chunker.regex_sieve_function, regex_list=[regex]))
         @param raw_data The raw data to run through this regex sieve
         @param regex_list a list of pre-compiled regexes
+        @param scan_from Index of the first byte of raw_data not seen by a
+            previous call, only matches ending after this index are returned
+        @param combine If True, scan all regexes in a single pass using one
+            alternation. Where two regexes match at the same position the one
+            earlier in the list wins.
         @retval A list of (start, end) tuples for each match the regexs find
         """
         return_list = []
         if regex_list is not None:
+            if combine:
+                regex_list = combine_regexes(regex_list)
             for matcher in regex_list:
-                for match in matcher.finditer(raw_data):
-                    return_list.append((match.start(), match.end()))
+                for match in matcher.finditer(raw_data, regex_scan_start(matcher, scan_from)):
+                    if match.end() > scan_from:
+                        return_list.append((match.start(), match.end()))
 
         return return_list
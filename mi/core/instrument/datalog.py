@@ -0,0 +1,128 @@
+"""
+@package mi.core.instrument.datalog
+@file mi/core/instrument/datalog.py
+@brief Fast reader for port agent datalog files
+
+The datalog is memory mapped and scanned for sync markers with mmap.find,
+skipping straight over the payload of each packet found. Packets are
+gathered in blocks and, if asked for, their checksums validated in a single
+numpy reduction per block. Headers and payloads are returned as memoryviews
+into the mapped file, nothing is copied until the caller asks for it. The
+file is unmapped when the generator finishes, so the views must be copied
+(e.g. with tobytes) to be kept after that.
+"""
+import mmap
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from mi.core.log import get_logger
+
+__license__ = 'Apache 2.0'
+
+log = get_logger()
+
+SYNC = '\xa3\x9d\x7a'
+# sync, packet type, packet size (including header), checksum, timestamp upper, timestamp lower
+HEADER_FORMAT = '>3sBHHII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+BLOCK_PACKETS = 4096
+
+DatalogPacket = namedtuple('DatalogPacket', 'offset packet_type time header payload')
+
+
+def map_file(file_handle):
+    """
+    Return the contents of an open file as a read-only uint8 array backed by mmap.
+    The array keeps the mapping alive as long as any view of it exists.
+    """
+    file_handle.seek(0, 2)
+    if file_handle.tell() == 0:
+        # empty files can not be mapped
+        return np.zeros(0, dtype=np.uint8)
+    mapped = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+    return np.frombuffer(mapped, dtype=np.uint8)
+
+
+def _scan(data, position, max_packets, validate):
+    """
+    Find up to max_packets candidate packets starting at position.
+    Returns the list of (offset, packet type, packet size, time) and the
+    position following the last packet.
+    """
+    mapped = data.base
+    size = len(data)
+    found = []
+    while len(found) < max_packets:
+        index = mapped.find(SYNC, position)
+        if index == -1 or index + HEADER_SIZE > size:
+            position = size
+            break
+
+        _, packet_type, packet_size, _, upper, lower = struct.unpack_from(HEADER_FORMAT, mapped, index)
+        if packet_size < HEADER_SIZE or index + packet_size > size:
+            if not validate and packet_size >= HEADER_SIZE:
+                # truncated packet at the end of the file
+                position = size
+                break
+            # not a real header, resume the search after this sync
+            position = index + 1
+            continue
+
+        found.append((index, packet_type, packet_size, upper + float(lower) / 2 ** 32))
+        position = index + packet_size
+    return found, position
+
+
+def _first_invalid(data, found):
+    """
+    Return the index of the first packet in found with a bad checksum, or None.
+    The LRC of a valid packet (header and payload) is zero.
+    """
+    if not found:
+        return None
+    bounds = np.empty(2 * len(found), dtype=np.intp)
+    bounds[0::2] = [offset for offset, _, _, _ in found]
+    bounds[1::2] = [offset + packet_size for offset, _, packet_size, _ in found]
+    # reduceat runs from each bound to the next, the last one to the end of the slice
+    lrc = np.bitwise_xor.reduceat(data[:bounds[-1]], bounds[:-1])[0::2]
+    bad = np.flatnonzero(lrc)
+    return bad[0] if len(bad) else None
+
+
+def read_packets(file_handle, packet_types=None, validate=False, block_packets=BLOCK_PACKETS):
+    """
+    Generate a DatalogPacket for each packet in an open datalog file.
+    The header and payload views are only valid until the generator finishes.
+    @param packet_types only packets of these types are returned (all if None)
+    @param validate skip packets whose checksum does not match, resynchronising
+                    on the next sync marker. Off by default, playback has always
+                    delivered packets whatever their checksum.
+    """
+    data = map_file(file_handle)
+    position = 0
+    invalid = 0
+    try:
+        while position < len(data):
+            found, next_position = _scan(data, position, block_packets, validate)
+            if validate:
+                bad = _first_invalid(data, found)
+                if bad is not None:
+                    invalid += 1
+                    log.debug('Invalid checksum in packet at offset %d', found[bad][0])
+                    next_position = found[bad][0] + 1
+                    found = found[:bad]
+
+            for offset, packet_type, packet_size, packet_time in found:
+                if packet_types is None or packet_type in packet_types:
+                    view = memoryview(data[offset:offset + packet_size])
+                    yield DatalogPacket(offset, packet_type, packet_time, view[:HEADER_SIZE], view[HEADER_SIZE:])
+            position = next_position
+    finally:
+        # the mapping, None for an empty file
+        if data.base is not None:
+            data.base.close()
+
+    if invalid:
+        log.warn('Skipped %d invalid packets in %s', invalid, getattr(file_handle, 'name', file_handle))
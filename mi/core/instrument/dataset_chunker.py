@@ -11,9 +11,13 @@
 __author__ = 'Steve Foley'
 __license__ = 'Apache 2.0'
 
+import bisect
+from collections import deque
+
 from mi.core.log import get_logger ; log = get_logger()
 
 from mi.core.exceptions import SampleException
+from mi.core.instrument.chunker import combine_regexes, incremental_sieve, is_incremental_sieve, regex_scan_start
 
 class Chunker(object):
     """
@@ -22,7 +26,15 @@ class Chunker(object):
     data. In the process it aggregates data fragments into whole chunks and
     breaks apart collections of data segments so they can be broken into
     individual blocks.
+
+    All bookkeeping is done in absolute offsets from the start of the stream,
+    so removing data from the front of the buffer never has to rebase the
+    chunk lists. Indices handed out by the get_next_* methods are still
+    relative to the start of the current buffer.
     """
+    # Minimum number of consumed bytes/raw chunks before we bother compacting
+    _COMPACT_THRESHOLD = 4096
+
     def __init__(self, data_sieve_fn):
         """
         Initialize the buffer and indexing structures 
@@ -41,82 +53,119 @@ class Chunker(object):
             IN SEQUENTIAL ORDER and WITHOUT OVERLAP.
         """
         self.sieve = data_sieve_fn
-        
-        self.raw_chunk_list = []
-        self.data_chunk_list = []
-        self.nondata_chunk_list = []
-        
-        """ To be filled out by the subclass """
-        self.buffer = None
-        
+        self._incremental = is_incremental_sieve(data_sieve_fn)
+
+        # raw storage, the first _head bytes have already been consumed
+        self._data = bytearray()
+        self._head = 0
+        # absolute offset of the start of the buffer
+        self._base = 0
+        # absolute offset up to which the sieve has already seen the data
+        self._scanned = 0
+
+        # raw chunks, entries before _raw_head have been removed
+        self._raw_starts = []
+        self._raw_ends = []
+        self._raw_times = []
+        self._raw_head = 0
+
+        # (start, end, timestamp) in absolute offsets
+        self._data_chunks = deque()
+        self._nondata_chunks = deque()
+
+    @property
+    def buffer(self):
+        """
+        The unconsumed contents of the buffer
+        """
+        return bytes(self._data[self._head:])
+
+    @property
+    def raw_chunk_list(self):
+        return [(max(self._raw_starts[i], self._base) - self._base, self._raw_ends[i] - self._base,
+                 self._raw_times[i]) for i in xrange(self._raw_head, len(self._raw_ends))]
+
+    @property
+    def data_chunk_list(self):
+        return [(s - self._base, e - self._base, t) for (s, e, t) in self._data_chunks]
+
+    @property
+    def nondata_chunk_list(self):
+        return [(s - self._base, e - self._base, t) for (s, e, t) in self._nondata_chunks]
+
+    @property
+    def _end(self):
+        """
+        Absolute offset of the end of the buffer
+        """
+        return self._base + len(self._data) - self._head
+
+    def _slice(self, start, end):
+        """
+        Return the buffer contents between two absolute offsets
+        """
+        offset = self._head - self._base
+        return bytes(self._data[start + offset:end + offset])
+
     def add_chunk(self, raw_data, timestamp):
         """
         Adds a chunk of data to the end of the buffer, includes the new indices
-        in the raw_chunk_list. This base class method handles strings and lists.
-        Improve or subclass for more capabilities.
+        in the raw_chunk_list.
         
-        @param raw_data The bunch of raw data as a list (or something that can be
-            treated as a list...like a string)
+        @param raw_data The bunch of raw data as a string (or anything
+            supporting the buffer interface)
         @param timestamp The time (in NTP4 float format) that the data was
             collected at the port agent
         """
-        assert isinstance(self.buffer, str) or isinstance(self.buffer, list)
         assert isinstance(timestamp, float)
         # Append raw
-        start_index = len(self.buffer)
-        
-        if self.data_chunk_list == []:
-            last_data_index = 0
+        start_index = self._end
+
+        if self._data_chunks:
+            last_data_index = self._data_chunks[-1][1]
         else:
-            last_data_index = self.data_chunk_list[-1][1] 
+            last_data_index = self._base
         end_index = start_index + len(raw_data)
-        
-        if isinstance(self.buffer, str):
-            self.buffer += raw_data
-        else:
-            self.buffer.append(raw_data)
-            
-        self.raw_chunk_list.append((start_index, end_index, timestamp))
+
+        self._data.extend(raw_data)
+        self._raw_starts.append(start_index)
+        self._raw_ends.append(end_index)
+        self._raw_times.append(timestamp)
 
         # find data
         result = self._generate_data_lists(timestamp,
                                            start_index=last_data_index)
-        assert result != None
-        
-        # rebase onto existing buffer
+
+        nondata = self._nondata_chunks
         for (s, e, t) in result['data_chunk_list']:
-            self.data_chunk_list.append((s, e, t))
-        
-            # remove first fragment part from non-data array if we completed a fragment
-            for (nds, nde, ndt) in self.nondata_chunk_list:
-                if (nds == s):
-                    self.nondata_chunk_list.remove((nds, nde, ndt))
-        
-        # splice non-data blocks in, combining with
-        # other blocks as needed
-        if result['non_data_chunk_list'] != []:
-            new_nondata_list = []
-            (first_new_s, first_new_e, first_new_t) = result['non_data_chunk_list'][0]
-            
-            if self.nondata_chunk_list == []:
-                self.nondata_chunk_list = result['non_data_chunk_list']
-                log.debug("Added chunk, data_chunk_list: %s, nondata_chunk_list: %s",
-                      self.data_chunk_list, self.nondata_chunk_list)
-                return
-            for (s, e, t) in self.nondata_chunk_list:
-                if e >= first_new_s:
-                    new_nondata_list.append((s, first_new_e, t))
-                    result['non_data_chunk_list'].pop(0) # already used it
+            self._data_chunks.append((s, e, t))
+
+            # remove first fragment part from non-data array if we completed a fragment,
+            # it can only be in the non-data after the last data block
+            for index in xrange(len(nondata) - 1, -1, -1):
+                if nondata[index][0] < s:
                     break
-                if e < first_new_s:
-                    new_nondata_list.append((s, e, t))
-            # all done, merging, so add the rest of what is left
-            new_nondata_list.extend(result['non_data_chunk_list'])
-            
-            self.nondata_chunk_list = new_nondata_list
-            log.debug("Added chunk, data_chunk_list: %s, nondata_chunk_list: %s",
-                      self.data_chunk_list, self.nondata_chunk_list)
-         
+                if nondata[index][0] == s:
+                    del nondata[index]
+                    break
+
+        # splice non-data blocks in, combining the first new block with an
+        # existing block that runs into it
+        new_nondata = result['non_data_chunk_list']
+        if new_nondata:
+            (first_new_s, first_new_e, first_new_t) = new_nondata[0]
+
+            merged = None
+            while nondata and nondata[-1][1] >= first_new_s:
+                merged = nondata.pop()
+            if merged is not None:
+                nondata.append((merged[0], first_new_e, merged[2]))
+                new_nondata = new_nondata[1:]
+            nondata.extend(new_nondata)
+
+        log.trace("Added chunk, data_chunk_list: %s, nondata_chunk_list: %s",
+                  self._data_chunks, self._nondata_chunks)
+
     def _generate_data_lists(self, timestamp, start_index=0):
         """
         From some starting place in the raw data buffer, go through and
@@ -125,33 +174,37 @@ class Chunker(object):
         @param timestamp The timestamp to use if an empty non_data_chunk list
             is encountered. Essentially the timestamp to use for a fragment or
             other non-data chunk that is being entered for the first time.
-        @param start_index The beginning index to start generating lists from.
-            Default is the beginning of the buffer
+        @param start_index The absolute offset to start generating lists from.
         @retval A dict with keys "data_chunk_list" and "non_data_chunk_list"
             that include the full data chunk lists for this block of data.
-            Indices are respect to the buffer, not the chunk
+            Indices are absolute offsets, not respect to the chunk
         """
-        log.debug("Generating data lists with start index %s", start_index)
+        log.trace("Generating data lists with start index %s", start_index)
         return_list = {'data_chunk_list':[], 'non_data_chunk_list':[]}
-        result = self.sieve(self.buffer[start_index:])
+        if self._incremental:
+            # a view of the buffer, sieving a long run of non-data does not copy it each time
+            raw_data = buffer(self._data, start_index - self._base + self._head)
+            result = self.sieve(raw_data, scan_from=max(0, self._scanned - start_index))
+        else:
+            result = self.sieve(self._slice(start_index, self._end))
+        self._scanned = self._end
         # assert no overlap!
         if (self.overlaps(result)):
             raise SampleException("Overlapping blocks in sieve list: %s" % result)
         # sort to protect us from some sloppy sieve code
         result.sort()
 
-        # rebase to buffer coordinates
+        # rebase to absolute offsets
         return_list['data_chunk_list'] = [(s+start_index, e+start_index) for (s, e) in result]
         return_list['data_chunk_list'] = self.add_timestamps(return_list['data_chunk_list'])
-        # Look up the timestamps from the old list - could be made more efficient
-        
+
         if result == []:
             return_list['non_data_chunk_list'].append((start_index,
-                                                       len(self.buffer),
+                                                       self._end,
                                                        timestamp))
         previous_end = start_index
         for (s, e) in result:
-            # rebase to buffer as long as we are walking through
+            # rebase to absolute offsets as long as we are walking through
             s += start_index
             e += start_index
             assert(s >= previous_end)
@@ -162,13 +215,13 @@ class Chunker(object):
                 previous_end = e
 
         return_list['non_data_chunk_list'] = self.add_timestamps(return_list['non_data_chunk_list'])
-        log.debug("Generated return list: %s", return_list)
+        log.trace("Generated return list: %s", return_list)
         return return_list    
     
     def add_timestamps(self, start_end_list):
         """
         Add timestamps to a list of (start, end) tuples that are normalized to
-        coincide with the raw block list indices.
+        coincide with the raw block list offsets.
         
         @param start_end_list The list of (start, end) tuples such as:
             [(15, 20), (35, 37)]
@@ -188,13 +241,11 @@ class Chunker(object):
                 (s, e) = (item[0], item[1])
             else:
                 raise SampleException("Invalid pair encountered!")
-                
-            for (raw_s, raw_e, raw_t) in self.raw_chunk_list:
-                if (s >= raw_e):
-                    continue
-                else:
-                    result_list.append((s, e, raw_t))
-                    break
+
+            # first raw block ending after the start
+            index = bisect.bisect_right(self._raw_ends, s, self._raw_head)
+            if index < len(self._raw_ends):
+                result_list.append((s, e, self._raw_times[index]))
                     
         log.trace("add_timestamp returning result_list: %s", result_list)
         return result_list
@@ -248,125 +299,112 @@ class Chunker(object):
             float format and data chunk is a section of buffer with indices
             between (start, end). If no data, returns (None, None, None, None)
         """
-        if self.data_chunk_list == []:
+        return self._get_next_with_index(self._data_chunks, clean)
+
+    def get_next_non_data_with_index(self, clean=True):
+        """
+        Get the next chunk of non-data from the buffer, clearing all that comes
+        before it. Default behavior is to clear the buffer before and including
+        this data.
+        
+        @param clean Remove the buffer contents before and including this data
+        @return A tuple of (timestamp, data_chunk, next_start, next_end) 
+            where timestamp is in NTP4 float format and data chunk is a 
+            (start, end) tuple, (None, None) if no data
+        """
+        return self._get_next_with_index(self._nondata_chunks, clean)
+
+    def _get_next_with_index(self, chunks, clean):
+        """
+        Return the first entry of a chunk deque, cleaning up to the end of it if requested
+        """
+        if not chunks:
             return (None, None, None, None)
 
-        if clean:    
-            (next_start, next_end, timestamp) = self.data_chunk_list.pop(0)
+        if clean:
+            (next_start, next_end, timestamp) = chunks.popleft()
         else:
-            (next_start, next_end, timestamp) = self.data_chunk_list[0]
-        
-        next_block = self.buffer[next_start:next_end]
+            (next_start, next_end, timestamp) = chunks[0]
 
-        if clean:    
+        next_block = self._slice(next_start, next_end)
+        base = self._base
+
+        if clean:
             self._clean_buffer(next_end)
-            self.raw_chunk_list = self._clean_chunk_list(self.raw_chunk_list,
-                                                         next_end)
-            self.data_chunk_list = self._clean_chunk_list(self.data_chunk_list,
-                                                         next_end)
-            self.nondata_chunk_list = self._clean_chunk_list(self.nondata_chunk_list,
-                                                             next_end)
-                
-        return (timestamp, next_block, next_start, next_end)
-    
-    def _clean_chunk_list(self, list, end_index):
+            self._clean_raw_list(next_end)
+            self._clean_chunk_list(self._data_chunks, next_end)
+            self._clean_chunk_list(self._nondata_chunks, next_end)
+
+        return (timestamp, next_block, next_start - base, next_end - base)
+
+    @staticmethod
+    def _clean_chunk_list(chunks, end_index):
         """
-        Cleans up the given chunk list based on the start and end indexes of
-        that are being removed. The idea is to keep the given list of indices
-        in sync with other lists that are having elements removed from them.
-        For example, if the list looks like
+        Cleans up the given chunk deque in place, removing everything before
+        the given absolute offset. Blocks straddling the offset are trimmed to
+        start at it. For example, if the deque looks like
         [(3, 5, time), (8, 12, time), (20, 25, time)]
-        and the end index is 10, the resulting list will be:
-        [(0, 2, time), (10, 15, time)]
-        as items up to 10 have been removed (only [10:25] remain)
-        and popped off the front so they are now [0:2] and [10:15].
+        and the end index is 10, the resulting deque will be:
+        [(10, 12, time), (20, 25, time)]
         
-        @param list A list of (start, end) tuples of indices that needs to be
-            cleaned up.
-        @param end_index The end index of what is being removed.
-        @retval The new list after it has been cleaned
+        @param chunks A deque of (start, end, time) tuples sorted by offset
+        @param end_index The absolute offset of the end of what is being removed.
         """
-        return_list = []
-        for (s, e, time) in list:
-            if s >= end_index:
-                return_list.append((s-end_index, e-end_index, time))
-            else:
-                if e > end_index:
-                    return_list.append((0,e-end_index, time))
-        return return_list
+        while chunks and chunks[0][1] <= end_index:
+            chunks.popleft()
+        if chunks and chunks[0][0] < end_index:
+            (s, e, time) = chunks.popleft()
+            chunks.appendleft((end_index, e, time))
+
+    def _clean_raw_list(self, end_index):
+        """
+        Drop raw chunks which end before the given absolute offset
+        """
+        self._raw_head = max(self._raw_head, bisect.bisect_right(self._raw_ends, end_index, self._raw_head))
+
+        if self._raw_head > self._COMPACT_THRESHOLD and self._raw_head * 2 > len(self._raw_ends):
+            del self._raw_starts[:self._raw_head]
+            del self._raw_ends[:self._raw_head]
+            del self._raw_times[:self._raw_head]
+            self._raw_head = 0
     
-    def _clean_data_list(self, index):
+    def _clean_data_list(self, end_index):
         """
         Clean up the data list in place so that it, if a fragment is consumed
         by a get_next_raw call, the data chunk is remove and added back to the
         non-data list.
         
-        @param index The index that things are being cleared up to
-        """
-        new_nondata_list = []
-
-        log.debug("Cleaning data chunk, data_chunk_list: %s, nondata_chunk_list: %s",
-                  self.data_chunk_list, self.nondata_chunk_list)
-
-        for (s, e, t) in self.data_chunk_list:
-            if (e <= index):
-                self.data_chunk_list.remove((s, e, t))
-                
-            if (e > index):
-                self.data_chunk_list.remove((s, e, t))
-                # add remaining to non data
-                for (nds, nde, ndt) in self.nondata_chunk_list:
-                    if (nde < s):
-                        new_nondata_list.append((nds, nde, ndt))
-                    elif (nde == s):
-                        new_nondata_list.append((nds, e, ndt))
-                    elif (nde > s):
-                        new_nondata_list.append((nds, nde, ndt))
-        
-        self.nondata_chunk_list = new_nondata_list
-    
+        @param end_index The absolute offset that things are being cleared up to
+        """
+        while self._data_chunks and self._data_chunks[0][1] <= end_index:
+            self._data_chunks.popleft()
+
+        if self._data_chunks and self._data_chunks[0][0] < end_index:
+            (s, e, t) = self._data_chunks.popleft()
+            nondata = self._nondata_chunks
+            if nondata and nondata[0][0] == e:
+                (nds, nde, ndt) = nondata.popleft()
+                e = nde
+            nondata.appendleft((end_index, e, t))
+
     def _clean_buffer(self, end_index):
         """
         Clean up the buffer only...usually followed by some list cleaning
-        @param end_index the last index used...clean up to here
+        @param end_index the absolute offset of the last byte used...clean up to here
         """
-        # Clean up buffer
-        if isinstance(self.buffer, str):
-            self.buffer = self.buffer[end_index:]
-        else:
-            self.buffer[0:end_index] = []
-        
-    def get_next_non_data_with_index(self, clean=True):
-        """
-        Get the next chunk of non-data from the buffer, clearing all that comes
-        before it. Default behavior is to clear the buffer before and including
-        this data.
-        
-        @param clean Remove the buffer contents before and including this data
-        @return A tuple of (timestamp, data_chunk, next_start, next_end) 
-            where timestamp is in NTP4 float format and data chunk is a 
-            (start, end) tuple, (None, None) if no data
-        """
-        if self.nondata_chunk_list == []:
-            return (None, None, None, None)
-
-        if clean:    
-            (next_start, next_end, next_time) = self.nondata_chunk_list.pop(0)
-        else:
-            (next_start, next_end, next_time) = self.nondata_chunk_list[0]
-        
-        next_block = self.buffer[next_start:next_end]
+        count = end_index - self._base
+        if count <= 0:
+            return
+        self._head += count
+        self._base = end_index
+        self._scanned = max(self._scanned, self._base)
 
-        if clean:    
-            self._clean_buffer(next_end)
-            self.raw_chunk_list = self._clean_chunk_list(self.raw_chunk_list,
-                                                         next_end)
-            self.data_chunk_list = self._clean_chunk_list(self.data_chunk_list,
-                                                         next_end)
-            self.nondata_chunk_list = self._clean_chunk_list(self.nondata_chunk_list,
-                                                             next_end)
-                        
-        return (next_time, next_block, next_start, next_end)
+        if self._head == len(self._data):
+            del self._data[:]
+            self._head = 0
+        elif self._head > self._COMPACT_THRESHOLD and self._head * 2 > len(self._data):
+            del self._data[:self._head]
+            self._head = 0
 
     def get_next_non_data(self, clean=True):
         """
@@ -393,23 +431,23 @@ class Chunker(object):
             float format and data chunk is a (start, end) tuple,
             (None, None) if empty list
         """
-        if self.raw_chunk_list == []:
+        if self._raw_head == len(self._raw_ends):
             return (None, None)
 
-        if clean:    
-            (next_start, next_end, next_time) = self.raw_chunk_list.pop(0)
-        else:
-            (next_start, next_end, next_time) = self.raw_chunk_list[0]
-        
-        next_block = self.buffer[next_start:next_end]
+        index = self._raw_head
+        next_start = max(self._raw_starts[index], self._base)
+        next_end = self._raw_ends[index]
+        next_time = self._raw_times[index]
+
+        next_block = self._slice(next_start, next_end)
 
         if clean:
             self._clean_buffer(next_end)
-            self.raw_chunk_list = self._clean_chunk_list(self.raw_chunk_list,
-                                                         next_end)
+            self._clean_raw_list(next_end)
+            self._clean_chunk_list(self._nondata_chunks, next_end)
             self._clean_data_list(next_end)
-            self.nondata_chunk_list = self._clean_chunk_list(self.nondata_chunk_list,
-                                                             next_end)
+            # data chunks may have been dropped, rescan everything next time
+            self._scanned = self._base
 
         return (next_time, next_block)
 
@@ -417,21 +455,15 @@ class Chunker(object):
         """
         Clean all data out of the non_data, raw, and data lists
         """
-        # clear out any non matching data.
-        (nd_timestamp, non_data) = self.get_next_non_data(clean=True)
-        while non_data is not None:
-            (nd_timestamp, non_data) = self.get_next_non_data(clean=True)
-        # clean out raw data
-        (nd_timestamp, raw_data) = self.get_next_raw(clean=True)
-        while raw_data is not None:
-            (nd_timestamp, raw_data) = self.get_next_raw(clean=True)
-        # clean out data
-        (nd_timestamp, data) = self.get_next_data(clean=True)
-        while data is not None:
-            (nd_timestamp, data) = self.get_next_data(clean=True)
+        end_index = self._end
+        self._clean_buffer(end_index)
+        self._clean_raw_list(end_index)
+        self._data_chunks.clear()
+        self._nondata_chunks.clear()
 
     @staticmethod
-    def regex_sieve_function(raw_data, regex_list=[]):
+    @incremental_sieve
+    def regex_sieve_function(raw_data, regex_list=[], scan_from=0, combine=False):
         """
         Simple method to take a list of regexes to use in a sieve and run the
         incoming data through them. Use this with functools.partial() to
@@ -441,16 +473,22 @@ class Chunker(object):
         @param raw_data The raw data to run through this regex sieve
         @param regex_list a list of pre-compiled regexes that will identify some
         flavor of a pattern in the raw data for matching.
+        @param scan_from Index of the first byte of raw_data not seen by a
+        previous call, only matches ending after this index are returned
+        @param combine If True, scan all regexes in a single alternation pass
         @retval A list of (start, end) tuples for each match the regexs find
         @use
         """
         return_list = []
     
         sieve_matchers = regex_list
+        if combine:
+            sieve_matchers = combine_regexes(regex_list)
         
         for matcher in sieve_matchers:
-            for match in matcher.finditer(raw_data):
-                return_list.append((match.start(), match.end()))
+            for match in matcher.finditer(raw_data, regex_scan_start(matcher, scan_from)):
+                if match.end() > scan_from:
+                    return_list.append((match.start(), match.end()))
     
         return return_list
 
@@ -460,17 +498,11 @@ class StringChunker(Chunker):
     A version of the chunker that handles a string buffer. Methods are tuned
     for easy interaction with strings instead of binary byte blocks.
     """
-    def __init__(self, data_sieve_fn):
-        Chunker.__init__(self, data_sieve_fn)
-        self.buffer = ""
     
     
 class BinaryChunker(Chunker):
     """
     A version of the chunker that handles a binary buffer and therefore
-    binary data blocks that fall out of it.
+    binary data blocks that fall out of it. Raw data may be anything
+    supporting the buffer interface (str, bytearray, memoryview).
     """
-    def __init__(self, data_sieve_fn):
-        Chunker.__init__(self, data_sieve_fn)
-        self.buffer = []
-    
\ No newline at end of file
@@ -11,6 +11,7 @@ the driver and agent. This involves a JSON interchange format
 import time
 import ntplib
 import base64
+import hashlib
 import json
 
 from mi.core.common import BaseEnum
@@ -102,6 +103,7 @@ class DataParticle(object):
 
         self.raw_data = raw_data
         self._values = None
+        self._thaw()
 
     def __eq__(self, arg):
         """
@@ -129,10 +131,11 @@ class DataParticle(object):
             log.debug('Timestamp %s does not match %s', t1, t2)
             return False
 
-        generated1 = json.loads(self.generate())
-        generated2 = json.loads(arg.generate())
-        missing, differing = self._compare(generated1, generated2, ignore_keys=[DataParticleKey.DRIVER_TIMESTAMP,
-                                                                                DataParticleKey.PREFERRED_TIMESTAMP])
+        ignore_keys = [DataParticleKey.DRIVER_TIMESTAMP, DataParticleKey.PREFERRED_TIMESTAMP]
+        if self.value_digest() == arg.value_digest():
+            ignore_keys.append(DataParticleKey.VALUES)
+
+        missing, differing = self._compare(self.freeze(), arg.freeze(), ignore_keys=ignore_keys)
         if missing:
             log.error('Key mismatch between particle dictionaries: %r', missing)
             return False
@@ -173,6 +176,7 @@ class DataParticle(object):
         #    raise InstrumentParameterException("invalid timestamp")
 
         self.contents[DataParticleKey.INTERNAL_TIMESTAMP] = float(timestamp)
+        self._thaw()
 
     def set_port_timestamp(self, timestamp=None, unix_time=None):
         """
@@ -192,6 +196,7 @@ class DataParticle(object):
             raise InstrumentParameterException("invalid timestamp")
 
         self.contents[DataParticleKey.PORT_TIMESTAMP] = float(timestamp)
+        self._thaw()
 
     def set_value(self, id, value):
         """
@@ -203,6 +208,7 @@ class DataParticle(object):
         """
         if (id == DataParticleKey.INTERNAL_TIMESTAMP) and (self._check_timestamp(value)):
             self.contents[DataParticleKey.INTERNAL_TIMESTAMP] = value
+            self._thaw()
         else:
             raise ReadOnlyException("Parameter %s not able to be set to %s after object creation!" %
                                     (id, value))
@@ -250,33 +256,73 @@ class DataParticle(object):
         @retval A python dictionary with the proper timestamps and data values
         @throws InstrumentDriverException if there is a problem wtih the inputs
         """
+        return dict(self.freeze())
+
+    def generate(self, sorted=False):
+        """
+        Generates a JSON_parsed packet from a sample dictionary of sensor data and
+        associates a timestamp with it
+
+        @param sorted Returned sorted json dict, useful for testing, but slow,
+           so dont do it unless it is important
+        @return A JSON_raw string, properly structured with port agent time stamp
+           and driver timestamp
+        @throws InstrumentDriverException If there is a problem with the inputs
+        """
+        frozen = self.freeze()
+        json_result = self._json.get(sorted)
+        if json_result is None:
+            json_result = self._json[sorted] = json.dumps(frozen, sort_keys=sorted)
+        return json_result
+
+    def freeze(self):
+        """
+        Build the particle values and structure, once. The structure and any
+        JSON generated from it are cached until a timestamp is set or the
+        contents are otherwise changed.
+
+        @retval The cached particle dictionary, which must not be modified
+        @throws InstrumentDriverException if there is a problem wtih the inputs
+        """
+        if self._frozen is not None and self._frozen_contents == self.contents:
+            return self._frozen
+
         # verify preferred timestamp exists in the structure...
         if not self._check_preferred_timestamps():
             raise SampleException("Preferred timestamp not in particle!")
 
         # build response structure
-        self._encoding_errors = []
         if self._values is None:
+            self._encoding_errors = []
             self._values = self._build_parsed_values()
         result = self._build_base_structure()
         result[DataParticleKey.STREAM_NAME] = self.data_particle_type()
         result[DataParticleKey.VALUES] = self._values
 
+        self._frozen = result
+        self._frozen_contents = dict(self.contents)
+        self._json = {}
         return result
 
-    def generate(self, sorted=False):
+    def value_digest(self):
         """
-        Generates a JSON_parsed packet from a sample dictionary of sensor data and
-        associates a timestamp with it
+        Return a digest of the particle values (timestamps are not included),
+        so particles can be checked for changed values without comparing them
+        value by value
+        """
+        if self._digest is None:
+            self.freeze()
+            self._digest = hashlib.sha1(repr(self._values)).hexdigest()
+        return self._digest
 
-        @param sorted Returned sorted json dict, useful for testing, but slow,
-           so dont do it unless it is important
-        @return A JSON_raw string, properly structured with port agent time stamp
-           and driver timestamp
-        @throws InstrumentDriverException If there is a problem with the inputs
+    def _thaw(self):
         """
-        json_result = json.dumps(self.generate_dict(), sort_keys=sorted)
-        return json_result
+        Discard the cached particle structure and JSON
+        """
+        self._frozen = None
+        self._frozen_contents = None
+        self._json = {}
+        self._digest = None
 
     def _build_parsed_values(self):
         """
@@ -8,11 +8,10 @@ Release notes:
 initial release
 """
 import cPickle as pickle
-import json
 
 import numpy as np
-import pandas as pd
-import xarray as xr
+from mi.core.instrument.chunked_writer import chunked_writer
+from mi.core.instrument.particle_accumulator import ParticleAccumulator
 from mi.core.instrument.publisher import Publisher
 from mi.logging import log
 
@@ -23,11 +22,8 @@ class CountPublisher(Publisher):
         self.total = 0
 
     def _publish(self, events, headers):
-        for e in events:
-            try:
-                json.dumps(e)
-            except (ValueError, UnicodeDecodeError) as err:
-                log.exception('Unable to publish event: %r %r', e, err)
+        # encoding logs any events which could not be published
+        self.encode(events)
         count = len(events)
         self.total += count
         log.info('Publish %d events (%d total)', count, self.total)
@@ -36,14 +32,7 @@ class CountPublisher(Publisher):
 class FilePublisher(Publisher):
     def __init__(self, *args, **kwargs):
         super(FilePublisher, self).__init__(*args, **kwargs)
-        self.samples = {}
-
-    @staticmethod
-    def _flatten(sample):
-        values = sample.pop('values')
-        for each in values:
-            sample[each['value_id']] = each['value']
-        return sample
+        self.particles = ParticleAccumulator()
 
     def _publish(self, events, headers):
         for event in events:
@@ -54,34 +43,13 @@ class FilePublisher(Publisher):
             particle = event.get('value', {})
             stream = particle.get('stream_name')
             if stream:
-                particle = self._flatten(particle)
-                self.samples.setdefault(stream, []).append(particle)
+                self.particles.add_particle(stream, particle)
 
     def to_dataframes(self):
-        data_frames = {}
-        for particle_type in self.samples:
-            data_frames[particle_type] = self.fix_arrays(pd.DataFrame(self.samples[particle_type]))
-        return data_frames
+        return self.particles.to_dataframes()
 
     def to_datasets(self):
-        datasets = {}
-        for particle_type in self.samples:
-            datasets[particle_type] = self.fix_arrays(pd.DataFrame(self.samples[particle_type]), return_as_xr=True)
-        return datasets
-
-    @staticmethod
-    def fix_arrays(data_frame, return_as_xr=False):
-        # round-trip the dataframe through xray to get the multidimensional indexing correct
-        new_ds = xr.Dataset()
-        for each in data_frame:
-            if data_frame[each].dtype == 'object' and isinstance(data_frame[each].values[0], list):
-                data = np.array([np.array(x) for x in data_frame[each].values])
-                new_ds[each] = xr.DataArray(data)
-            else:
-                new_ds[each] = data_frame[each]
-        if return_as_xr:
-            return new_ds
-        return new_ds.to_dataframe()
+        return self.particles.to_datasets()
 
     def write(self):
         log.info('Writing output files...')
@@ -127,3 +95,40 @@ class XarrayPublisher(FilePublisher):
             file_path = '%s.xr' % particle_type
             with open(file_path, 'w') as fh:
                 pickle.dump(datasets[particle_type], fh, protocol=-1)
+
+
+class ChunkedFilePublisher(Publisher):
+    """
+    Write particles out in compressed chunks as they are published instead of
+    holding them all in memory until the end. Unlike a FilePublisher nothing is
+    kept to build dataframes from, write() only finishes the files.
+    """
+    fmt = None
+
+    def __init__(self, allowed, output_path=None, chunk_rows=None, **kwargs):
+        super(ChunkedFilePublisher, self).__init__(allowed, **kwargs)
+        self.particles = chunked_writer(self.fmt, output_path, chunk_rows)
+
+    def _publish(self, events, headers):
+        for event in events:
+            # file publisher only applicable to particles
+            if event.get('type') != 'DRIVER_ASYNC_EVENT_SAMPLE':
+                continue
+
+            particle = event.get('value', {})
+            stream = particle.get('stream_name')
+            if stream:
+                self.particles.add_particle(stream, particle)
+
+    def write(self):
+        log.info('Writing output files...')
+        self.particles.close()
+        log.info('Done writing output files...')
+
+
+class NetcdfPublisher(ChunkedFilePublisher):
+    fmt = 'netcdf'
+
+
+class ParquetPublisher(ChunkedFilePublisher):
+    fmt = 'parquet'
@@ -7,7 +7,6 @@ Release notes:
 
 initial release
 """
-import json
 import time
 
 import kombu
@@ -29,13 +28,16 @@ class KombuPublisher(Publisher):
         self.producer = kombu.Producer(self.connection, routing_key=self.queue, exchange=self.exchange)
 
     def _publish(self, events, headers):
-        msg_headers = self._merge_headers(headers)
+        msg_headers = self._serializer.headers(self._merge_headers(headers))
+        body, events = self.encode(events)
+        if not events:
+            return
 
         now = time.time()
         try:
             publish = self.connection.ensure(self.producer, self.producer.publish, max_retries=4)
-            publish(json.dumps(events), headers=msg_headers, user_id=self.username,
-                    declare=[self._queue], content_type='text/plain')
+            publish(body, headers=msg_headers, user_id=self.username,
+                    declare=[self._queue], content_type=self._serializer.content_type)
             log.info('Published %d messages using KOMBU in %.2f secs with headers %r',
                      len(events), time.time() - now, msg_headers)
         except Exception as e:
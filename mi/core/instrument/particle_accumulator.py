@@ -0,0 +1,371 @@
+"""
+@package mi.core.instrument.particle_accumulator
+@file /mi-instrument/mi/core/instrument/particle_accumulator.py
+@brief Columnar accumulation of data particles
+
+Particles are appended straight into one growable numpy array per stream and
+parameter instead of being kept as a list of dictionaries. Scalar parameters
+become 1D arrays, array valued parameters become a single 2D (or higher)
+block, so building a DataFrame or Dataset does not need to copy the data
+value by value.
+"""
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+ROW_DIMENSION = 'index'
+
+_NUMPY_KINDS = {'b': 'b', 'i': 'i', 'u': 'i', 'f': 'f'}
+_DTYPES = {'b': np.bool_, 'i': np.int64, 'f': np.float64, 'O': np.object_}
+
+
+def _describe(value):
+    """
+    Return the kind ('b', 'i', 'f' or 'O'), shape and storable form of a value
+    """
+    if isinstance(value, (list, tuple, np.ndarray)):
+        array = np.asarray(value)
+        kind = _NUMPY_KINDS.get(array.dtype.kind, 'O')
+        if kind == 'O' and array.dtype.kind == 'O':
+            # ragged or mixed lists are stored as opaque objects
+            return 'O', (), value
+        return kind, array.shape, array
+
+    if isinstance(value, (bool, np.bool_)):
+        return 'b', (), value
+    if isinstance(value, (int, long, np.integer)):
+        if isinstance(value, long) and not -2 ** 63 <= value < 2 ** 63:
+            return 'O', (), value
+        return 'i', (), value
+    if isinstance(value, (float, np.floating)):
+        return 'f', (), value
+    return 'O', (), value
+
+
+def _to_object(value):
+    return value.tolist() if isinstance(value, np.ndarray) else value
+
+
+class Column(object):
+    """
+    The values of one parameter, stored in a numpy array which grows by doubling.
+    Missing values are stored as NaN (or None for object columns) and recorded
+    in a mask, which is only allocated once a value is missing.
+    """
+    MIN_CAPACITY = 16
+
+    def __init__(self):
+        self.kind = None
+        self.shape = ()
+        self.data = None
+        self.mask = None
+        self.size = 0
+
+    def set(self, row, value):
+        """
+        Store the value for row. Rows skipped since the last value are missing.
+        """
+        if value is None:
+            self.fill_missing(row + 1)
+            return
+
+        if row > self.size:
+            self.fill_missing(row)
+
+        kind, shape, value = _describe(value)
+        if self.kind is None:
+            self.kind, self.shape = kind, shape
+            if self.size:
+                self._make_nullable()
+        elif kind != self.kind or shape != self.shape:
+            if self.kind != 'O' or self.shape:
+                self._promote(kind, shape)
+            if shape != self.shape:
+                # the column holds arbitrary objects, store the value as one
+                value = _to_object(value)
+
+        self._reserve(row + 1)
+        self.data[row] = value
+        self.size = row + 1
+
+    def extend(self, start, other, rows):
+        """
+        Store the first rows values of another column starting at row start
+        """
+        if other.kind is None:
+            self.fill_missing(start + rows)
+            return
+
+        if start > self.size:
+            self.fill_missing(start)
+
+        missing = other.missing(rows)
+        if self.kind is None:
+            self.kind, self.shape = other.kind, other.shape
+            if self.size:
+                self._make_nullable()
+        elif self.shape == other.shape and not self._holds(other.kind):
+            self._promote(other.kind, other.shape)
+        if missing is not None:
+            self._make_nullable()
+
+        if self.shape != other.shape or not self._holds(other.kind):
+            # differing types, go through the promotion rules one value at a time
+            values = other.values(rows)
+            for row in xrange(rows):
+                value = None if missing is not None and missing[row] else values[row]
+                self.set(start + row, value)
+            return
+
+        self._reserve(start + rows)
+        self.data[start:start + rows] = other.values(rows)
+        if missing is not None:
+            self._mask(start + rows)[start:start + rows] = missing
+        self.size = start + rows
+
+    def fill_missing(self, rows):
+        """
+        Mark every row from the current size up to (but excluding) rows as missing
+        """
+        if rows <= self.size:
+            return
+
+        if self.kind is not None:
+            self._make_nullable()
+            self._reserve(rows)
+            self.data[self.size:rows] = self._missing_value()
+
+        self._mask(rows)[self.size:rows] = True
+        self.size = rows
+
+    def values(self, rows):
+        """
+        Return the values of the first rows rows, padding with missing values if needed
+        """
+        self.fill_missing(rows)
+        if self.kind is None:
+            data = np.empty(rows, dtype=np.object_)
+            data[:] = None
+            return data
+        return self.data[:rows]
+
+    def missing(self, rows):
+        """
+        Return a boolean array of the rows which have no value, or None if none are missing
+        """
+        self.fill_missing(rows)
+        if self.mask is None:
+            return None
+        return self._mask(rows)[:rows]
+
+    def _mask(self, rows):
+        """
+        Return the mask, allocated or grown to hold at least rows rows
+        """
+        if self.mask is None:
+            self.mask = np.zeros(self._capacity(rows), dtype=np.bool_)
+        elif len(self.mask) < rows:
+            self.mask = self._grow(self.mask, max(rows, 2 * len(self.mask)))
+        return self.mask
+
+    def _holds(self, kind):
+        """
+        Return True if values of kind can be copied into this column as they are
+        """
+        return kind == self.kind or self.kind == 'O' or (self.kind == 'f' and kind == 'i')
+
+    def _missing_value(self):
+        return np.nan if self.kind == 'f' else None
+
+    def _make_nullable(self):
+        if self.kind == 'i':
+            self._promote('f', self.shape)
+        elif self.kind == 'b':
+            self._promote('O', self.shape)
+
+    def _promote(self, kind, shape):
+        """
+        Convert the column so it can also hold values of the given kind and shape
+        """
+        if shape != self.shape:
+            # values differ in shape, keep each one as an object
+            data = np.empty(self._capacity(self.size), dtype=np.object_)
+            for row in xrange(self.size):
+                data[row] = _to_object(self.data[row])
+            self.kind, self.shape = 'O', ()
+        else:
+            if set([kind, self.kind]) <= set(['i', 'f']):
+                self.kind = 'f'
+            else:
+                self.kind = 'O'
+            data = None if self.data is None else self.data.astype(_DTYPES[self.kind])
+
+        if data is not None and self.mask is not None:
+            data[:self.size][self._mask(self.size)[:self.size]] = self._missing_value()
+        self.data = data
+
+    def _capacity(self, rows):
+        return max(self.MIN_CAPACITY, rows)
+
+    @staticmethod
+    def _grow(array, capacity):
+        new_array = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+        new_array[:len(array)] = array
+        return new_array
+
+    def _reserve(self, rows):
+        if self.data is None:
+            self.data = np.empty((self._capacity(rows),) + self.shape, dtype=_DTYPES[self.kind])
+            if self.size:
+                self.data[:self.size] = self._missing_value()
+        elif len(self.data) < rows:
+            self.data = self._grow(self.data, max(rows, 2 * len(self.data)))
+
+
+class StreamColumns(object):
+    """
+    All columns of one stream
+    """
+    def __init__(self):
+        self.columns = {}
+        self.rows = 0
+
+    def append(self, sample):
+        """
+        Append a flat dictionary of parameter values as a new row
+        """
+        row = self.rows
+        columns = self.columns
+        for key, value in sample.iteritems():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = Column()
+            column.set(row, value)
+        self.rows += 1
+
+    def append_particle(self, particle):
+        """
+        Append a particle dictionary as a new row, flattening the values list
+        """
+        row = self.rows
+        columns = self.columns
+        for key, value in particle.iteritems():
+            if key == 'values':
+                continue
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = Column()
+            column.set(row, value)
+
+        for each in particle.get('values', []):
+            key = each['value_id']
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = Column()
+            column.set(row, each['value'])
+        self.rows += 1
+
+    def extend(self, other):
+        """
+        Append all rows of another StreamColumns
+        """
+        start = self.rows
+        columns = self.columns
+        for key, column in other.columns.iteritems():
+            if key not in columns:
+                columns[key] = Column()
+            columns[key].extend(start, column, other.rows)
+        self.rows += other.rows
+
+    def __len__(self):
+        return self.rows
+
+    def arrays(self):
+        """
+        Return a dictionary of parameter name to numpy array
+        """
+        return {key: column.values(self.rows) for key, column in self.columns.iteritems()}
+
+    def to_dataframe(self):
+        """
+        Build a DataFrame, array valued parameters become an object column
+        holding a view of each row of the array block
+        """
+        data = {}
+        for key, values in self.arrays().iteritems():
+            if values.ndim > 1:
+                rows = np.empty(self.rows, dtype=np.object_)
+                for row in xrange(self.rows):
+                    rows[row] = values[row]
+                values = rows
+            data[key] = values
+        return pd.DataFrame(data, columns=sorted(data))
+
+    def to_dataset(self):
+        """
+        Build a Dataset with one row dimension, array valued parameters get
+        additional dimensions named after the parameter
+        """
+        data_vars = {}
+        for key, values in self.arrays().iteritems():
+            dims = (ROW_DIMENSION,) + tuple('%s_dim_%d' % (key, dim) for dim in xrange(1, values.ndim))
+            data_vars[key] = (dims, values)
+        return xr.Dataset(data_vars)
+
+    def to_records(self):
+        """
+        Return the rows as a list of dictionaries of plain python values,
+        missing values are omitted
+        """
+        records = [{} for _ in xrange(self.rows)]
+        for key, column in self.columns.iteritems():
+            values = column.values(self.rows).tolist()
+            missing = column.missing(self.rows)
+            for row, value in enumerate(values):
+                if missing is None or not missing[row]:
+                    records[row][key] = value
+        return records
+
+
+class ParticleAccumulator(object):
+    """
+    Accumulate particles into per stream columns
+    """
+    def __init__(self):
+        self.streams = {}
+
+    def _stream(self, stream):
+        columns = self.streams.get(stream)
+        if columns is None:
+            columns = self.streams[stream] = StreamColumns()
+        return columns
+
+    def add_particle(self, stream, particle):
+        """
+        Add a particle dictionary (as returned by generate_dict)
+        """
+        self._stream(stream).append_particle(particle)
+
+    def add_sample(self, stream, sample):
+        """
+        Add an already flattened dictionary of parameter values
+        """
+        self._stream(stream).append(sample)
+
+    def add_columns(self, stream, columns):
+        """
+        Add all rows of a StreamColumns, e.g. one accumulated by another process
+        """
+        self._stream(stream).extend(columns)
+
+    def __len__(self):
+        return sum(len(columns) for columns in self.streams.itervalues())
+
+    def to_dataframes(self):
+        return {stream: columns.to_dataframe() for stream, columns in self.streams.iteritems()}
+
+    def to_datasets(self):
+        return {stream: columns.to_dataset() for stream, columns in self.streams.iteritems()}
+
+    def to_records(self):
+        return {stream: columns.to_records() for stream, columns in self.streams.iteritems()}
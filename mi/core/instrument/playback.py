@@ -6,27 +6,34 @@
 @brief Playback process using ZMQ messaging.
 
 Usage:
-    playback datalog <module> <refdes> <event_url> <particle_url> [--allowed=<particles>]  [--max_events=<events>] <files>...
-    playback ascii <module> <refdes> <event_url> <particle_url> [--allowed=<particles>] [--max_events=<events>] <files>...
-    playback chunky <module> <refdes> <event_url> <particle_url> [--allowed=<particles>] [--max_events=<events>] <files>...
+    playback datalog <module> <refdes> <event_url> <particle_url> [--allowed=<particles>]  [--max_events=<events>] [--jobs=<jobs>] [--overlap=<seconds>] <files>...
+    playback ascii <module> <refdes> <event_url> <particle_url> [--allowed=<particles>] [--max_events=<events>] [--jobs=<jobs>] [--overlap=<seconds>] <files>...
+    playback chunky <module> <refdes> <event_url> <particle_url> [--allowed=<particles>] [--max_events=<events>] [--jobs=<jobs>] [--overlap=<seconds>] <files>...
     playback zplsc <module> <refdes> <event_url> <particle_url> [--allowed=<particles>] [--max_events=<events>] <files>...
 
 Options:
     -h, --help          Show this screen
     --allowed=<particles> Comma-separated list of publishable particles
+    --jobs=<jobs>         Play time-contiguous segments of the files in parallel
+    --overlap=<seconds>   Continue each segment this far into the next one [default: 60]
 
     To run without installing:
     python -m mi.core.instrument.playback ...
 """
+import cPickle as pickle
 import glob
 import importlib
+import json
+import multiprocessing
 import sys
+import tempfile
 import time
 from datetime import datetime
 
 import os
 import re
 from docopt import docopt
+from mi.core.instrument.datalog import read_packets
 from mi.core.instrument.instrument_driver import DriverAsyncEvent
 from mi.core.instrument.instrument_protocol import \
     MenuInstrumentProtocol,\
@@ -46,6 +53,8 @@ Y2K = (datetime(2000, 1, 1) - datetime(1900, 1, 1)).total_seconds()
 DATE_PATTERN = r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?Z?$'
 DATE_MATCHER = re.compile(DATE_PATTERN)
 DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+SCAN_BLOCK_SIZE = 65536
+DEFAULT_OVERLAP = 60
 
 
 def string_to_ntp_date_time(datestr):
@@ -100,37 +109,56 @@ class PlaybackPacket(Packet):
 
     @staticmethod
     def packet_from_fh(file_handle):
-        data_buffer = bytearray()
+        """
+        Read the next packet from file_handle, scanning for the sync bytes a
+        block at a time. The file is left positioned after the packet.
+        """
+        sync = PacketHeader.sync
         while True:
-            byte = file_handle.read(1)
-            if byte == '':
-                return None
+            start = file_handle.tell()
+            block = file_handle.read(SCAN_BLOCK_SIZE)
+            sync_index = block.find(sync)
+            if sync_index == -1:
+                if len(block) < SCAN_BLOCK_SIZE:
+                    return None
+                # the sync bytes may straddle the end of the block
+                file_handle.seek(start + len(block) - len(sync) + 1)
+                continue
 
-            data_buffer.append(byte)
-            sync_index = data_buffer.find(PacketHeader.sync)
-            if sync_index != -1:
-                # found the sync bytes, read the rest of the header
-                data_buffer.extend(file_handle.read(PacketHeader.header_size - len(PacketHeader.sync)))
+            file_handle.seek(start + sync_index)
+            data_buffer = bytearray(file_handle.read(PacketHeader.header_size))
+            if len(data_buffer) < PacketHeader.header_size:
+                return None
 
-                if len(data_buffer) < PacketHeader.header_size:
-                    return None
+            header = PacketHeader.from_buffer(data_buffer, 0)
+            # read the payload
+            payload = file_handle.read(header.payload_size)
+            if len(payload) == header.payload_size:
+                return PlaybackPacket(payload=payload, header=header)
+            return None
 
-                header = PacketHeader.from_buffer(data_buffer, sync_index)
-                # read the payload
-                payload = file_handle.read(header.payload_size)
-                if len(payload) == header.payload_size:
-                    packet = PlaybackPacket(payload=payload, header=header)
-                    return packet
+    @staticmethod
+    def from_datalog_packet(datalog_packet):
+        """
+        Build a PlaybackPacket from a mi.core.instrument.datalog.DatalogPacket
+        """
+        header = PacketHeader.from_buffer(bytearray(datalog_packet.header), 0)
+        return PlaybackPacket(payload=datalog_packet.payload.tobytes(), header=header)
 
 
 class PlaybackWrapper(object):
-    def __init__(self, module, refdes, event_url, particle_url, reader_klass, allowed, files, max_events, handler=None):
+    def __init__(self, module, refdes, event_url, particle_url, reader_klass, allowed, files, max_events, handler=None,
+                 jobs=None, overlap=None):
         version = DriverWrapper.get_version(module)
         headers = {'sensor': refdes, 'deliveryType': 'streamed', 'version': version, 'module': module}
         self.max_events = max_events
         self.event_publisher = Publisher.from_url(event_url, handler=handler, headers=headers)
         self.particle_publisher = Publisher.from_url(particle_url, handler=handler, headers=headers, allowed=allowed,
                                                      max_events=max_events)
+        self.module = module
+        self.reader_klass = reader_klass
+        self.jobs = jobs
+        self.overlap = overlap if overlap is not None else DEFAULT_OVERLAP
         self.protocol = self.construct_protocol(module)
         self.reader = reader_klass(files, self.got_data)
 
@@ -139,6 +167,9 @@ class PlaybackWrapper(object):
         self.particle_publisher.set_source(filename)
 
     def playback(self):
+        if self.jobs > 1 and len(self.reader.files) > 1:
+            return self.parallel_playback()
+
         for index, filename in enumerate(self.reader.read()):
             if filename is not None:
                 self.set_header_filename(filename)
@@ -151,6 +182,43 @@ class PlaybackWrapper(object):
         if hasattr(self.particle_publisher, 'write'):
             self.particle_publisher.write()
 
+    def parallel_playback(self):
+        """
+        Play time-contiguous segments of the files through separate protocol
+        instances in a pool of worker processes, then publish the events of
+        each segment in turn, in the order a serial playback would
+        """
+        segments = split_segments(self.reader.files, self.jobs)
+        tasks = []
+        for index, files in enumerate(segments):
+            overlap_files = segments[index + 1][:1] if index + 1 < len(segments) else []
+            tasks.append((self.module, self.reader_klass, files, overlap_files, self.overlap))
+
+        log.info('Playing back %d files in %d segments', len(self.reader.files), len(segments))
+        pool = multiprocessing.Pool(len(segments))
+        try:
+            results = pool.imap(play_segment, tasks)
+            source = None
+            for index, (filename, event) in enumerate(merge_segments(results, self.event_publisher)):
+                if filename != source:
+                    # publish what we have so each file keeps its own source header
+                    self.publish()
+                    source = filename
+                    self.set_header_filename(filename)
+                self.particle_publisher.enqueue(event)
+                if index % 1000 == 0:
+                    self.publish()
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        self.publish()
+        if hasattr(self.particle_publisher, 'write'):
+            self.particle_publisher.write()
+
     def zplsc_playback(self):
         for index, filename in enumerate(self.reader.read()):
             if filename:
@@ -221,6 +289,201 @@ class PlaybackWrapper(object):
             self.event_publisher.enqueue(event)
 
 
+class EventCollector(object):
+    """
+    Stands in for a publisher in a segment worker. Events are written to the
+    segment's spill file with the name of the file being played when they were
+    generated, events from the overlap are kept in memory (see SegmentPlayback).
+    """
+    def __init__(self, playback, particles):
+        self.playback = playback
+        self.particles = particles
+        self.overlap_events = []
+        self._max_events = Publisher.DEFAULT_MAX_EVENTS
+
+    def enqueue(self, event):
+        if self.playback.in_overlap:
+            self.overlap_events.append((self.playback.filename, event))
+            if self.particles:
+                self.playback.last_particle_time = particle_time(event)
+        else:
+            pickle.dump((self.particles, self.playback.filename, event), self.playback.spill, pickle.HIGHEST_PROTOCOL)
+
+    def set_source(self, source):
+        pass
+
+    def publish(self):
+        return 0
+
+
+class SegmentPlayback(PlaybackWrapper):
+    """
+    Play back one segment of the files in a worker process. After the segment
+    it continues into the first file of the next segment until overlap seconds
+    of packets have been played, so a record straddling the boundary is still
+    completed. Readers which do not time their packets (e.g. ChunkyDatalogReader)
+    are bounded by the time of the particles produced in the overlap instead.
+
+    Events are spilled to a temporary file as they are generated rather than
+    held in memory, events produced in the overlap are returned separately.
+    """
+    def __init__(self, module, reader_klass, files, overlap_files, overlap):
+        self.spill = tempfile.NamedTemporaryFile(prefix='playback_segment_', delete=False)
+        self.event_publisher = EventCollector(self, particles=False)
+        self.particle_publisher = EventCollector(self, particles=True)
+        self.overlap_files = set(overlap_files)
+        self.overlap = overlap
+        self.filename = None
+        self.in_overlap = False
+        self.overlap_start = None
+        self.last_particle_time = None
+        self.done = False
+        self.protocol = self.construct_protocol(module)
+        self.reader = reader_klass(list(files) + list(overlap_files), self.got_data)
+
+    def set_header_filename(self, filename):
+        self.filename = filename
+        self.in_overlap = filename in self.overlap_files
+
+    def got_data(self, packet):
+        if self.done:
+            return
+        if self.in_overlap:
+            timestamp = packet.get_timestamp() or self.last_particle_time
+            if self.overlap_start is None:
+                self.overlap_start = timestamp
+            elif timestamp - self.overlap_start > self.overlap:
+                self.done = True
+                return
+        super(SegmentPlayback, self).got_data(packet)
+
+    def play(self):
+        """
+        @retval the path of the spill file (see read_spill), the events and the
+            particles (lists of (filename, event)) produced in the overlap
+        """
+        try:
+            for filename in self.reader.read():
+                if filename is not None:
+                    self.set_header_filename(filename)
+                    if hasattr(self.protocol, 'got_filename'):
+                        self.protocol.got_filename(filename)
+                if self.done:
+                    break
+        finally:
+            self.spill.close()
+
+        return self.spill.name, self.event_publisher.overlap_events, self.particle_publisher.overlap_events
+
+
+def play_segment(args):
+    """
+    Worker process entry point, see SegmentPlayback
+    """
+    module, reader_klass, files, overlap_files, overlap = args
+    return SegmentPlayback(module, reader_klass, files, overlap_files, overlap).play()
+
+
+def read_spill(path):
+    """
+    Generate the (is particle, filename, event) records of a segment spill
+    file in the order they were generated, removing the file once read
+    """
+    try:
+        with open(path, 'rb') as fh:
+            while True:
+                try:
+                    yield pickle.load(fh)
+                except EOFError:
+                    break
+    finally:
+        os.remove(path)
+
+
+def split_segments(files, count):
+    """
+    Split the (time ordered) list of files into at most count contiguous
+    segments of roughly equal size in bytes
+    """
+    sizes = [os.path.getsize(f) for f in files]
+    total = float(sum(sizes)) or 1.0
+    segments = [[]]
+    consumed = 0
+    for name, size in zip(files, sizes):
+        if segments[-1] and len(segments) < count and consumed >= total * len(segments) / count:
+            segments.append([])
+        segments[-1].append(name)
+        consumed += size
+    return segments
+
+
+def particle_time(event):
+    particle = event.get('value', {})
+    timestamp = particle.get(particle.get('preferred_timestamp'))
+    if timestamp is None:
+        timestamp = particle.get('port_timestamp')
+    return timestamp or 0
+
+
+def particle_key(event):
+    particle = event.get('value', {})
+    return (particle.get('stream_name'), particle.get('port_timestamp'), particle.get('internal_timestamp'),
+            json.dumps(particle.get('values'), sort_keys=True))
+
+
+def _merge_overlap(overlap, held):
+    """
+    Merge the particles a segment produced in its overlap into the first
+    particles of the following segment, dropping those it produced too
+    """
+    keys = set(particle_key(event) for _, event in held)
+    kept = [item for item in overlap if particle_key(item[1]) not in keys]
+    if not kept:
+        return held
+    return sorted(kept + held, key=lambda item: particle_time(item[1]))
+
+
+def merge_segments(results, event_publisher):
+    """
+    Generate (filename, particle event) pairs from the ordered segment results
+    in the order they were generated, as a serial playback would. Other events
+    are enqueued on event_publisher as they are read.
+
+    Each segment replays the first file of the following segment from its
+    start, so the events a segment produced in its overlap are dropped and the
+    particles are only kept if the following segment did not produce them. Only
+    the following segment's particles up to the end of the overlap are held to
+    compare against, the duplicates are among its first particles.
+    """
+    overlap = []
+    for path, _, segment_overlap in results:
+        if overlap:
+            window_end = max(particle_time(event) for _, event in overlap)
+            # bounds the particles held if they have no timestamps
+            max_held = 2 * len(overlap)
+        held = []
+        for is_particle, filename, event in read_spill(path):
+            if not is_particle:
+                event_publisher.enqueue(event)
+                continue
+            if overlap:
+                if particle_time(event) <= window_end and len(held) < max_held:
+                    held.append((filename, event))
+                    continue
+                for item in _merge_overlap(overlap, held):
+                    yield item
+                overlap = []
+            yield filename, event
+
+        if overlap:
+            for item in _merge_overlap(overlap, held):
+                yield item
+        overlap = segment_overlap
+
+    for item in overlap:
+        yield item
+
+
 class DatalogReader(object):
     def __init__(self, files, callback):
         self.callback = callback
@@ -233,6 +496,7 @@ class DatalogReader(object):
         if not all([os.path.isfile(f) for f in self.files]):
             raise Exception('Not all files found')
         self._filehandle = None
+        self._packets = None
         self.target_types = [PacketType.FROM_INSTRUMENT, PacketType.PA_CONFIG]
         self.file_name_list = []
 
@@ -253,15 +517,18 @@ class DatalogReader(object):
             if not self._process_packet():
                 self._filehandle.close()
                 self._filehandle = None
+                self._packets = None
 
             yield
 
     def _process_packet(self):
-        packet = PlaybackPacket.packet_from_fh(self._filehandle)
-        if packet is None:
+        if self._packets is None:
+            self._packets = read_packets(self._filehandle, self.target_types)
+
+        datalog_packet = next(self._packets, None)
+        if datalog_packet is None:
             return False
-        if packet.header.packet_type in self.target_types:
-            self.callback(packet)
+        self.callback(PlaybackPacket.from_datalog_packet(datalog_packet))
         return True
 
 
@@ -355,6 +622,8 @@ def main():
     allowed = options.get('--allowed')
     if allowed is not None:
         allowed = [_.strip() for _ in allowed.split(',')]
+    jobs = int(options.get('--jobs') or 1)
+    overlap = float(options.get('--overlap') or DEFAULT_OVERLAP)
     max_events = options.get('--max_events')
     if not max_events:
         max_events = Publisher.DEFAULT_MAX_EVENTS
@@ -380,7 +649,8 @@ def main():
     else:
         reader = None
 
-    wrapper = PlaybackWrapper(module, refdes, event_url, particle_url, reader, allowed, files, max_events)
+    wrapper = PlaybackWrapper(module, refdes, event_url, particle_url, reader, allowed, files, max_events,
+                              jobs=jobs, overlap=overlap)
     if zplsc_reader:
         wrapper.zplsc_playback()
     else:
@@ -8,6 +8,7 @@
 and logging.
 """
 import errno
+import select
 import socket
 import struct
 import threading
@@ -17,6 +18,7 @@ import ntplib
 
 from mi.core.exceptions import InstrumentConnectionException, InstrumentException
 from mi.core.log import get_logger
+from mi.core.watchdog import get_watchdog
 
 __author__ = 'David Everett'
 __license__ = 'Apache 2.0'
@@ -44,6 +46,10 @@ OFFSET_P_CHECKSUM_LOW = 6
 OFFSET_P_CHECKSUM_HIGH = 7
 
 
+# Offset of the packet size in the packed header
+OFFSET_P_LENGTH = 4
+PACKET_LENGTH_FORMAT = '>H'
+
 # Offsets into the unpacked header fields
 SYNC_BYTE1_INDEX = 0
 TYPE_INDEX = 3
@@ -54,6 +60,7 @@ TIMESTAMP_LOWER_INDEX = 7
 
 MAX_SEND_ATTEMPTS = 15  # Max number of times we can get EAGAIN
 NEWLINE = '\n'
+RECEIVE_BUFFER_SIZE = 65536  # Initial size of the listener receive buffer
 
 
 class SocketClosed(Exception):
@@ -82,6 +89,7 @@ class PortAgentPacket:
     DIGI_RSP = 8
     HEARTBEAT = 9
     PICKLED_FROM_INSTRUMENT = 10
+    FRAMED_FROM_INSTRUMENT = 11
 
     def __init__(self, packet_type=None):
         self.__header = None
@@ -373,12 +381,19 @@ class Listener(threading.Thread):
     """
     A listener thread to monitor the client socket data incoming from
     the port agent process.
+
+    Data is received in blocks into a reusable buffer, every complete packet
+    in the buffer is framed after each receive. The buffer only grows if a
+    single packet does not fit. The thread waits for data with select, so it
+    notices it has been stopped within POLL_INTERVAL.
     """
     MAX_HEARTBEAT_INTERVAL = 20  # Max, for range checking parameter
     MAX_MISSED_HEARTBEATS = 5  # Max number we can miss
     HEARTBEAT_FUDGE = 1  # Fudge factor to account for delayed heartbeat
+    POLL_INTERVAL = 0.1  # Max time to wait for data before checking if we are done
 
-    def __init__(self, sock, callback, error_callback, heartbeat, max_missed_heartbeats):
+    def __init__(self, sock, callback, error_callback, heartbeat, max_missed_heartbeats,
+                 buffer_size=RECEIVE_BUFFER_SIZE):
         """
         Listener thread constructor.
         @param sock The socket to listen on.
@@ -386,9 +401,15 @@ class Listener(threading.Thread):
         @param error_callback The callback on error
         @param heartbeat The heartbeat interval in which to expect heartbeat messages from the Port Agent.
         @param max_missed_heartbeats The number of allowable missed heartbeats before attempting recovery.
+        @param buffer_size The initial size of the receive buffer.
         """
         threading.Thread.__init__(self)
         self.sock = sock
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        # received bytes not yet framed are self._buffer[self._start:self._end]
+        self._start = 0
+        self._end = 0
         self._done = False
         self.heartbeat_timer = None
         self.thread_name = None
@@ -412,23 +433,24 @@ class Listener(threading.Thread):
 
     def error(self):
         self._done = True
+        self.stop_heartbeat_timer()
         self.error_callback()
 
     def start_heartbeat_timer(self):
         """
-        Note: the threading timer here is only run once.  The cancel
-        only applies if the function has yet run.  You can't reset
-        it and start it again, you have to instantiate a new one.
-        I don't like this; we need to implement a tread timer that
-        stays up and can be reset and started many times.
+        (Re)start the heartbeat timer. The timer is registered with the
+        process wide watchdog, resetting it does not create a thread.
         """
         if not self._done:
-            if self.heartbeat_timer:
-                self.heartbeat_timer.cancel()
+            if self.heartbeat_timer is None:
+                self.heartbeat_timer = get_watchdog().register(self.heartbeat, self.heartbeat_timeout,
+                                                               name='heartbeat %s' % self.thread_name)
+            else:
+                self.heartbeat_timer.reset()
 
-            self.heartbeat_timer = threading.Timer(self.heartbeat,
-                                                   self.heartbeat_timeout)
-            self.heartbeat_timer.start()
+    def stop_heartbeat_timer(self):
+        if self.heartbeat_timer is not None:
+            self.heartbeat_timer.cancel()
 
     def handle_packet(self, pa_packet):
         packet_type = pa_packet.get_header_type()
@@ -443,34 +465,86 @@ class Listener(threading.Thread):
         else:
             self.callback(pa_packet)
 
-    def _receive_n_bytes(self, count):
-        data_buffer = bytearray(count)
-        data_view = memoryview(data_buffer)
-        bytes_left = count
-        while bytes_left and not self._done:
-            try:
-                bytes_rx = self.sock.recv_into(data_view[-bytes_left:], bytes_left)
-                log.trace('RX BYTES %d LEFT %d SOCK %r', bytes_rx, bytes_left, self.sock)
-                if bytes_rx <= 0:
-                    raise SocketClosed()
-                bytes_left -= bytes_rx
-            except socket.error as e:
-                if e.errno == errno.EWOULDBLOCK:
-                    time.sleep(.1)
-                else:
-                    raise
-
-        if self._done:
-            raise Done()
-
-        return str(data_buffer)
+    def _make_room(self, size):
+        """
+        Move the unframed bytes to the start of the buffer, growing the
+        buffer if it can not hold size bytes.
+        """
+        pending = self._end - self._start
+        if size > len(self._buffer):
+            buffer_ = bytearray(max(size, 2 * len(self._buffer)))
+            buffer_[:pending] = self._view[self._start:self._end]
+            self._buffer = buffer_
+            self._view = memoryview(buffer_)
+        elif self._start:
+            # slicing copies, the source and destination may overlap
+            self._buffer[:pending] = self._buffer[self._start:self._end]
+        self._start = 0
+        self._end = pending
+
+    def _receive(self):
+        """
+        Wait up to POLL_INTERVAL for data from the port agent and read as
+        much as fits in the buffer.
+        @returns True if data was received
+        @raise SocketClosed if the port agent closed the connection
+        """
+        try:
+            readable, _, _ = select.select([self.sock], [], [], self.POLL_INTERVAL)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return False
+            raise
+        if not readable:
+            return False
+
+        if self._end == len(self._buffer):
+            self._make_room(self._end - self._start + 1)
+        try:
+            bytes_rx = self.sock.recv_into(self._view[self._end:])
+        except socket.error as e:
+            if e.errno in (errno.EWOULDBLOCK, errno.EINTR):
+                return False
+            raise
+        log.trace('RX BYTES %d SOCK %r', bytes_rx, self.sock)
+        if bytes_rx <= 0:
+            raise SocketClosed()
+        self._end += bytes_rx
+        return True
+
+    def _frame(self):
+        """
+        Handle every complete packet in the buffer. Header and data are
+        copied out of the buffer (once each) as callbacks may keep them.
+        """
+        while self._end - self._start >= HEADER_SIZE:
+            start = self._start
+            packet_size, = struct.unpack_from(PACKET_LENGTH_FORMAT, self._buffer, start + OFFSET_P_LENGTH)
+            if packet_size < HEADER_SIZE:
+                # skip the header and carry on with the next bytes
+                self._start += HEADER_SIZE
+                raise InstrumentException('Invalid port agent packet size: %d' % packet_size)
+
+            if self._end - start < packet_size:
+                # incomplete, make sure the rest of the packet fits
+                if start + packet_size > len(self._buffer):
+                    self._make_room(packet_size)
+                break
+
+            self._start += packet_size
+            pa_packet = PortAgentPacket()
+            pa_packet.unpack_header(self._view[start:start + HEADER_SIZE].tobytes())
+            pa_packet.attach_data(self._view[start + HEADER_SIZE:start + packet_size].tobytes())
+            self.handle_packet(pa_packet)
+
+        if self._start == self._end:
+            self._start = self._end = 0
 
     def run(self):
         """
-        Listener thread processing loop. Block on receive from port agent.
-        Receive HEADER_SIZE bytes to receive the entire header.  From that,
-        get the length of the whole packet (including header); compute the
-        length of the remaining data and read that.
+        Listener thread processing loop. Wait for data from the port agent,
+        receive as much as is available and handle each complete packet,
+        keeping any partial packet for the next receive.
         """
         self.thread_name = threading.current_thread().name
         log.info('PortAgentClient listener thread: %s started.', self.thread_name)
@@ -480,17 +554,9 @@ class Listener(threading.Thread):
 
         while not self._done:
             try:
-                header = self._receive_n_bytes(HEADER_SIZE)
-                pa_packet = PortAgentPacket()
-                pa_packet.unpack_header(header)
-                data_size = pa_packet.get_data_length()
-                data = self._receive_n_bytes(data_size)
-                # Should have complete port agent packet.
-                pa_packet.attach_data(data)
-                self.handle_packet(pa_packet)
-
-            except Done:
-                pass
+                # framing first picks up any packets left by an exception in a callback
+                self._frame()
+                self._receive()
 
             except (SocketClosed, socket.error) as e:
                 error_string = 'Listener: %s Socket error while receiving from port agent: %r' % (self.thread_name, e)
@@ -504,4 +570,5 @@ class Listener(threading.Thread):
                 log.error(e.get_triple())
                 self.callback(e)
 
+        self.stop_heartbeat_timer()
         log.info('Port_agent_client thread done listening; going away.')
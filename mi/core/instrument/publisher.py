@@ -9,14 +9,15 @@ initial release
 """
 import copy
 import datetime
-import json
 import time
 import urllib
 import urlparse
 from collections import deque
-from threading import Thread
+from threading import Thread, RLock, Condition
 
 from mi.core.instrument.instrument_driver import DriverAsyncEvent
+from mi.core.instrument.serializer import get_serializer
+from mi.core.instrument.spill_queue import SpillQueue
 from mi.logging import log
 
 
@@ -34,29 +35,152 @@ def extract_param(param, query):
     return return_value, urllib.urlencode(new_params)
 
 
+class PublisherMetrics(object):
+    """
+    Counters for a publisher queue. Flush latency is the time from the oldest
+    event of a batch being queued until the batch is published.
+    """
+    def __init__(self):
+        self.enqueued = 0
+        self.published = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.failed = 0
+        self.flushes = 0
+        self.max_depth = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    def record_flush(self, events, latency):
+        self.published += events
+        self.flushes += 1
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        self.total_flush_latency += latency
+
+    def as_dict(self):
+        result = dict(self.__dict__)
+        result['mean_flush_latency'] = self.total_flush_latency / self.flushes if self.flushes else 0.0
+        return result
+
+
 class Publisher(object):
+    """
+    Queue events and publish them in batches from a background thread (see start),
+    or synchronously with publish. The thread publishes as soon as max_events are
+    queued, or once the oldest queued event is publish_interval seconds old.
+
+    The queue holds at most max_queue events (unbounded if None). When it is full
+    the overflow policy decides what happens to new events: BLOCK waits for the
+    publisher thread to make room (or publishes inline if it is not running),
+    DROP_OLDEST discards the oldest queued event and SPILL writes the new events
+    to disk (a SpillQueue in spill_path). Events still spilled when the publisher
+    is stopped are recovered by the next publisher opened on the same spill_path.
+
+    With SPILL, events which fail to publish are also moved to disk once they
+    push the queue past max_queue, so a broker outage does not grow memory.
+    Spilled events are replayed in order, at up to replay_rate events per second
+    while the publisher thread runs. Until the spill is read back, new events are
+    spilled behind it, so events are always published in the order queued.
+    """
     DEFAULT_MAX_EVENTS = 500
     DEFAULT_PUBLISH_INTERVAL = 5
+    DEFAULT_REPLAY_RATE = 1000
     SOURCE = 'source'
+    # returned by _publish for events sent but not yet confirmed, see _confirmed
+    PENDING = object()
 
-    def __init__(self, allowed, max_events=None, publish_interval=None):
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+    SPILL = 'spill'
+    OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, SPILL)
+
+    def __init__(self, allowed, max_events=None, publish_interval=None, codec=None, max_queue=None, overflow=None,
+                 spill_path=None, replay_rate=None):
         self._allowed = allowed
+        self._serializer = get_serializer(codec)
         self._deque = deque()
         self._max_events = max_events if max_events else self.DEFAULT_MAX_EVENTS
         self._publish_interval = publish_interval if publish_interval else self.DEFAULT_PUBLISH_INTERVAL
+        self._max_queue = max_queue
+        self._overflow = overflow if overflow else self.BLOCK
+        if self._overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy: %r' % self._overflow)
+        if self._overflow == self.SPILL and not self._max_queue:
+            raise ValueError('The spill overflow policy requires max_queue')
+        if self._overflow == self.SPILL and not spill_path:
+            raise ValueError('The spill overflow policy requires spill_path')
+        self._spill = SpillQueue(spill_path, self._serializer) if self._overflow == self.SPILL else None
+        self._replay_rate = replay_rate if replay_rate else self.DEFAULT_REPLAY_RATE
+        self._replay_allowance = 0.0
+        self._last_replay = time.time()
         self._running = False
         self._headers = {}
-        log.info('Publisher: max_events: %d publish_interval: %d', self._max_events, self._publish_interval)
+        self._lock = RLock()
+        self._ready = Condition(self._lock)
+        self._not_full = Condition(self._lock)
+        # time the oldest event in the queue was queued
+        self._oldest = None
+        # don't publish again before this time after a failure
+        self._retry_at = 0
+        self._metrics = PublisherMetrics()
+        log.info('Publisher: max_events: %d publish_interval: %d codec: %s max_queue: %s overflow: %s',
+                 self._max_events, self._publish_interval, self._serializer.name, self._max_queue, self._overflow)
 
     def _run(self):
-        self._running = True
-        last_publish = time.time()
         while self._running:
-            now = time.time()
-            if now > last_publish + self._publish_interval:
-                last_publish = now
+            with self._lock:
+                while self._running and not self._flush_due():
+                    self._ready.wait(self._wait_time())
+            if self._running:
                 self.publish()
-            time.sleep(.1)
+
+    def _flush_due(self):
+        self._replay()
+        if not self._deque:
+            return False
+        now = time.time()
+        if now < self._retry_at:
+            return False
+        return len(self._deque) >= self._max_events or now >= self._oldest + self._publish_interval
+
+    def _wait_time(self):
+        """
+        Seconds until the next flush could be due, None if the queue is empty
+        """
+        if not self._deque:
+            if self._spill is not None and len(self._spill):
+                # wait for the replay allowance to reach one event
+                return max(0.01, (1 - self._replay_allowance) / self._replay_rate)
+            return None
+        return max(0, max(self._retry_at, self._oldest + self._publish_interval) - time.time())
+
+    def _replay(self):
+        """
+        Move spilled events back to the in-memory queue, as far as max_queue
+        and (when the publisher thread is running) the replay rate allow
+        """
+        if self._spill is None or not len(self._spill):
+            return
+
+        now = time.time()
+        room = self._max_queue - len(self._deque)
+        if self._running:
+            elapsed, self._last_replay = now - self._last_replay, now
+            self._replay_allowance = min(self._max_events, self._replay_allowance + elapsed * self._replay_rate)
+            room = min(room, int(self._replay_allowance))
+        if room <= 0:
+            return
+
+        events = self._spill.read(room)
+        self._replay_allowance -= len(events)
+        self._metrics.replayed += len(events)
+        self._deque.extend(events)
+        if self._oldest is None:
+            # replayed events are already late, publish them with the next flush
+            self._oldest = now - self._publish_interval
 
     def _merge_headers(self, headers):
         msg_headers = copy.deepcopy(self._headers)
@@ -71,22 +195,109 @@ class Publisher(object):
         self._headers[self.SOURCE] = source
 
     def start(self):
+        self._running = True
+        self._last_replay = time.time()
         t = Thread(target=self._run)
         t.setDaemon(True)
         t.start()
 
     def stop(self):
-        self._running = False
+        with self._lock:
+            self._running = False
+            if self._spill is not None:
+                self._spill.close()
+            self._ready.notify_all()
+            self._not_full.notify_all()
 
     def enqueue(self, event):
-        try:
-            json.dumps(event)
+        # events are validated when the batch is encoded, see encode
+        with self._lock:
+            self._metrics.enqueued += 1
+            if self._spill is not None:
+                # once spilling, keep spilling until the spill is read back to preserve ordering
+                if len(self._spill) or len(self._deque) >= self._max_queue:
+                    if self._spill.append(event):
+                        self._metrics.spilled += 1
+                    return
+            elif self._max_queue and len(self._deque) >= self._max_queue:
+                if self._overflow == self.DROP_OLDEST:
+                    self._deque.popleft()
+                    self._metrics.dropped += 1
+                    if self._metrics.dropped % 1000 == 1:
+                        log.warn('Publisher queue full, dropped %d events so far', self._metrics.dropped)
+                else:
+                    self._wait_not_full()
+
             self._deque.append(event)
-        except Exception as e:
-            log.error('Unable to encode event as JSON: %r', e)
+            depth = len(self._deque)
+            self._metrics.max_depth = max(self._metrics.max_depth, depth)
+            if self._oldest is None:
+                self._oldest = time.time()
+                self._ready.notify()
+            elif depth >= self._max_events:
+                self._ready.notify()
+
+    def _wait_not_full(self):
+        while len(self._deque) >= self._max_queue:
+            if self._running:
+                self._ready.notify()
+                self._not_full.wait(1)
+            else:
+                # nothing else will empty the queue
+                self.publish()
 
     def requeue(self, events):
-        self._deque.extendleft(reversed(events))
+        with self._lock:
+            self._deque.extendleft(reversed(events))
+            if self._oldest is None:
+                self._oldest = time.time()
+
+            excess = len(self._deque) - self._max_queue if self._spill is not None else 0
+            if excess > 0:
+                # the newest events in memory go in front of those already spilled
+                tail = [self._deque.pop() for _ in xrange(excess)]
+                tail.reverse()
+                self._spill.prepend(tail)
+                self._metrics.spilled += len(tail)
+
+    def _take(self):
+        """
+        Remove up to max_events from the queue, refilling it from the spill
+        """
+        with self._lock:
+            events = []
+            for _ in xrange(self._max_events):
+                try:
+                    events.append(self._deque.popleft())
+                except IndexError:
+                    break
+
+            if self._spill is not None:
+                self._spill.flush()
+                self._replay()
+
+            oldest = self._oldest
+            if not self._deque:
+                self._oldest = None
+            self._not_full.notify_all()
+            return events, oldest
+
+    def queue_depth(self):
+        """
+        Number of events waiting to be published, including any spilled to disk
+        """
+        with self._lock:
+            return len(self._deque) + (len(self._spill) if self._spill is not None else 0)
+
+    def metrics(self):
+        """
+        Return a dictionary of the queue depth and publishing counters
+        """
+        with self._lock:
+            result = self._metrics.as_dict()
+            result['queue_depth'] = len(self._deque)
+            result['spill_depth'] = len(self._spill) if self._spill is not None else 0
+            return result
 
     @staticmethod
     def group_events(events):
@@ -97,31 +308,60 @@ class Publisher(object):
         return group_dict
 
     def publish(self):
-        events = []
-        for _ in xrange(self._max_events):
-            try:
-                events.append(self._deque.popleft())
-            except IndexError:
-                break
+        events, oldest = self._take()
 
         if events:
             events = self.filter_events(events)
             groups = self.group_events(events)
+            published = 0
             for instance in groups:
                 if instance is None:
                     failed = self._publish(groups[instance], instance)
-                    if failed:
-                        self.requeue(failed)
                 else:
                     failed = self._publish(groups[instance], {'sensor': instance})
-                    if failed:
-                        self.requeue(failed)
-
-        return len(self._deque)
+                if failed is self.PENDING:
+                    continue
+                if failed:
+                    self._failed(failed, instance)
+                else:
+                    published += len(groups[instance])
+
+            with self._lock:
+                self._metrics.record_flush(published, time.time() - oldest if oldest else 0.0)
+
+        return self.queue_depth()
+
+    def _confirmed(self, count):
+        """
+        Count events published once confirmed, after _publish returned PENDING
+        """
+        with self._lock:
+            self._metrics.published += count
+
+    def _failed(self, events, instance=None):
+        """
+        Requeue events which failed to publish, publishing is retried after publish_interval
+        """
+        if instance is not None:
+            # restore the instance removed by group_events
+            for event in events:
+                event['instance'] = instance
+        self.requeue(events)
+        with self._lock:
+            self._metrics.failed += len(events)
+            self._retry_at = time.time() + self._publish_interval
 
     def _publish(self, events, headers):
         raise NotImplemented
 
+    def encode(self, events):
+        """
+        Encode a batch of events with this publisher's serializer, events which
+        can not be encoded are logged and dropped
+        @returns the encoded message and the events it contains
+        """
+        return self._serializer.encode_events(events)
+
     def filter_events(self, events):
         if self._allowed is not None and isinstance(self._allowed, list):
             log.info('Filtering %d events with: %r', len(events), self._allowed)
@@ -146,6 +386,11 @@ class Publisher(object):
 
         result = urlparse.urlsplit(url)
         queue, query = extract_param('queue', result.query)
+        for param, convert in [('codec', str), ('max_queue', int), ('overflow', str), ('spill_path', str),
+                               ('replay_rate', float)]:
+            value, query = extract_param(param, query)
+            if value:
+                kwargs[param] = convert(value)
         url = result.scheme + '://' + result.netloc + result.path
 
         username = password = 'guest'
@@ -161,6 +406,9 @@ class Publisher(object):
         if result.scheme == 'qpid':
             from qpid_publisher import QpidPublisher
             publisher = QpidPublisher
+            window, query = extract_param('window', query)
+            if window:
+                kwargs['window'] = int(window)
 
         elif result.scheme == 'amqp' or result.scheme == 'pyamqp':
             from kombu_publisher import KombuPublisher
@@ -183,6 +431,14 @@ class Publisher(object):
         elif result.scheme == 'xarray':
             from file_publisher import XarrayPublisher
             return XarrayPublisher(allowed, **kwargs)
+
+        elif result.scheme in ('netcdf', 'parquet'):
+            from file_publisher import NetcdfPublisher, ParquetPublisher
+            chunk_rows, _ = extract_param('rows', result.query)
+            output_path = (result.netloc + result.path) or None
+            publisher = NetcdfPublisher if result.scheme == 'netcdf' else ParquetPublisher
+            return publisher(allowed, output_path=output_path,
+                             chunk_rows=int(chunk_rows) if chunk_rows else None, **kwargs)
         
         elif result.scheme == 'ingest':
             return IngestEnginePublisher(handler, allowed, **kwargs)
@@ -219,4 +475,4 @@ class IngestEnginePublisher(Publisher):
     def _publish(self, events, headers):
         for e in events:
             stream = e['value']['stream_name']
-            self.handler.addParticleSample(stream, json.dumps(e['value']))
+            self.handler.addParticleSample(stream, self._serializer.dumps(e['value']))
@@ -6,39 +6,164 @@
 Release notes:
 
 initial release
+
+Messages are sent through a PipelinedSender: with a window of one every
+message waits for the broker, as before. With a larger window (?window=N on
+the publisher URL) messages are sent without waiting and confirmed together
+with session.sync, messages of a window which fails to confirm are requeued
+and published again (at least once delivery).
 """
-import json
 import time
 
 import qpid.messaging as qm
 from mi.core.instrument.publisher import Publisher
 from mi.logging import log
 
+# errors which leave the messages in flight unconfirmed
+SEND_ERRORS = (qm.MessagingError, qm.Timeout)
+
+
+class PipelinedSender(object):
+    """
+    Send messages asynchronously and confirm them in windows. The window is
+    confirmed (session.sync) once it holds window messages or its first
+    message has been in flight for confirm_interval seconds, callers may also
+    confirm early.
+
+    Each message is sent along with a token, anything the caller needs to
+    acknowledge or replay the message. send and confirm return the tokens of
+    the confirmed and of the failed messages. On failure every message in
+    flight is failed and the sender must be attached to a new session.
+    """
+    DEFAULT_WINDOW = 1
+    DEFAULT_CONFIRM_INTERVAL = 1.0
+    DEFAULT_TIMEOUT = 30
+
+    def __init__(self, window=None, confirm_interval=None, timeout=None):
+        self.window = window if window else self.DEFAULT_WINDOW
+        self.confirm_interval = confirm_interval if confirm_interval is not None else self.DEFAULT_CONFIRM_INTERVAL
+        self.timeout = timeout if timeout else self.DEFAULT_TIMEOUT
+        self.session = None
+        self.sender = None
+        self._in_flight = []
+        self._first_sent = None
+
+    def attach(self, session, sender):
+        self.session = session
+        self.sender = sender
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    def send(self, message, token):
+        """
+        Send a message without waiting for the broker, confirming the window if due
+        @returns lists of the confirmed and failed tokens
+        """
+        self._in_flight.append(token)
+        if self._first_sent is None:
+            self._first_sent = time.time()
+        try:
+            self.sender.send(message, sync=False)
+        except SEND_ERRORS as e:
+            return [], self._fail(e)
+
+        if self.confirm_due():
+            return self.confirm()
+        return [], []
+
+    def confirm_due(self):
+        if not self._in_flight:
+            return False
+        return len(self._in_flight) >= self.window or time.time() - self._first_sent >= self.confirm_interval
+
+    def confirm(self):
+        """
+        Wait for the broker to confirm every message in flight
+        @returns lists of the confirmed and failed tokens
+        """
+        if not self._in_flight:
+            return [], []
+        try:
+            self.session.sync(timeout=self.timeout)
+        except SEND_ERRORS as e:
+            return [], self._fail(e)
+        return self.abort(), []
+
+    def abort(self):
+        """
+        Forget the messages in flight
+        @returns their tokens
+        """
+        tokens, self._in_flight = self._in_flight, []
+        self._first_sent = None
+        return tokens
+
+    def _fail(self, error):
+        log.error('Unable to confirm %d messages sent to QPID: %r', len(self._in_flight), error)
+        self.session = self.sender = None
+        return self.abort()
+
 
 class QpidPublisher(Publisher):
-    def __init__(self, url, queue, headers, allowed, username='guest', password='guest', max_events=None, **kwargs):
+    def __init__(self, url, queue, headers, allowed, username='guest', password='guest', max_events=None,
+                 window=None, **kwargs):
         super(QpidPublisher, self).__init__(allowed, max_events, **kwargs)
         self.connection = qm.Connection(url, reconnect=True, username=username, password=password)
         self.queue = queue
         self.session = None
         self.sender = None
         self._headers = headers
+        self._pipeline = PipelinedSender(window)
         self.connect()
 
     def connect(self):
-        self.connection.open()
+        if not self.connection.opened():
+            self.connection.open()
         self.session = self.connection.session()
         self.sender = self.session.sender('%s; {create: always, node: {type: queue, durable: true}}' % self.queue)
+        self._pipeline.attach(self.session, self.sender)
+
+    def publish(self):
+        depth = super(QpidPublisher, self).publish()
+        if depth < self._max_events:
+            # no full batch is waiting to be pipelined behind the messages in flight
+            self._settle(*self._pipeline.confirm())
+            depth = self.queue_depth()
+        return depth
+
+    def _settle(self, confirmed, failed):
+        if confirmed:
+            elapsed = time.time() - min(sent for _, _, sent in confirmed)
+            count = sum(len(events) for events, _, _ in confirmed)
+            self._confirmed(count)
+            log.info('Published %d messages to QPID in %d batches, confirmed in %.2f secs',
+                     count, len(confirmed), elapsed)
+        if failed:
+            self.session = self.sender = None
+            # each batch is requeued in front of the queue, last batch first keeps them in order
+            for events, instance, _ in reversed(failed):
+                self._failed(events, instance)
 
     def _publish(self, events, headers):
-        msg_headers = self._merge_headers(headers)
+        msg_headers = self._serializer.headers(self._merge_headers(headers))
+        body, events = self.encode(events)
+        if not events:
+            return
+
+        if self.sender is None:
+            try:
+                self.connect()
+            except SEND_ERRORS as e:
+                log.error('Unable to connect to QPID: %r', e)
+                return events
 
         # HACK!
         self.connection.error = None
 
-        now = time.time()
-        message = qm.Message(content=json.dumps(events), content_type='text/plain', durable=True,
+        message = qm.Message(content=body, content_type=self._serializer.content_type, durable=True,
                              properties=msg_headers, user_id='guest')
-        self.sender.send(message, sync=True)
-        elapsed = time.time() - now
-        log.info('Published %d messages to QPID in %.2f secs', len(events), elapsed)
+        instance = headers.get('sensor') if headers else None
+        # the events are counted once confirmed, or requeued if they fail, by _settle
+        self._settle(*self._pipeline.send(message, (events, instance, time.time())))
+        return self.PENDING
@@ -0,0 +1,131 @@
+"""
+@package mi.core.instrument.serializer
+@file /mi-instrument/mi/core/instrument/serializer.py
+@brief Encoding of published events
+
+Publishers encode each batch of events once with a Serializer, selected by
+name ('json' or 'msgpack', e.g. with ?codec=msgpack on the publisher URL).
+Events which can not be encoded are dropped from the batch individually
+instead of every event being test encoded as it is queued.
+
+Messages encoded with anything but the default JSON codec carry the codec
+name in the CODEC_HEADER header, consumers use serializer_for_headers to
+pick the matching decoder.
+"""
+import json
+
+from mi.logging import log
+
+CODEC_HEADER = 'codec'
+DEFAULT_CODEC = 'json'
+
+# errors raised when an object can not be encoded
+ENCODE_ERRORS = (TypeError, ValueError, OverflowError, UnicodeDecodeError)
+
+
+class Serializer(object):
+    name = None
+    content_type = None
+
+    def dumps(self, obj):
+        raise NotImplementedError
+
+    def loads(self, data):
+        raise NotImplementedError
+
+    def encode_events(self, events):
+        """
+        Encode a list of events as a single message
+        @returns the encoded message and the list of events actually encoded
+        """
+        try:
+            return self.dumps(events), events
+        except ENCODE_ERRORS:
+            pass
+
+        # find the offending events, the rest still get published
+        good = []
+        for event in events:
+            try:
+                self.dumps(event)
+                good.append(event)
+            except ENCODE_ERRORS as e:
+                log.error('Unable to encode event as %s: %r %r', self.name, event, e)
+        return self.dumps(good), good
+
+    def headers(self, headers):
+        """
+        Return headers with the codec header added, if this is not the default codec
+        """
+        if self.name != DEFAULT_CODEC:
+            headers = dict(headers)
+            headers[CODEC_HEADER] = self.name
+        return headers
+
+
+class JsonSerializer(Serializer):
+    """
+    Compact JSON using a reusable encoder. Circular references are not
+    checked for, they fail on the recursion limit instead.
+    """
+    name = 'json'
+    content_type = 'text/plain'
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(separators=(',', ':'), check_circular=False)
+        self._decoder = json.JSONDecoder()
+
+    def dumps(self, obj):
+        try:
+            return self._encoder.encode(obj)
+        except RuntimeError as e:
+            raise ValueError('Unable to encode %s: %s' % (type(obj).__name__, e))
+
+    def loads(self, data):
+        return self._decoder.decode(data)
+
+
+class MsgpackSerializer(Serializer):
+    """
+    MessagePack, strings are packed as raw (utf-8) and unpacked as unicode
+    so messages decode to the same objects as JSON
+    """
+    name = 'msgpack'
+    content_type = 'application/x-msgpack'
+
+    def __init__(self):
+        import msgpack
+        self._msgpack = msgpack
+
+    def dumps(self, obj):
+        return self._msgpack.packb(obj, use_bin_type=False)
+
+    def loads(self, data):
+        return self._msgpack.unpackb(data, raw=False)
+
+
+SERIALIZERS = {
+    JsonSerializer.name: JsonSerializer,
+    MsgpackSerializer.name: MsgpackSerializer,
+}
+_instances = {}
+
+
+def get_serializer(codec=None):
+    """
+    Return the (shared) serializer for a codec name, JSON if None
+    @raise ValueError for an unknown codec
+    """
+    codec = codec or DEFAULT_CODEC
+    if codec not in _instances:
+        if codec not in SERIALIZERS:
+            raise ValueError('Unknown codec: %r (expected one of %s)' % (codec, ', '.join(sorted(SERIALIZERS))))
+        _instances[codec] = SERIALIZERS[codec]()
+    return _instances[codec]
+
+
+def serializer_for_headers(headers):
+    """
+    Return the serializer for a received message, given its headers
+    """
+    return get_serializer((headers or {}).get(CODEC_HEADER))
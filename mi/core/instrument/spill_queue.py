@@ -0,0 +1,223 @@
+"""
+@package mi.core.instrument.spill_queue
+@file /mi-instrument/mi/core/instrument/spill_queue.py
+@brief Disk overflow for the publisher queue
+
+Events which do not fit in a publisher's in-memory queue (for example while
+the broker is unreachable) are written to a directory of append-only segment
+files, each event a length prefixed record encoded with the publisher's
+serializer. Segments are memory mapped to read the events back in order and
+deleted once fully read.
+
+Events can also be put back in front of the queue (prepend), these are
+written to a new segment numbered before the current head. Segments left
+behind by a previous process are picked up again when the queue is opened,
+so spilled events survive a restart. A partly read segment is replayed from
+its start after a restart, so events may be published twice. Events are
+only lost if the process dies after their segment was deleted but before
+they were published.
+"""
+import glob
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+from mi.core.instrument.serializer import get_serializer
+from mi.logging import log
+
+RECORD_HEADER = struct.Struct('>I')
+SEGMENT_SUFFIX = '.spill'
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+# segments are numbered from here so prepended segments stay positive
+FIRST_SEGMENT = 10 ** 12
+
+
+class Segment(object):
+    def __init__(self, directory, number):
+        self.number = number
+        self.path = os.path.join(directory, '%020d%s' % (number, SEGMENT_SUFFIX))
+        self.count = 0
+        self.size = 0
+        self.read_offset = 0
+        self.writer = None
+
+    def open_writer(self):
+        self.writer = open(self.path, 'ab')
+
+    def write(self, record):
+        self.writer.write(RECORD_HEADER.pack(len(record)))
+        self.writer.write(record)
+        self.size += RECORD_HEADER.size + len(record)
+        self.count += 1
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def _map(self):
+        self.flush()
+        with open(self.path, 'rb') as fh:
+            if not os.fstat(fh.fileno()).st_size:
+                return None
+            return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, count):
+        """
+        Return the next count (at most) records
+        """
+        records = []
+        mapped = self._map()
+        if mapped is None:
+            return records
+        try:
+            offset = self.read_offset
+            while len(records) < count and self.count:
+                size, = RECORD_HEADER.unpack_from(mapped, offset)
+                offset += RECORD_HEADER.size
+                records.append(mapped[offset:offset + size])
+                offset += size
+                self.count -= 1
+            self.read_offset = offset
+        finally:
+            mapped.close()
+        return records
+
+    def recover(self):
+        """
+        Count the complete records of an existing segment, a partial record
+        at the end (from a process which died while writing) is ignored
+        """
+        mapped = self._map()
+        if mapped is None:
+            return
+        try:
+            end = len(mapped)
+            offset = 0
+            while offset + RECORD_HEADER.size <= end:
+                size, = RECORD_HEADER.unpack_from(mapped, offset)
+                if offset + RECORD_HEADER.size + size > end:
+                    log.warn('Ignoring partial record at the end of %s', self.path)
+                    break
+                offset += RECORD_HEADER.size + size
+                self.count += 1
+            self.size = offset
+        finally:
+            mapped.close()
+
+    def delete(self):
+        self.close_writer()
+        os.unlink(self.path)
+
+
+class SpillQueue(object):
+    def __init__(self, path=None, serializer=None, segment_size=DEFAULT_SEGMENT_SIZE):
+        """
+        @param path directory for the segment files, a temporary directory
+                    (removed on close) if None
+        @param serializer serializer used to encode the events, JSON by default
+        @param segment_size start a new segment once the current one reaches this size
+        """
+        self._serializer = serializer if serializer is not None else get_serializer()
+        self._segment_size = segment_size
+        self._temporary = path is None
+        if path is None:
+            path = tempfile.mkdtemp(prefix='publisher_spill_')
+        elif not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self._segments = []
+        self._count = 0
+        self._recover()
+
+    def _recover(self):
+        for segment_path in sorted(glob.glob(os.path.join(self.path, '*' + SEGMENT_SUFFIX))):
+            name = os.path.basename(segment_path)[:-len(SEGMENT_SUFFIX)]
+            segment = Segment(self.path, int(name))
+            segment.recover()
+            if segment.count:
+                self._segments.append(segment)
+                self._count += segment.count
+            else:
+                segment.delete()
+        if self._count:
+            log.info('Recovered %d spilled events from %s', self._count, self.path)
+
+    def __len__(self):
+        return self._count
+
+    def _encode(self, event):
+        try:
+            return self._serializer.dumps(event)
+        except Exception as e:
+            log.error('Unable to spill event: %r %r', event, e)
+
+    def _new_segment(self, number):
+        segment = Segment(self.path, number)
+        segment.open_writer()
+        return segment
+
+    def append(self, event):
+        """
+        Append an event, returns False if it could not be encoded
+        """
+        record = self._encode(event)
+        if record is None:
+            return False
+
+        tail = self._segments[-1] if self._segments else None
+        if tail is None or tail.writer is None or tail.size >= self._segment_size:
+            if tail is not None:
+                tail.close_writer()
+            tail = self._new_segment(tail.number + 1 if tail is not None else FIRST_SEGMENT)
+            self._segments.append(tail)
+
+        tail.write(record)
+        self._count += 1
+        return True
+
+    def prepend(self, events):
+        """
+        Put events (in order) in front of those already queued
+        """
+        records = [record for record in (self._encode(event) for event in events) if record is not None]
+        if not records:
+            return
+
+        head = self._segments[0] if self._segments else None
+        segment = self._new_segment(head.number - 1 if head is not None else FIRST_SEGMENT)
+        for record in records:
+            segment.write(record)
+        segment.close_writer()
+        self._segments.insert(0, segment)
+        self._count += len(records)
+
+    def read(self, count):
+        """
+        Remove and return up to count of the oldest events
+        """
+        events = []
+        while len(events) < count and self._segments:
+            head = self._segments[0]
+            events.extend(self._serializer.loads(record) for record in head.read(count - len(events)))
+            if not head.count:
+                head.delete()
+                self._segments.pop(0)
+        self._count -= len(events)
+        return events
+
+    def flush(self):
+        if self._segments:
+            self._segments[-1].flush()
+
+    def close(self):
+        for segment in self._segments:
+            segment.close_writer()
+        if self._temporary and not self._count:
+            shutil.rmtree(self.path, ignore_errors=True)
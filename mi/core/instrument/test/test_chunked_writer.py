@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_chunked_writer
+@file mi/core/instrument/test/test_chunked_writer.py
+@brief Test cases for the chunked NetCDF and Parquet writers
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from nose.plugins.attrib import attr
+
+from mi.core.instrument.chunked_writer import chunked_writer
+from mi.core.instrument.file_publisher import FilePublisher
+from mi.core.instrument.publisher import Publisher
+from mi.core.unit_test import MiUnitTestCase
+
+try:
+    import netCDF4
+    import xarray as xr
+except ImportError:
+    netCDF4 = None
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+def make_particle(index):
+    return {
+        'stream_name': 'ctd',
+        'internal_timestamp': 3600000000.0 + index,
+        'values': [{'value_id': 'temp', 'value': index},
+                   {'value_id': 'spectrum', 'value': [index, index + 1, index + 2]}]
+    }
+
+
+@attr('UNIT', group='mi')
+class UnitTestChunkedWriter(MiUnitTestCase):
+
+    def setUp(self):
+        self.output_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_path)
+
+    def write(self, fmt, particles, chunk_rows=4):
+        writer = chunked_writer(fmt, self.output_path, chunk_rows)
+        for particle in particles:
+            writer.add_particle(particle['stream_name'], particle)
+        writer.close()
+        return writer
+
+    @unittest.skipIf(netCDF4 is None, 'netCDF4 is not installed')
+    def test_netcdf(self):
+        particles = [make_particle(index) for index in xrange(10)]
+        particles[5]['values'][0]['value'] = None
+        particles[7]['values'].append({'value_id': 'serial', 'value': 'abc'})
+        writer = self.write('netcdf', particles)
+
+        self.assertEqual(len(writer), 10)
+        self.assertEqual(os.listdir(self.output_path), ['ctd.nc'])
+
+        ds = xr.open_dataset(os.path.join(self.output_path, 'ctd.nc')).load()
+        self.assertEqual(ds.spectrum.shape, (10, 3))
+        self.assertEqual(ds.spectrum.values[9].tolist(), [9, 10, 11])
+        self.assertTrue(np.isnan(ds.temp.values[5]))
+        self.assertEqual(ds.temp.values[6], 6)
+        self.assertEqual(ds.serial.values[7], 'abc')
+
+        variable = netCDF4.Dataset(os.path.join(self.output_path, 'ctd.nc')).variables['temp']
+        self.assertTrue(variable.filters()['zlib'])
+
+    @unittest.skipIf(netCDF4 is None, 'netCDF4 is not installed')
+    def test_netcdf_rollover(self):
+        particles = [make_particle(index) for index in xrange(6)]
+        particles[5]['values'][1]['value'] = [1, 2]
+        writer = self.write('netcdf', particles)
+
+        self.assertEqual(sorted(os.listdir(self.output_path)), ['ctd.nc', 'ctd_1.nc'])
+        self.assertEqual(len(writer), 6)
+        ds = xr.open_dataset(os.path.join(self.output_path, 'ctd_1.nc')).load()
+        self.assertEqual(ds.temp.values.tolist(), [4, 5])
+
+    @unittest.skipIf(pq is None, 'pyarrow is not installed')
+    def test_parquet(self):
+        particles = [make_particle(index) for index in xrange(10)]
+        particles[5]['values'][0]['value'] = None
+        self.write('parquet', particles)
+
+        parquet_file = pq.ParquetFile(os.path.join(self.output_path, 'ctd.parquet'))
+        self.assertEqual(parquet_file.num_row_groups, 3)
+
+        df = parquet_file.read().to_pandas()
+        self.assertEqual(len(df), 10)
+        self.assertTrue(np.isnan(df.temp[5]))
+        self.assertEqual(df.temp[9], 9)
+        self.assertEqual(list(df.spectrum[2]), [2, 3, 4])
+
+    @unittest.skipIf(pq is None, 'pyarrow is not installed')
+    def test_parquet_publisher(self):
+        publisher = Publisher.from_url('parquet://%s?rows=2' % self.output_path)
+        # nothing is kept in memory to build dataframes from
+        self.assertNotIsInstance(publisher, FilePublisher)
+        publisher._publish([{'type': 'DRIVER_ASYNC_EVENT_SAMPLE', 'value': make_particle(index)}
+                            for index in xrange(5)], None)
+        publisher.write()
+
+        parquet_file = pq.ParquetFile(os.path.join(self.output_path, 'ctd.parquet'))
+        self.assertEqual(parquet_file.num_row_groups, 3)
+        self.assertEqual(parquet_file.metadata.num_rows, 5)
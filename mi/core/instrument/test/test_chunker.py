@@ -13,7 +13,7 @@ __license__ = 'Apache 2.0'
 from functools import partial
 
 import re
-from mi.core.instrument.chunker import StringChunker
+from mi.core.instrument.chunker import StringChunker, combine_regexes, incremental_sieve, is_incremental_sieve
 from mi.core.unit_test import MiUnitTestCase
 from mi.logging import log
 from nose.plugins.attrib import attr
@@ -200,3 +200,130 @@ class UnitTestStringChunker(MiUnitTestCase):
         self.assertEqual([], StringChunker._prune_overlaps([]))
         self.assertEqual([(0, 5)], StringChunker._prune_overlaps([(0, 5), (3, 6)]))
         self.assertEqual([(0, 5), (5, 7)], StringChunker._prune_overlaps([(0, 5), (5, 7), (6, 8)]))
+
+    def test_timestamps_many_chunks(self):
+        """
+        Feed data in many small pieces, the chunk gets the timestamp of its
+        first byte and the timestamps of the consumed bytes are dropped
+        """
+        for index, char in enumerate("Foo"):
+            self._chunker.add_chunk(char, float(index))
+        self._chunker.add_chunk(self.SAMPLE_1[:10], 3.0)
+        self._chunker.add_chunk(self.SAMPLE_1[10:], 4.0)
+        for index, char in enumerate("BLEH"):
+            self._chunker.add_chunk(char, float(index + 5))
+
+        (time, result) = self._chunker.get_next_data()
+        self.assertEquals(result, self.SAMPLE_1)
+        self.assertEquals(time, 3.0)
+        self.assertEqual(self._chunker.buffer, "BLEH")
+        self.assertEqual(self._chunker.timestamps, [(0, 1, 5.0), (1, 2, 6.0), (2, 3, 7.0), (3, 4, 8.0)])
+
+    def test_max_buff_size(self):
+        """
+        Verify the oldest data is dropped when the buffer grows past its limit
+        """
+        self._chunker = StringChunker(UnitTestStringChunker.sieve_function, max_buff_size=20)
+        self._chunker.add_chunk(self.FRAGMENT_1, self.TIMESTAMP_1)
+        self._chunker.add_chunk("0123456789", self.TIMESTAMP_2)
+
+        self.assertEqual(self._chunker.buffer, self.FRAGMENT_1[7:] + "0123456789")
+        self.assertEqual(self._chunker.timestamps, [(-7, 10, self.TIMESTAMP_1), (10, 20, self.TIMESTAMP_2)])
+        self.assertEqual(self._chunker._find_timestamp(0), self.TIMESTAMP_1)
+        self.assertEqual(self._chunker._find_timestamp(10), self.TIMESTAMP_2)
+
+    def test_compaction(self):
+        """
+        Push enough samples through to force the buffer and timestamp lists to compact
+        """
+        for index in xrange(2500):
+            self._chunker.add_chunk(self.FRAGMENT_1, float(index))
+            self._chunker.add_chunk(self.FRAGMENT_2 + "\r\n", float(index) + 0.5)
+            (time, result) = self._chunker.get_next_data()
+            self.assertEquals(result, self.FRAGMENT_SAMPLE)
+            self.assertEquals(time, float(index))
+
+        self.assertEqual(self._chunker.buffer, "\r\n")
+        self.assertEqual(self._chunker.timestamps, [(-14, 2, 2499.5)])
+
+    def test_incremental_sieve(self):
+        """
+        Verify an incremental sieve is handed the offset of the unscanned data
+        """
+        scan_offsets = []
+
+        def sieve(raw_data, scan_from=0):
+            scan_offsets.append(scan_from)
+            return UnitTestStringChunker.sieve_function(raw_data)
+        sieve = incremental_sieve(sieve)
+
+        self._chunker = StringChunker(sieve)
+        self._chunker.add_chunk("junk" + self.FRAGMENT_1, self.TIMESTAMP_1)
+        self._chunker.add_chunk(self.FRAGMENT_2, self.TIMESTAMP_2)
+        self._chunker.add_chunk(self.FRAGMENT_1, self.TIMESTAMP_3)
+
+        self.assertEqual(scan_offsets, [0, 21, 0])
+        self.assertEqual(self._chunker.get_next_data(), (self.TIMESTAMP_1, self.FRAGMENT_SAMPLE))
+        self.assertTrue(is_incremental_sieve(partial(sieve)))
+        self.assertFalse(is_incremental_sieve(UnitTestStringChunker.sieve_function))
+
+    def test_incremental_sieve_view(self):
+        """
+        Verify an incremental sieve scans the buffer in place and chunks are still strings
+        """
+        seen = []
+
+        def sieve(raw_data, scan_from=0):
+            seen.append(raw_data)
+            return UnitTestStringChunker.sieve_function(raw_data)
+
+        self._chunker = StringChunker(incremental_sieve(sieve))
+        self._chunker.add_chunk("junk" + self.FRAGMENT_1, self.TIMESTAMP_1)
+        self._chunker.add_chunk(self.FRAGMENT_2, self.TIMESTAMP_2)
+
+        self.assertNotIsInstance(seen[0], str)
+        (time, result) = self._chunker.get_next_data()
+        self.assertIs(type(result), str)
+        self.assertEqual(result, self.FRAGMENT_SAMPLE)
+        self.assertEqual(self._chunker.buffer, "")
+
+    def test_regex_sieve_scan_from(self):
+        """
+        Verify the regex sieve only reports matches ending in the unscanned data
+        """
+        bounded = re.compile(r'SATPAR\d{4},\d{1,7}.\d\d,\d{10},\d{1,3}\r\n')
+        unbounded = re.compile(r'SATPAR.*?\r\n')
+        data = "%s\r\n%s\r\n" % (self.SAMPLE_1, self.SAMPLE_2)
+
+        for regex in [bounded, unbounded]:
+            self.assertEqual([(0, 33), (33, 66)], StringChunker.regex_sieve_function(data, [regex]))
+            self.assertEqual([(33, 66)], StringChunker.regex_sieve_function(data, [regex], scan_from=33))
+            self.assertEqual([(33, 66)], StringChunker.regex_sieve_function(data, [regex], scan_from=65))
+            self.assertEqual([], StringChunker.regex_sieve_function(data, [regex], scan_from=66))
+
+    def test_regex_sieve_incremental_chunker(self):
+        """
+        Feed a regex sieve chunker a byte at a time and verify every sample is found
+        """
+        regex = re.compile(r'SATPAR\d{4},\d{1,7}.\d\d,\d{10},\d{1,3}\r\n')
+        self._chunker = StringChunker(partial(StringChunker.regex_sieve_function, regex_list=[regex]))
+        data = "junk%s\r\n%s\r\nmore junk%s\r\n" % (self.SAMPLE_1, self.SAMPLE_2, self.SAMPLE_3)
+        for char in data:
+            self._chunker.add_chunk(char, self.TIMESTAMP_1)
+
+        results = [self._chunker.get_next_data()[1] for _ in range(4)]
+        self.assertEqual(results, [self.SAMPLE_1 + "\r\n", self.SAMPLE_2 + "\r\n", self.SAMPLE_3 + "\r\n", None])
+
+    def test_regex_sieve_combine(self):
+        """
+        Verify combining regexes gives the same results as separate scans
+        """
+        regex_list = [re.compile(r'SATPAR\d{4},10.01,\d{10},\d{1,3}'),
+                      re.compile(r'SATPAR\d{4},10.02,\d{10},\d{1,3}'),
+                      re.compile(r'(X)\1')]
+        data = "%s\r\n%s\r\nXX" % (self.SAMPLE_1, self.SAMPLE_2)
+
+        combined = combine_regexes(regex_list)
+        self.assertEqual(len(combined), 2)
+        self.assertEqual(sorted(StringChunker.regex_sieve_function(data, regex_list)),
+                         sorted(StringChunker.regex_sieve_function(data, regex_list, combine=True)))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_datalog
+@file mi/core/instrument/test/test_datalog.py
+@brief Test cases for the mmap backed datalog reader
+"""
+
+__license__ = 'Apache 2.0'
+
+import mmap
+import struct
+import tempfile
+
+from mock import patch
+from nose.plugins.attrib import attr
+
+from mi.core.instrument.datalog import read_packets, HEADER_FORMAT, HEADER_SIZE, SYNC
+from mi.core.instrument.port_agent_client import py_lrc
+from mi.core.unit_test import MiUnitTestCase
+
+
+def make_packet(packet_type, payload, timestamp=3600.5, checksum=None):
+    upper = int(timestamp)
+    lower = int((timestamp - upper) * 2 ** 32)
+    header = struct.pack(HEADER_FORMAT, SYNC, packet_type, len(payload) + HEADER_SIZE, 0, upper, lower)
+    if checksum is None:
+        checksum = py_lrc(payload, py_lrc(header))
+    header = struct.pack(HEADER_FORMAT, SYNC, packet_type, len(payload) + HEADER_SIZE, checksum, upper, lower)
+    return header + payload
+
+
+@attr('UNIT', group='mi')
+class UnitTestDatalog(MiUnitTestCase):
+
+    def open(self, contents):
+        fh = tempfile.TemporaryFile()
+        self.addCleanup(fh.close)
+        fh.write(contents)
+        fh.flush()
+        return fh
+
+    def read(self, contents, **kwargs):
+        # the views are only valid while reading
+        return [packet._replace(header=packet.header.tobytes(), payload=packet.payload.tobytes())
+                for packet in read_packets(self.open(contents), **kwargs)]
+
+    def test_read_packets(self):
+        contents = ''.join([
+            'garbage',
+            make_packet(1, 'first'),
+            make_packet(4, 'status'),
+            make_packet(1, 'has a %s sync' % SYNC),
+            make_packet(1, ''),
+        ])
+        packets = self.read(contents)
+        self.assertEqual([p.payload for p in packets], ['first', 'status', 'has a %s sync' % SYNC, ''])
+        self.assertEqual([p.packet_type for p in packets], [1, 4, 1, 1])
+        self.assertEqual(packets[0].offset, 7)
+        self.assertEqual(packets[0].time, 3600.5)
+        self.assertEqual(packets[0].header, contents[7:7 + HEADER_SIZE])
+
+        packets = self.read(contents, packet_types=[4])
+        self.assertEqual([p.payload for p in packets], ['status'])
+
+    def test_invalid_packets(self):
+        bad = make_packet(1, 'bad %s' % make_packet(1, 'inner'), checksum=0x55)
+        contents = make_packet(1, 'one') + bad + make_packet(1, 'two') + make_packet(1, 'truncated')[:-2]
+        packets = self.read(contents, validate=True)
+        # the corrupt packet is skipped and the scan resynchronises on the embedded packet
+        self.assertEqual([p.payload for p in packets], ['one', 'inner', 'two'])
+
+        # by default packets are delivered whatever their checksum
+        packets = self.read(contents)
+        self.assertEqual([p.payload for p in packets], ['one', 'bad %s' % make_packet(1, 'inner'), 'two'])
+
+    def test_blocks(self):
+        payloads = ['payload %d' % index for index in xrange(100)]
+        contents = ''.join(make_packet(1, payload) for payload in payloads)
+        packets = self.read(contents, block_packets=7)
+        self.assertEqual([p.payload for p in packets], payloads)
+
+    def test_empty(self):
+        self.assertEqual(self.read(''), [])
+
+    def test_unmapped(self):
+        mapped = []
+        real_mmap = mmap.mmap
+
+        def map_file(*args, **kwargs):
+            mapped.append(real_mmap(*args, **kwargs))
+            return mapped[-1]
+
+        contents = make_packet(1, 'one') + make_packet(1, 'two')
+        with patch('mi.core.instrument.datalog.mmap.mmap', side_effect=map_file):
+            list(read_packets(self.open(contents)))
+            packets = read_packets(self.open(contents))
+            next(packets)
+            packets.close()
+
+        # the file is unmapped once the generator finishes or is closed
+        self.assertEqual(len(mapped), 2)
+        for each in mapped:
+            self.assertRaises(ValueError, each.find, SYNC)
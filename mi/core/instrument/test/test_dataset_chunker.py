@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_dataset_chunker
+@file mi/core/instrument/test/test_dataset_chunker.py
+@brief Test cases for the dataset chunker module
+"""
+
+__license__ = 'Apache 2.0'
+
+from functools import partial
+
+import re
+from mi.core.instrument.chunker import incremental_sieve
+from mi.core.instrument.dataset_chunker import StringChunker, BinaryChunker
+from mi.core.unit_test import MiUnitTestCase
+from nose.plugins.attrib import attr
+
+
+@attr('UNIT', group='mi')
+class UnitTestDatasetChunker(MiUnitTestCase):
+    """
+    Test the data, non-data and raw bookkeeping of the dataset chunker
+    """
+    SAMPLE_1 = "SATPAR0229,10.01,2206748111,111\r\n"
+    SAMPLE_2 = "SATPAR0229,10.02,2206748222,222\r\n"
+    SAMPLE_3 = "SATPAR0229,10.03,2206748333,333\r\n"
+
+    REGEX = re.compile(r'SATPAR\d{4},\d{1,7}.\d\d,\d{10},\d{1,3}\r\n')
+
+    TIMESTAMP_1 = 3569168821.102485
+    TIMESTAMP_2 = 3569168822.202485
+    TIMESTAMP_3 = 3569168823.302485
+
+    def setUp(self):
+        self._chunker = StringChunker(partial(StringChunker.regex_sieve_function, regex_list=[self.REGEX]))
+
+    def test_data_and_non_data(self):
+        """
+        Data and non-data blocks are separated, with indices relative to the current buffer
+        """
+        self._chunker.add_chunk("junk" + self.SAMPLE_1 + "more" + self.SAMPLE_2, self.TIMESTAMP_1)
+
+        self.assertEqual(self._chunker.get_next_non_data_with_index(clean=False),
+                         (self.TIMESTAMP_1, "junk", 0, 4))
+        self.assertEqual(self._chunker.get_next_data_with_index(clean=False),
+                         (self.TIMESTAMP_1, self.SAMPLE_1, 4, 37))
+
+        self.assertEqual(self._chunker.get_next_non_data(), (self.TIMESTAMP_1, "junk"))
+        self.assertEqual(self._chunker.get_next_data_with_index(), (self.TIMESTAMP_1, self.SAMPLE_1, 0, 33))
+        self.assertEqual(self._chunker.get_next_non_data_with_index(), (self.TIMESTAMP_1, "more", 0, 4))
+        self.assertEqual(self._chunker.get_next_data_with_index(), (self.TIMESTAMP_1, self.SAMPLE_2, 0, 33))
+        self.assertEqual(self._chunker.get_next_data(), (None, None))
+        self.assertEqual(self._chunker.get_next_non_data(), (None, None))
+        self.assertEqual(self._chunker.buffer, "")
+
+    def test_fragment(self):
+        """
+        A fragment is non-data until it is completed, then it becomes data with the first timestamp
+        """
+        self._chunker.add_chunk(self.SAMPLE_1[:10], self.TIMESTAMP_1)
+        self.assertEqual(self._chunker.nondata_chunk_list, [(0, 10, self.TIMESTAMP_1)])
+        self.assertEqual(self._chunker.get_next_data(), (None, None))
+
+        self._chunker.add_chunk(self.SAMPLE_1[10:] + self.SAMPLE_2[:5], self.TIMESTAMP_2)
+        self.assertEqual(self._chunker.raw_chunk_list, [(0, 10, self.TIMESTAMP_1), (10, 38, self.TIMESTAMP_2)])
+        self.assertEqual(self._chunker.data_chunk_list, [(0, 33, self.TIMESTAMP_1)])
+        self.assertEqual(self._chunker.nondata_chunk_list, [])
+
+        self.assertEqual(self._chunker.get_next_data(), (self.TIMESTAMP_1, self.SAMPLE_1))
+        self.assertEqual(self._chunker.raw_chunk_list, [(0, 5, self.TIMESTAMP_2)])
+
+        self._chunker.add_chunk(self.SAMPLE_2[5:], self.TIMESTAMP_3)
+        self.assertEqual(self._chunker.get_next_data(), (self.TIMESTAMP_2, self.SAMPLE_2))
+
+    def test_non_data_merge(self):
+        """
+        Non-data spread over several chunks is merged into one block
+        """
+        self._chunker.add_chunk("junk", self.TIMESTAMP_1)
+        self._chunker.add_chunk("more", self.TIMESTAMP_2)
+        self._chunker.add_chunk(self.SAMPLE_3, self.TIMESTAMP_3)
+
+        self.assertEqual(self._chunker.get_next_non_data(), (self.TIMESTAMP_1, "junkmore"))
+        self.assertEqual(self._chunker.get_next_data(), (self.TIMESTAMP_3, self.SAMPLE_3))
+
+    def test_get_next_raw(self):
+        """
+        Fetching raw data consumes the buffer and drops the data it overlaps
+        """
+        self._chunker.add_chunk(self.SAMPLE_1 + self.SAMPLE_2[:10], self.TIMESTAMP_1)
+        self._chunker.add_chunk(self.SAMPLE_2[10:], self.TIMESTAMP_2)
+
+        self.assertEqual(self._chunker.get_next_raw(), (self.TIMESTAMP_1, self.SAMPLE_1 + self.SAMPLE_2[:10]))
+        self.assertEqual(self._chunker.data_chunk_list, [])
+        self.assertEqual(self._chunker.nondata_chunk_list, [(0, 23, self.TIMESTAMP_1)])
+        self.assertEqual(self._chunker.get_next_raw(), (self.TIMESTAMP_2, self.SAMPLE_2[10:]))
+        self.assertEqual(self._chunker.get_next_raw(), (None, None))
+
+    def test_clean_all_chunks(self):
+        self._chunker.add_chunk("junk" + self.SAMPLE_1 + self.SAMPLE_2[:10], self.TIMESTAMP_1)
+        self._chunker.clean_all_chunks()
+
+        self.assertEqual(self._chunker.buffer, "")
+        self.assertEqual(self._chunker.raw_chunk_list, [])
+        self.assertEqual(self._chunker.get_next_data(), (None, None))
+        self.assertEqual(self._chunker.get_next_non_data(), (None, None))
+
+        self._chunker.add_chunk(self.SAMPLE_3, self.TIMESTAMP_3)
+        self.assertEqual(self._chunker.get_next_data_with_index(), (self.TIMESTAMP_3, self.SAMPLE_3, 0, 33))
+
+    def test_many_chunks(self):
+        """
+        Stream enough samples through to force the buffer and raw list to compact
+        """
+        for index in xrange(5000):
+            self._chunker.add_chunk(self.SAMPLE_1[:20], float(index))
+            self._chunker.add_chunk(self.SAMPLE_1[20:], float(index) + 0.5)
+            self.assertEqual(self._chunker.get_next_data(), (float(index), self.SAMPLE_1))
+
+        self.assertEqual(self._chunker.buffer, "")
+        self.assertEqual(self._chunker.raw_chunk_list, [])
+
+    def test_incremental_sieve_view(self):
+        """
+        An incremental sieve scans the buffer in place, data and non-data are still strings
+        """
+        seen = []
+
+        def sieve(raw_data, scan_from=0):
+            seen.append(raw_data)
+            return StringChunker.regex_sieve_function(raw_data, [self.REGEX], scan_from=scan_from)
+
+        self._chunker = StringChunker(incremental_sieve(sieve))
+        self._chunker.add_chunk("junk" + self.SAMPLE_1[:10], self.TIMESTAMP_1)
+        self._chunker.add_chunk(self.SAMPLE_1[10:], self.TIMESTAMP_2)
+
+        self.assertFalse(any(isinstance(raw_data, str) for raw_data in seen))
+        self.assertEqual(self._chunker.get_next_non_data(), (self.TIMESTAMP_1, "junk"))
+        (timestamp, data) = self._chunker.get_next_data()
+        self.assertIs(type(data), str)
+        self.assertEqual((timestamp, data), (self.TIMESTAMP_1, self.SAMPLE_1))
+
+    def test_binary(self):
+        """
+        The binary chunker accepts any buffer and hands back byte strings
+        """
+        self._chunker = BinaryChunker(lambda data: [(m.start(), m.end()) for m in re.finditer('\x01.{3}\x03', data)])
+        self._chunker.add_chunk(bytearray('\x00\x01ab'), self.TIMESTAMP_1)
+        self._chunker.add_chunk(memoryview('c\x03\x01'), self.TIMESTAMP_2)
+
+        self.assertEqual(self._chunker.get_next_data_with_index(), (self.TIMESTAMP_1, '\x01abc\x03', 1, 6))
+        self.assertEqual(self._chunker.buffer, '\x01')
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_dataset_data_particle
+@file mi/core/instrument/test/test_dataset_data_particle.py
+@brief Test cases for the cached generation of dataset data particles
+"""
+
+__license__ = 'Apache 2.0'
+
+import json
+
+from nose.plugins.attrib import attr
+
+from mi.core.instrument.dataset_data_particle import DataParticle, DataParticleKey
+from mi.core.unit_test import MiUnitTestCase
+
+
+class CountingParticle(DataParticle):
+    _data_particle_type = 'test_particle'
+
+    def __init__(self, *args, **kwargs):
+        self.builds = 0
+        super(CountingParticle, self).__init__(*args, **kwargs)
+
+    def _build_parsed_values(self):
+        self.builds += 1
+        return [self._encode_value('temp', self.raw_data, float)]
+
+
+@attr('UNIT', group='mi')
+class TestUnitDatasetDataParticle(MiUnitTestCase):
+
+    def new_particle(self, value='23.45', timestamp=3600000000.0):
+        return CountingParticle(value, internal_timestamp=timestamp,
+                                preferred_timestamp=DataParticleKey.INTERNAL_TIMESTAMP)
+
+    def test_generate_cached(self):
+        particle = self.new_particle()
+        particle.generate_dict()
+        generated = particle.generate()
+        self.assertIs(particle.generate(), generated)
+        self.assertEqual(particle.builds, 1)
+        self.assertEqual(json.loads(generated)[DataParticleKey.VALUES][0][DataParticleKey.VALUE], 23.45)
+
+        # callers get their own copy of the dictionary
+        particle.generate_dict().pop(DataParticleKey.DRIVER_TIMESTAMP)
+        self.assertIn(DataParticleKey.DRIVER_TIMESTAMP, particle.generate_dict())
+
+    def test_timestamp_invalidates(self):
+        particle = self.new_particle()
+        generated = particle.generate()
+
+        particle.set_internal_timestamp(3600000001.0)
+        self.assertEqual(json.loads(particle.generate())[DataParticleKey.INTERNAL_TIMESTAMP], 3600000001.0)
+
+        particle.set_value(DataParticleKey.INTERNAL_TIMESTAMP, 3600000000.0)
+        self.assertEqual(particle.generate(), generated)
+
+        particle.contents[DataParticleKey.QUALITY_FLAG] = 'questionable'
+        self.assertEqual(particle.generate_dict()[DataParticleKey.QUALITY_FLAG], 'questionable')
+        # the values are only ever built once
+        self.assertEqual(particle.builds, 1)
+
+    def test_value_digest(self):
+        particle = self.new_particle()
+        self.assertEqual(particle.value_digest(), self.new_particle(timestamp=3600000100.0).value_digest())
+        self.assertNotEqual(particle.value_digest(), self.new_particle('23.46').value_digest())
+        self.assertEqual(particle, self.new_particle())
+
+    def test_encoding_errors_kept(self):
+        particle = self.new_particle('bad')
+        particle.generate_dict()
+        particle.generate()
+        self.assertEqual(particle.get_encoding_errors(), [{'temp': 'bad'}])
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_particle_accumulator
+@file mi/core/instrument/test/test_particle_accumulator.py
+@brief Test cases for the columnar particle accumulator
+"""
+
+__license__ = 'Apache 2.0'
+
+import numpy as np
+from nose.plugins.attrib import attr
+
+from mi.core.instrument.particle_accumulator import Column, ParticleAccumulator, StreamColumns
+from mi.core.unit_test import MiUnitTestCase
+
+
+@attr('UNIT', group='mi')
+class UnitTestParticleAccumulator(MiUnitTestCase):
+
+    def test_column_types(self):
+        column = Column()
+        for row in xrange(100):
+            column.set(row, row)
+        self.assertEqual(column.values(100).dtype, np.int64)
+        self.assertEqual(column.values(100).tolist(), range(100))
+
+        column.set(100, 0.5)
+        self.assertEqual(column.values(101).dtype, np.float64)
+        self.assertEqual(column.values(101)[-2:].tolist(), [99.0, 0.5])
+
+        column.set(101, 'text')
+        self.assertEqual(column.values(102).dtype, np.object_)
+        self.assertEqual(column.values(102)[-3:].tolist(), [99, 0.5, 'text'])
+
+    def test_column_missing(self):
+        column = Column()
+        column.set(2, 5)
+        column.set(3, None)
+        column.set(4, 6)
+
+        values = column.values(6)
+        self.assertEqual(values.dtype, np.float64)
+        self.assertTrue(np.isnan(values[[0, 1, 3, 5]]).all())
+        self.assertEqual(values[[2, 4]].tolist(), [5, 6])
+        self.assertEqual(column.missing(6).tolist(), [True, True, False, True, False, True])
+
+        column = Column()
+        column.set(0, True)
+        column.set(2, False)
+        self.assertEqual(column.values(3).tolist(), [True, None, False])
+
+    def test_column_arrays(self):
+        column = Column()
+        column.set(0, [1, 2, 3])
+        column.set(1, [4.5, 5, 6])
+        column.set(3, [7, 8, 9])
+
+        values = column.values(4)
+        self.assertEqual(values.shape, (4, 3))
+        self.assertEqual(values.dtype, np.float64)
+        self.assertTrue(np.isnan(values[2]).all())
+
+        # arrays of a different shape fall back to a column of lists
+        column.set(4, [1, 2])
+        values = column.values(5)
+        self.assertEqual(values.shape, (5,))
+        self.assertEqual(values[0], [1, 2, 3])
+        self.assertEqual(values[4], [1, 2])
+
+    def test_accumulator(self):
+        accumulator = ParticleAccumulator()
+        for index in xrange(3):
+            accumulator.add_particle('stream_a', {
+                'stream_name': 'stream_a',
+                'internal_timestamp': 3600000000.0 + index,
+                'values': [{'value_id': 'temp', 'value': 10 + index},
+                           {'value_id': 'velocity', 'value': [index, index + 1]}]})
+        accumulator.add_sample('stream_b', {'x': 'y'})
+
+        self.assertEqual(len(accumulator), 4)
+
+        df = accumulator.to_dataframes()['stream_a']
+        self.assertEqual(list(df.columns), ['internal_timestamp', 'stream_name', 'temp', 'velocity'])
+        self.assertEqual(df.temp.tolist(), [10, 11, 12])
+        self.assertEqual(df.velocity[2].tolist(), [2, 3])
+
+        ds = accumulator.to_datasets()['stream_a']
+        self.assertEqual(ds.velocity.dims, ('index', 'velocity_dim_1'))
+        self.assertEqual(ds.velocity.values.tolist(), [[0, 1], [1, 2], [2, 3]])
+
+        records = accumulator.to_records()
+        self.assertEqual(records['stream_b'], [{'x': 'y'}])
+        self.assertEqual(records['stream_a'][1], {'stream_name': 'stream_a', 'internal_timestamp': 3600000001.0,
+                                                  'temp': 11, 'velocity': [1, 2]})
+
+    def test_missing_parameters(self):
+        columns = StreamColumns()
+        columns.append({'a': 1})
+        columns.append({'b': 2})
+
+        self.assertEqual(columns.to_records(), [{'a': 1.0}, {'b': 2.0}])
+        self.assertTrue(np.isnan(columns.arrays()['a'][1]))
+
+    def test_extend(self):
+        first = StreamColumns()
+        first.append({'a': 1, 'b': [1, 2]})
+        first.append({'c': 's'})
+
+        second = StreamColumns()
+        second.append({'a': 2.5, 'b': [3, 4]})
+        second.append({'a': None, 'c': 't', 'd': True})
+
+        third = StreamColumns()
+        third.append({'a': 7, 'b': [5, 6, 7]})
+
+        accumulator = ParticleAccumulator()
+        for columns in [first, second, third]:
+            accumulator.add_columns('stream', columns)
+
+        self.assertEqual(len(accumulator), 5)
+        self.assertEqual(accumulator.to_records()['stream'], [
+            {'a': 1.0, 'b': [1, 2]},
+            {'c': 's'},
+            {'a': 2.5, 'b': [3, 4]},
+            {'c': 't', 'd': True},
+            {'a': 7.0, 'b': [5, 6, 7]},
+        ])
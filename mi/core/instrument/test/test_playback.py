@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_playback
+@file mi/core/instrument/test/test_playback.py
+@brief Test cases for playing back segments of files in parallel
+
+This module is also the protocol module played back: each line 'L,<time>,<value>'
+is a particle and each file starts with a state change event.
+"""
+
+__license__ = 'Apache 2.0'
+
+import cPickle as pickle
+import os
+import re
+import shutil
+import tempfile
+
+from nose.plugins.attrib import attr
+
+from mi.core.instrument.instrument_driver import DriverAsyncEvent
+from mi.core.instrument.playback import ChunkyDatalogReader, PlaybackWrapper, SegmentPlayback, merge_segments, \
+    particle_key, split_segments
+from mi.core.unit_test import MiUnitTestCase
+
+MODULE = __name__
+LINE = re.compile(r'L,(\d+),(\d+)$')
+
+
+class LineProtocol(object):
+    def __init__(self, callback):
+        self.callback = callback
+        self.buffer = ''
+
+    def got_filename(self, filename):
+        self.callback(DriverAsyncEvent.STATE_CHANGE, os.path.basename(filename))
+
+    def got_data(self, packet):
+        lines = (self.buffer + packet.get_data()).split('\n')
+        self.buffer = lines.pop()
+        for line in lines:
+            match = LINE.match(line)
+            # the tail of a line begun in the previous file
+            if match:
+                self.callback(DriverAsyncEvent.SAMPLE, make_particle(*map(int, match.groups())))
+
+
+def create_playback_protocol(callback):
+    return LineProtocol(callback)
+
+
+def make_particle(timestamp, value):
+    return {'stream_name': 'line', 'port_timestamp': None, 'internal_timestamp': float(timestamp),
+            'preferred_timestamp': 'internal_timestamp', 'values': [{'value_id': 'value', 'value': value}]}
+
+
+def particle(timestamp, value=None):
+    return {'type': DriverAsyncEvent.SAMPLE, 'value': make_particle(timestamp, timestamp if value is None else value)}
+
+
+class Collector(object):
+    """
+    Publisher recording each event with its source
+    """
+    _max_events = 1000
+
+    def __init__(self):
+        self.source = None
+        self.events = []
+
+    def enqueue(self, event):
+        self.events.append((self.source, event))
+
+    def set_source(self, source):
+        self.source = source
+
+    def publish(self):
+        return 0
+
+
+@attr('UNIT', group='mi')
+class PlaybackSegmentUnitTest(MiUnitTestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def create_file(self, name, contents):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'w') as fh:
+            fh.write(contents)
+        return path
+
+    def create_files(self, count, lines):
+        """
+        count files of lines lines, one second apart, each file ending part way through a line
+        """
+        data = ''.join('L,%d,%d\n' % (index, index * 7) for index in xrange(count * lines))
+        size = len(data) / count
+        return [self.create_file('%02d.dat' % index, data[index * size:(index + 1) * size if index + 1 < count else None])
+                for index in xrange(count)]
+
+    def spill(self, records):
+        fh = tempfile.NamedTemporaryFile(dir=self.temp_dir, delete=False)
+        with fh:
+            for record in records:
+                pickle.dump(record, fh, pickle.HIGHEST_PROTOCOL)
+        return fh.name
+
+    def playback(self, files, jobs, overlap=20):
+        wrapper = PlaybackWrapper(MODULE, 'refdes', 'log://', 'log://', ChunkyDatalogReader, None, files, 1000,
+                                  jobs=jobs, overlap=overlap)
+        wrapper.event_publisher = Collector()
+        wrapper.particle_publisher = Collector()
+        wrapper.playback()
+        events = [event['value'] for _, event in wrapper.event_publisher.events]
+        particles = [(os.path.basename(source), event['value']['internal_timestamp'], event['value']['values'])
+                     for source, event in wrapper.particle_publisher.events]
+        return events, particles
+
+    def test_split_segments(self):
+        files = [self.create_file('%02d' % index, 'x' * size) for index, size in enumerate([10, 10, 50, 10, 10, 10])]
+
+        self.assertEqual(split_segments(files, 1), [files])
+        self.assertEqual(split_segments(files, 2), [files[:3], files[3:]])
+        segments = split_segments(files, 3)
+        self.assertEqual(sum(segments, []), files)
+        self.assertEqual(len(segments), 3)
+        self.assertEqual(len(split_segments(files[:2], 5)), 2)
+
+    def test_particle_key(self):
+        event = particle(10, 5)
+        same = particle(10, 5)
+        same['value']['values'] = [dict(reversed(each.items())) for each in same['value']['values']]
+        self.assertEqual(particle_key(event), particle_key(same))
+        self.assertNotEqual(particle_key(event), particle_key(particle(10, 6)))
+        self.assertNotEqual(particle_key(event), particle_key(particle(11, 5)))
+
+    def test_merge_segments(self):
+        state = {'type': DriverAsyncEvent.STATE_CHANGE, 'value': 'b'}
+        results = [
+            # segment one played into file b: particles 4 (only it could complete) and 5 (a duplicate)
+            (self.spill([(True, 'a', particle(1)), (False, 'a', state), (True, 'a', particle(3))]),
+             [('b', state)], [('b', particle(4)), ('b', particle(5))]),
+            (self.spill([(False, 'b', state), (True, 'b', particle(5)), (True, 'b', particle(6)),
+                         (True, 'c', particle(9))]),
+             [], []),
+        ]
+        collector = Collector()
+
+        merged = [(filename, event['value']['internal_timestamp'])
+                  for filename, event in merge_segments(iter(results), collector)]
+
+        self.assertEqual(merged, [('a', 1), ('a', 3), ('b', 4), ('b', 5), ('b', 6), ('c', 9)])
+        # the overlap events are not published twice
+        self.assertEqual([event for _, event in collector.events], [state, state])
+        # the spill files are removed once read
+        self.assertFalse(any(os.path.exists(path) for path, _, _ in results))
+
+    def test_merge_segments_without_timestamps(self):
+        # the particles held to compare against the overlap are bounded
+        results = [
+            (self.spill([(True, 'a', particle(0, 1))]), [], [('b', particle(0, 2))]),
+            (self.spill([(True, 'b', particle(0, value)) for value in xrange(2, 10)]), [], []),
+        ]
+        merged = [event['value']['values'][0]['value'] for _, event in merge_segments(iter(results), Collector())]
+        self.assertEqual(merged, range(1, 10))
+
+    def test_overlap_untimed_packets(self):
+        # chunky packets have no time, the overlap is bounded by particle time
+        files = self.create_files(2, 2000)
+        spill, events, particles = SegmentPlayback(MODULE, ChunkyDatalogReader, files[:1], files[1:], 20).play()
+        self.addCleanup(os.remove, spill)
+
+        self.assertEqual([event['value'] for _, event in events], ['01.dat'])
+        times = [event['value']['internal_timestamp'] for _, event in particles]
+        # the line straddling the files comes first
+        with open(files[0]) as fh:
+            self.assertEqual(times[0], fh.read().count('\n'))
+        self.assertLess(times[-1] - times[0], 200)
+
+    def test_jobs(self):
+        files = self.create_files(5, 1000)
+
+        serial = self.playback(files, 1)
+        parallel = self.playback(files, 3)
+
+        self.assertEqual(parallel, serial)
+        events, particles = parallel
+        self.assertEqual(events, [os.path.basename(path) for path in files])
+        self.assertEqual([timestamp for _, timestamp, _ in particles], range(5000))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_port_agent_listener
+@file mi/core/instrument/test/test_port_agent_listener.py
+@brief Test cases for framing port agent packets in the client listener
+"""
+
+__license__ = 'Apache 2.0'
+
+import socket
+import threading
+import time
+
+from nose.plugins.attrib import attr
+
+from mi.core.exceptions import InstrumentException
+from mi.core.instrument.port_agent_client import Listener, PortAgentPacket
+from mi.core.unit_test import MiUnitTestCase
+
+
+def make_packet(data, packet_type=PortAgentPacket.DATA_FROM_INSTRUMENT):
+    packet = PortAgentPacket(packet_type)
+    packet.attach_data(data)
+    packet.attach_timestamp(3600000000.5)
+    packet.pack_header()
+    return packet.get_header() + data
+
+
+@attr('UNIT', group='mi')
+class TestUnitPortAgentListener(MiUnitTestCase):
+
+    def setUp(self):
+        self.sock, self.port_agent = socket.socketpair()
+        self.sock.setblocking(0)
+        self.packets = []
+        self.errors = []
+        self.received = threading.Event()
+        self.listener = None
+
+    def tearDown(self):
+        if self.listener is not None:
+            self.listener._done = True
+            self.listener.join(2)
+        self.sock.close()
+        self.port_agent.close()
+
+    def start(self, expected, **kwargs):
+        self.expected = expected
+        self.listener = Listener(self.sock, self.callback, self.error_callback, 0, 0, **kwargs)
+        self.listener.start()
+
+    def callback(self, packet):
+        self.packets.append(packet)
+        if len(self.packets) >= self.expected:
+            self.received.set()
+
+    def error_callback(self):
+        self.errors.append(True)
+        self.received.set()
+
+    def data(self):
+        return [packet.get_data() for packet in self.packets if isinstance(packet, PortAgentPacket)]
+
+    def test_many_packets_per_receive(self):
+        self.start(3)
+        self.port_agent.sendall(make_packet('first') + make_packet('', PortAgentPacket.HEARTBEAT) +
+                                make_packet('second') + make_packet('third', PortAgentPacket.PORT_AGENT_STATUS))
+        self.assertTrue(self.received.wait(5))
+        self.assertEqual(self.data(), ['first', 'second', 'third'])
+        self.assertEqual([packet.get_header_type() for packet in self.packets],
+                         [PortAgentPacket.DATA_FROM_INSTRUMENT, PortAgentPacket.DATA_FROM_INSTRUMENT,
+                          PortAgentPacket.PORT_AGENT_STATUS])
+        self.assertEqual(self.packets[0].get_timestamp(), 3600000000.5)
+        self.assertIsInstance(self.packets[0].get_data(), str)
+
+    def test_partial_packets(self):
+        # packets larger than the buffer arrive in pieces
+        payloads = ['x' * 1000, 'y' * 10, 'z' * 5000]
+        self.start(len(payloads), buffer_size=64)
+        stream = ''.join(make_packet(payload) for payload in payloads)
+        for index in xrange(0, len(stream), 700):
+            self.port_agent.sendall(stream[index:index + 700])
+            time.sleep(0.01)
+        self.assertTrue(self.received.wait(5))
+        self.assertEqual(self.data(), payloads)
+
+    def test_callback_exception(self):
+        def callback(packet):
+            if isinstance(packet, PortAgentPacket) and packet.get_data() == 'bad':
+                raise ValueError('bad packet')
+            self.callback(packet)
+
+        self.expected = 2
+        self.listener = Listener(self.sock, callback, self.error_callback, 0, 0)
+        self.listener.start()
+        self.port_agent.sendall(make_packet('bad') + make_packet('good'))
+        self.assertTrue(self.received.wait(5))
+        self.assertIsInstance(self.packets[0], InstrumentException)
+        self.assertEqual(self.data(), ['good'])
+
+    def test_socket_closed(self):
+        self.start(1)
+        self.port_agent.close()
+        self.assertTrue(self.received.wait(5))
+        self.assertEqual(self.errors, [True])
+
+    def test_stop(self):
+        self.start(1)
+        self.listener._done = True
+        self.listener.join(1)
+        self.assertFalse(self.listener.is_alive())
+
+    def test_heartbeat(self):
+        self.listener = Listener(self.sock, self.callback, self.error_callback, 0.1, 2)
+        self.expected = 1
+        self.listener.start()
+        # the heartbeat interval is at least HEARTBEAT_FUDGE seconds, keep resetting for a while
+        for _ in xrange(3):
+            time.sleep(0.5)
+            self.port_agent.sendall(make_packet('', PortAgentPacket.HEARTBEAT))
+        self.assertEqual(self.errors, [])
+        self.assertTrue(self.received.wait(5))
+        self.assertEqual(self.errors, [True])
+        self.assertFalse(self.listener.heartbeat_timer.armed)
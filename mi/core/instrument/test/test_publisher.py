@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_publisher
+@file mi/core/instrument/test/test_publisher.py
+@brief Test cases for the publisher queue, flush triggers and overflow policies
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from nose.plugins.attrib import attr
+
+from mi.core.instrument.publisher import Publisher
+from mi.core.unit_test import MiUnitTestCase
+
+
+class ListPublisher(Publisher):
+    def __init__(self, *args, **kwargs):
+        super(ListPublisher, self).__init__(*args, **kwargs)
+        self.batches = []
+        self.fail = False
+        self.published = threading.Event()
+
+    def _publish(self, events, headers):
+        if self.fail:
+            return events
+        self.batches.append([event['n'] for event in events])
+        self.published.set()
+
+    @property
+    def events(self):
+        return [n for batch in self.batches for n in batch]
+
+
+def event(n):
+    return {'type': 'DRIVER_ASYNC_EVENT_SAMPLE', 'n': n}
+
+
+@attr('UNIT', group='mi')
+class TestUnitPublisher(MiUnitTestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_size_trigger(self):
+        publisher = ListPublisher(None, max_events=10, publish_interval=60)
+        publisher.start()
+        try:
+            for n in xrange(10):
+                publisher.enqueue(event(n))
+            self.assertTrue(publisher.published.wait(5))
+            self.assertEqual(publisher.batches, [range(10)])
+        finally:
+            publisher.stop()
+
+    def test_time_trigger(self):
+        publisher = ListPublisher(None, max_events=10, publish_interval=.2)
+        publisher.start()
+        try:
+            now = time.time()
+            publisher.enqueue(event(0))
+            self.assertTrue(publisher.published.wait(5))
+            self.assertGreaterEqual(time.time() - now, .2)
+            self.assertEqual(publisher.events, [0])
+            self.assertGreater(publisher.metrics()['last_flush_latency'], 0)
+        finally:
+            publisher.stop()
+
+    def test_drop_oldest(self):
+        publisher = ListPublisher(None, max_events=100, max_queue=5, overflow=Publisher.DROP_OLDEST)
+        for n in xrange(8):
+            publisher.enqueue(event(n))
+        self.assertEqual(publisher.queue_depth(), 5)
+        publisher.publish()
+        self.assertEqual(publisher.events, range(3, 8))
+        metrics = publisher.metrics()
+        self.assertEqual(metrics['dropped'], 3)
+        self.assertEqual(metrics['published'], 5)
+        self.assertEqual(metrics['max_depth'], 5)
+
+    def test_block_without_thread(self):
+        # with no publisher thread running a full queue is published inline
+        publisher = ListPublisher(None, max_events=2, max_queue=4)
+        for n in xrange(7):
+            publisher.enqueue(event(n))
+        self.assertEqual(publisher.events, [0, 1, 2, 3])
+        while publisher.publish():
+            pass
+        self.assertEqual(publisher.events, range(7))
+
+    def test_block(self):
+        publisher = ListPublisher(None, max_events=2, max_queue=4, publish_interval=60)
+        publisher.start()
+        try:
+            for n in xrange(50):
+                publisher.enqueue(event(n))
+                self.assertLessEqual(publisher.queue_depth(), 4)
+        finally:
+            publisher.stop()
+        while publisher.publish():
+            pass
+        self.assertEqual(publisher.events, range(50))
+
+    def test_spill(self):
+        path = os.path.join(self.tempdir, 'spill')
+        publisher = ListPublisher(None, max_events=3, max_queue=4, overflow=Publisher.SPILL, spill_path=path)
+        for n in xrange(20):
+            publisher.enqueue(event(n))
+        self.assertEqual(publisher.metrics()['queue_depth'], 4)
+        self.assertEqual(publisher.metrics()['spill_depth'], 16)
+        self.assertEqual(publisher.queue_depth(), 20)
+
+        while publisher.publish():
+            pass
+        self.assertEqual(publisher.events, range(20))
+        self.assertEqual(os.listdir(path), [])
+
+    def test_spill_interleaved(self):
+        path = os.path.join(self.tempdir, 'spill')
+        publisher = ListPublisher(None, max_events=5, max_queue=10, overflow=Publisher.SPILL, spill_path=path,
+                                  publish_interval=.02, replay_rate=200)
+        for n in xrange(30):
+            publisher.enqueue(event(n))
+
+        publisher.start()
+        try:
+            self.assertTrue(publisher.published.wait(5))
+            # replay is rate limited, leaving room in memory, but live events go behind those still spilled
+            for n in xrange(30, 60):
+                publisher.enqueue(event(n))
+                time.sleep(.005)
+            now = time.time()
+            while publisher.queue_depth() and time.time() - now < 10:
+                time.sleep(.01)
+        finally:
+            publisher.stop()
+        self.assertEqual(publisher.events, range(60))
+
+    def test_failed_publish_requeued(self):
+        publisher = ListPublisher(None, max_events=10)
+        publisher.fail = True
+        for n in xrange(3):
+            publisher.enqueue(event(n))
+        self.assertEqual(publisher.publish(), 3)
+        self.assertEqual(publisher.metrics()['failed'], 3)
+        publisher.fail = False
+        self.assertEqual(publisher.publish(), 0)
+        self.assertEqual(publisher.events, range(3))
+
+    def test_from_url(self):
+        publisher = Publisher.from_url('count://?max_queue=10&overflow=drop_oldest', allowed=None)
+        self.assertEqual(publisher._max_queue, 10)
+        self.assertEqual(publisher._overflow, Publisher.DROP_OLDEST)
+        self.assertRaises(ValueError, Publisher, None, overflow='bogus')
+        self.assertRaises(ValueError, Publisher, None, overflow=Publisher.SPILL)
+        self.assertRaises(ValueError, Publisher, None, max_queue=10, overflow=Publisher.SPILL)
+
+    def test_outage_spill_and_replay(self):
+        path = os.path.join(self.tempdir, 'spill')
+        publisher = ListPublisher(None, max_events=10, max_queue=20, overflow=Publisher.SPILL, spill_path=path)
+        publisher.fail = True
+        for n in xrange(100):
+            publisher.enqueue(event(n))
+            if n % 10 == 9:
+                publisher.publish()
+                # failed batches beyond max_queue are moved to disk, memory stays bounded
+                self.assertLessEqual(publisher.metrics()['queue_depth'], 20)
+        self.assertEqual(publisher.queue_depth(), 100)
+        self.assertEqual(publisher.events, [])
+
+        # the broker is back, everything is published in the original order
+        publisher.fail = False
+        while publisher.publish():
+            pass
+        self.assertEqual(publisher.events, range(100))
+
+    def test_spill_survives_restart(self):
+        path = os.path.join(self.tempdir, 'spill')
+        publisher = ListPublisher(None, max_events=10, max_queue=5, overflow=Publisher.SPILL, spill_path=path)
+        for n in xrange(30):
+            publisher.enqueue(event(n))
+        publisher.stop()
+        # stopping closes the spill, leaving its segments for the next publisher
+        self.assertTrue(all(segment.writer is None for segment in publisher._spill._segments))
+        self.assertNotEqual(os.listdir(path), [])
+
+        publisher = ListPublisher(None, max_events=10, max_queue=5, overflow=Publisher.SPILL, spill_path=path)
+        self.assertEqual(publisher.queue_depth(), 25)
+        while publisher.publish():
+            pass
+        self.assertEqual(publisher.events, range(5, 30))
+
+    def test_replay_rate(self):
+        path = os.path.join(self.tempdir, 'spill')
+        publisher = ListPublisher(None, max_events=10, max_queue=10, overflow=Publisher.SPILL, spill_path=path,
+                                  publish_interval=.05, replay_rate=100)
+        for n in xrange(60):
+            publisher.enqueue(event(n))
+
+        now = time.time()
+        publisher.start()
+        try:
+            self.assertTrue(publisher.published.wait(5))
+            # live events queue up behind the spilled ones
+            publisher.enqueue(event('live'))
+            while publisher.queue_depth() and time.time() - now < 10:
+                time.sleep(.01)
+        finally:
+            publisher.stop()
+        # ~50 spilled events at 100 per second (after an initial burst of max_events)
+        self.assertGreater(time.time() - now, .3)
+        self.assertEqual(publisher.events, range(60) + ['live'])
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_qpid_publisher
+@file mi/core/instrument/test/test_qpid_publisher.py
+@brief Test cases for pipelined QPID publishing, using a fake session
+"""
+
+__license__ = 'Apache 2.0'
+
+import json
+import time
+
+import qpid.messaging as qm
+from mock import patch
+from nose.plugins.attrib import attr
+
+from mi.core.instrument.qpid_publisher import PipelinedSender, QpidPublisher
+from mi.core.unit_test import MiUnitTestCase
+
+
+class FakeSession(object):
+    """
+    Stands in for both the session and its sender, messages are delivered
+    when the session is synced
+    """
+    def __init__(self):
+        self.pending = []
+        self.delivered = []
+        self.syncs = 0
+        self.fail_sync = False
+        self.fail_send = False
+
+    def send(self, message, sync=True):
+        if self.fail_send:
+            raise qm.ConnectionError('send failed')
+        self.pending.append(message)
+        if sync:
+            self.sync()
+
+    def sync(self, timeout=None):
+        self.syncs += 1
+        if self.fail_sync:
+            self.pending = []
+            raise qm.SessionError('sync failed')
+        self.delivered.extend(self.pending)
+        self.pending = []
+
+
+def event(n):
+    return {'type': 'DRIVER_ASYNC_EVENT_SAMPLE', 'n': n}
+
+
+@attr('UNIT', group='mi')
+class TestUnitPipelinedSender(MiUnitTestCase):
+
+    def setUp(self):
+        self.session = FakeSession()
+        self.pipeline = PipelinedSender(window=3, confirm_interval=60)
+        self.pipeline.attach(self.session, self.session)
+
+    def test_window(self):
+        self.assertEqual(self.pipeline.send('a', 1), ([], []))
+        self.assertEqual(self.pipeline.send('b', 2), ([], []))
+        self.assertEqual(self.session.syncs, 0)
+        self.assertEqual(self.pipeline.send('c', 3), ([1, 2, 3], []))
+        self.assertEqual(self.session.syncs, 1)
+        self.assertEqual(self.session.delivered, ['a', 'b', 'c'])
+        self.assertEqual(len(self.pipeline), 0)
+
+    def test_default_window_is_synchronous(self):
+        pipeline = PipelinedSender()
+        pipeline.attach(self.session, self.session)
+        self.assertEqual(pipeline.send('a', 1), ([1], []))
+        self.assertEqual(self.session.delivered, ['a'])
+
+    def test_confirm_interval(self):
+        pipeline = PipelinedSender(window=10, confirm_interval=0.05)
+        pipeline.attach(self.session, self.session)
+        pipeline.send('a', 1)
+        self.assertFalse(pipeline.confirm_due())
+        time.sleep(0.1)
+        self.assertTrue(pipeline.confirm_due())
+        self.assertEqual(pipeline.send('b', 2), ([1, 2], []))
+
+    def test_confirm_early(self):
+        self.assertEqual(self.pipeline.confirm(), ([], []))
+        self.pipeline.send('a', 1)
+        self.assertEqual(self.pipeline.confirm(), ([1], []))
+        self.assertEqual(self.session.syncs, 1)
+
+    def test_failed_sync(self):
+        self.pipeline.send('a', 1)
+        self.pipeline.send('b', 2)
+        self.session.fail_sync = True
+        self.assertEqual(self.pipeline.send('c', 3), ([], [1, 2, 3]))
+        self.assertIsNone(self.pipeline.sender)
+        self.assertEqual(len(self.pipeline), 0)
+
+    def test_failed_send(self):
+        self.pipeline.send('a', 1)
+        self.session.fail_send = True
+        self.assertEqual(self.pipeline.send('b', 2), ([], [1, 2]))
+
+
+@attr('UNIT', group='mi')
+class TestUnitQpidPublisher(MiUnitTestCase):
+
+    def setUp(self):
+        self.sessions = []
+        patcher = patch.object(QpidPublisher, 'connect', lambda publisher: self.connect(publisher))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def connect(self, publisher):
+        session = FakeSession()
+        self.sessions.append(session)
+        publisher.session = publisher.sender = session
+        publisher._pipeline.attach(session, session)
+
+    def delivered(self):
+        return [event['n'] for session in self.sessions
+                for message in session.delivered for event in json.loads(message.content)]
+
+    def create_publisher(self, **kwargs):
+        return QpidPublisher('localhost', 'test', {}, None, max_events=2, publish_interval=0.01, **kwargs)
+
+    def test_pipelined(self):
+        publisher = self.create_publisher(window=4)
+        for n in xrange(10):
+            publisher.enqueue(event(n))
+
+        # batches are pipelined while a full batch is waiting, the rest confirmed together
+        self.assertEqual(publisher.publish(), 8)
+        self.assertEqual(self.sessions[0].syncs, 0)
+        while publisher.publish():
+            pass
+        self.assertEqual(self.sessions[0].syncs, 2)
+        self.assertEqual(self.delivered(), range(10))
+        self.assertEqual(publisher.metrics()['published'], 10)
+
+    def test_replay_failed_window(self):
+        publisher = self.create_publisher(window=4)
+        for n in xrange(6):
+            publisher.enqueue(event(n))
+        publisher.publish()
+        publisher.publish()
+
+        # pipelined events are not counted as published until confirmed
+        self.assertEqual(publisher.metrics()['published'], 0)
+
+        self.sessions[0].fail_sync = True
+        publisher.publish()
+        self.assertEqual(publisher.metrics()['failed'], 6)
+        self.assertEqual(publisher.metrics()['published'], 0)
+        self.assertEqual(publisher.queue_depth(), 6)
+
+        time.sleep(0.02)
+        while publisher.publish():
+            time.sleep(0.02)
+        self.assertEqual(len(self.sessions), 2)
+        self.assertEqual(self.delivered(), range(6))
+        # the replayed events are counted once
+        self.assertEqual(publisher.metrics()['published'], 6)
+
+    def test_instance_restored(self):
+        publisher = self.create_publisher(window=4)
+        publisher.enqueue(dict(event(0), instance='sensor-a'))
+        publisher.enqueue(dict(event(1), instance='sensor-b'))
+        self.sessions[0].fail_sync = True
+        publisher.publish()
+        self.assertEqual(sorted(e['instance'] for e in publisher._deque), ['sensor-a', 'sensor-b'])
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_serializer
+@file mi/core/instrument/test/test_serializer.py
+@brief Test cases for the published event serializers
+"""
+
+__license__ = 'Apache 2.0'
+
+import json
+
+from nose.plugins.attrib import attr
+
+from mi.core.instrument.publisher import Publisher
+from mi.core.instrument.serializer import get_serializer, serializer_for_headers, CODEC_HEADER
+from mi.core.unit_test import MiUnitTestCase
+
+EVENT = {
+    'type': 'DRIVER_ASYNC_EVENT_SAMPLE',
+    'time': 3600000000.5,
+    'value': {
+        'stream_name': 'ctdpf_sample',
+        'values': [{'value_id': 'temperature', 'value': 12.5},
+                   {'value_id': 'counts', 'value': [1, 2, 3]},
+                   {'value_id': 'serial', 'value': u'1234\xb0'}],
+    },
+}
+
+
+class ListPublisher(Publisher):
+    def __init__(self, *args, **kwargs):
+        super(ListPublisher, self).__init__(*args, **kwargs)
+        self.messages = []
+
+    def _publish(self, events, headers):
+        body, events = self.encode(events)
+        self.messages.append((self._serializer.headers(self._merge_headers(headers)), body, events))
+
+
+@attr('UNIT', group='mi')
+class TestUnitSerializer(MiUnitTestCase):
+
+    def test_round_trip(self):
+        for codec in ['json', 'msgpack']:
+            serializer = get_serializer(codec)
+            self.assertEqual(serializer.loads(serializer.dumps([EVENT])), json.loads(json.dumps([EVENT])))
+
+    def test_drop_bad_events(self):
+        bad = {'type': 'DRIVER_ASYNC_EVENT_SAMPLE', 'value': object()}
+        for codec in ['json', 'msgpack']:
+            serializer = get_serializer(codec)
+            body, events = serializer.encode_events([EVENT, bad, EVENT])
+            self.assertEqual(events, [EVENT, EVENT])
+            self.assertEqual(len(serializer.loads(body)), 2)
+
+        circular = {}
+        circular['self'] = circular
+        body, events = get_serializer('json').encode_events([circular, EVENT])
+        self.assertEqual(events, [EVENT])
+
+    def test_headers(self):
+        json_serializer = get_serializer()
+        msgpack_serializer = get_serializer('msgpack')
+        self.assertEqual(json_serializer.headers({'sensor': 'x'}), {'sensor': 'x'})
+        headers = msgpack_serializer.headers({'sensor': 'x'})
+        self.assertEqual(headers, {'sensor': 'x', CODEC_HEADER: 'msgpack'})
+
+        self.assertIs(serializer_for_headers(headers), msgpack_serializer)
+        self.assertIs(serializer_for_headers({'sensor': 'x'}), json_serializer)
+        self.assertIs(serializer_for_headers(None), json_serializer)
+        self.assertRaises(ValueError, get_serializer, 'xml')
+
+    def test_publisher_codec(self):
+        publisher = ListPublisher(None, codec='msgpack')
+        publisher.enqueue(dict(EVENT))
+        publisher.enqueue({'type': 'DRIVER_ASYNC_EVENT_SAMPLE', 'value': object()})
+        publisher.publish()
+
+        [(headers, body, events)] = publisher.messages
+        self.assertEqual(headers[CODEC_HEADER], 'msgpack')
+        self.assertEqual(len(events), 1)
+        self.assertEqual(serializer_for_headers(headers).loads(body)[0]['value']['stream_name'], 'ctdpf_sample')
+
+    def test_from_url(self):
+        publisher = Publisher.from_url('count://?codec=msgpack', allowed=None)
+        self.assertEqual(publisher._serializer.name, 'msgpack')
+        publisher = Publisher.from_url('count://', allowed=None)
+        self.assertEqual(publisher._serializer.name, 'json')
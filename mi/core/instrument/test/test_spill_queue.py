@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_spill_queue
+@file mi/core/instrument/test/test_spill_queue.py
+@brief Test cases for the segmented publisher spill queue
+"""
+
+__license__ = 'Apache 2.0'
+
+import glob
+import os
+import shutil
+import tempfile
+
+from nose.plugins.attrib import attr
+
+from mi.core.instrument.spill_queue import SpillQueue, SEGMENT_SUFFIX
+from mi.core.unit_test import MiUnitTestCase
+
+
+@attr('UNIT', group='mi')
+class TestUnitSpillQueue(MiUnitTestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def segments(self):
+        return sorted(glob.glob(os.path.join(self.path, '*' + SEGMENT_SUFFIX)))
+
+    def test_segments(self):
+        queue = SpillQueue(self.path, segment_size=100)
+        for n in xrange(50):
+            queue.append({'n': n})
+        self.assertEqual(len(queue), 50)
+        self.assertGreater(len(self.segments()), 1)
+
+        self.assertEqual([e['n'] for e in queue.read(7)], range(7))
+        queue.append({'n': 50})
+        self.assertEqual([e['n'] for e in queue.read(100)], range(7, 51))
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(self.segments(), [])
+
+    def test_prepend(self):
+        queue = SpillQueue(self.path)
+        queue.append({'n': 2})
+        queue.prepend([{'n': 0}, {'n': 1}])
+        queue.append({'n': 3})
+        self.assertEqual([e['n'] for e in queue.read(10)], [0, 1, 2, 3])
+
+    def test_recover_partial(self):
+        queue = SpillQueue(self.path)
+        for n in xrange(5):
+            queue.append({'n': n})
+        queue.flush()
+        self.assertEqual([e['n'] for e in queue.read(2)], [0, 1])
+        queue.close()
+
+        # simulate a process dying part way through writing a record
+        [segment] = self.segments()
+        with open(segment, 'ab') as fh:
+            fh.write('\x00\x00\x01\x00{"n"')
+
+        queue = SpillQueue(self.path)
+        # unpublished records are recovered from the start of the segment
+        self.assertEqual(len(queue), 5)
+        queue.append({'n': 5})
+        self.assertEqual([e['n'] for e in queue.read(10)], range(6))
+
+    def test_temporary(self):
+        queue = SpillQueue()
+        queue.append({'n': 0})
+        queue.read(1)
+        queue.close()
+        self.assertFalse(os.path.exists(queue.path))
@@ -6,20 +6,37 @@
 @brief Move messages from rabbitMQ to QPID
 
 Usage:
-    shovel <rabbit_url> <rabbit_queue> <rabbit_key> <qpid_url> <qpid_queue>
+    shovel [--window=<messages>] [--channels=<channels>] <rabbit_url> <rabbit_queue> <rabbit_key> <qpid_url> <qpid_queue>
 
 Options:
-    -h, --help          Show this screen.
+    -h, --help              Show this screen.
+    --window=<messages>     Messages sent to QPID before waiting for the broker to
+                            confirm them [default: 100]
+    --channels=<channels>   Number of parallel rabbitMQ consumers, each with its own
+                            connections to rabbitMQ and QPID [default: 1]
+
+Messages are only acknowledged to rabbitMQ once QPID has confirmed them, the
+messages of a window which fails to confirm are requeued in rabbitMQ. Each
+consumer prefetches two windows so the next window is received while the
+previous one is confirmed, a confirmed window is acknowledged with a single
+multiple ack.
+
+The stats reporter logs the latency (from receiving a message to QPID
+confirming it) and throughput (messages per second) distributions over each
+report interval.
 
 """
+import bisect
 import time
-from threading import Thread
+from threading import Thread, Lock
 
 import qpid.messaging as qm
 from docopt import docopt
 from kombu import Connection, Queue, Exchange
 from kombu.mixins import ConsumerMixin
 from librabbitmq import ChannelError
+from mi.core.instrument.qpid_publisher import PipelinedSender, SEND_ERRORS
+from mi.core.instrument.serializer import serializer_for_headers
 from mi.core.log import LoggerManager
 from mi.logging import log
 
@@ -27,12 +44,14 @@ LoggerManager()
 
 
 class QpidProducer(object):
-    def __init__(self, url, queue, username='guest', password='guest'):
+    def __init__(self, url, queue, username='guest', password='guest', window=None):
         self.url = url
         self.username = username
         self.password = password
         self.queue = queue
+        self.connection = None
         self.sender = None
+        self.pipeline = PipelinedSender(window)
 
     def connect(self):
         delay = 1
@@ -43,6 +62,8 @@ class QpidProducer(object):
                 connection.open()
                 session = connection.session()
                 self.sender = session.sender('%s; {create: always, node: {type: queue, durable: true}}' % self.queue)
+                self.connection = connection
+                self.pipeline.attach(session, self.sender)
                 log.info('Shovel connected to QPID')
                 return
             except qm.ConnectError:
@@ -50,20 +71,148 @@ class QpidProducer(object):
                 time.sleep(delay)
                 delay = min(max_delay, delay*2)
 
-    def send(self, message, headers):
+    def disconnect(self):
+        """
+        Drop the connection, returns the tokens of any messages still in flight
+        """
+        self.sender = None
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except SEND_ERRORS:
+                pass
+            self.connection = None
+        return self.pipeline.abort()
+
+    def _settle(self, confirmed, failed):
+        if failed:
+            self.disconnect()
+        return confirmed, failed
+
+    def send(self, message, headers, token):
+        """
+        Send a message to QPID, see PipelinedSender.send
+        @param token returned once the message is confirmed or failed
+        @returns lists of the confirmed and failed tokens
+        """
         if self.sender is None:
             self.connect()
-        message = qm.Message(content=message, content_type='text/plain', durable=True,
+        # the body is passed through as is, keep the content type of its codec
+        content_type = serializer_for_headers(headers).content_type
+        message = qm.Message(content=message, content_type=content_type, durable=True,
                              properties=headers, user_id='guest')
-        self.sender.send(message, sync=False)
+        return self._settle(*self.pipeline.send(message, token))
+
+    def confirm(self, force=False):
+        """
+        Confirm the messages in flight if the window is due (or force)
+        @returns lists of the confirmed and failed tokens
+        """
+        if force or self.pipeline.confirm_due():
+            return self._settle(*self.pipeline.confirm())
+        return [], []
+
+
+class Histogram(object):
+    """
+    Counts of values in buckets, bucket i holds values up to bounds[i],
+    the last bucket everything above bounds[-1]
+    """
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.max = None
+
+    def add(self, value, count=1):
+        self.counts[bisect.bisect_left(self.bounds, value)] += count
+        self.count += count
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percent):
+        """
+        Upper bound of the bucket holding the given percentile (the maximum
+        for the last bucket), None if empty
+        """
+        if not self.count:
+            return None
+        target = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def __str__(self):
+        buckets = []
+        for index, count in enumerate(self.counts):
+            if count:
+                label = '<=%g' % self.bounds[index] if index < len(self.bounds) else '>%g' % self.bounds[-1]
+                buckets.append('%s:%d' % (label, count))
+        return ' '.join(buckets)
+
+
+class ShovelStats(object):
+    """
+    Counters and histograms shared by the consumers, the histograms are
+    reset at each report
+    """
+    # seconds, 1 ms to ~33 s
+    LATENCY_BOUNDS = [0.001 * 2 ** i for i in xrange(16)]
+    # messages per second, 10 to ~164k
+    THROUGHPUT_BOUNDS = [10 * 2 ** i for i in xrange(15)]
+
+    def __init__(self):
+        self.lock = Lock()
+        self.sent = 0
+        self.requeued = 0
+        self.latency = Histogram(self.LATENCY_BOUNDS)
+        self.throughput = Histogram(self.THROUGHPUT_BOUNDS)
+        self._second = int(time.time())
+        self._second_count = 0
+
+    def _roll(self, now):
+        # count completed seconds (including idle ones) in the throughput histogram
+        second = int(now)
+        if second > self._second:
+            self.throughput.add(self._second_count)
+            if second > self._second + 1:
+                self.throughput.add(0, second - self._second - 1)
+            self._second = second
+            self._second_count = 0
+
+    def record(self, confirmed, requeued=0):
+        """
+        @param confirmed times at which each confirmed message was received
+        @param requeued number of messages requeued
+        """
+        now = time.time()
+        with self.lock:
+            self._roll(now)
+            for received in confirmed:
+                self.latency.add(now - received)
+            self.sent += len(confirmed)
+            self._second_count += len(confirmed)
+            self.requeued += requeued
+
+    def report(self):
+        """
+        Return the counters and the histograms since the last report, resetting the histograms
+        """
+        with self.lock:
+            self._roll(time.time())
+            latency, self.latency = self.latency, Histogram(self.LATENCY_BOUNDS)
+            throughput, self.throughput = self.throughput, Histogram(self.THROUGHPUT_BOUNDS)
+            return self.sent, self.requeued, latency, throughput
 
 
 class RabbitConsumer(ConsumerMixin):
-    def __init__(self, url, queue, routing_key, qpid):
+    def __init__(self, url, queue, routing_key, qpid, stats=None):
         self.connection = Connection(hostname=url)
         self.exchange = Exchange(name='amq.direct', type='direct', channel=self.connection)
         self.qpid = qpid
-        self.count = 0
+        self.stats = stats if stats is not None else ShovelStats()
 
         kwargs = {
             'exchange': self.exchange,
@@ -81,19 +230,53 @@ class RabbitConsumer(ConsumerMixin):
             self.queue = Queue(auto_delete=True, **kwargs)
 
     def get_consumers(self, Consumer, channel):
-        c = Consumer([self.queue], callbacks=[self.on_message])
-        c.qos(prefetch_count=100)
+        # raw messages, the body is forwarded to QPID without being decoded
+        c = Consumer([self.queue], on_message=self.on_message)
+        # receive the next window while the last one is being confirmed
+        c.qos(prefetch_count=max(100, 2 * self.qpid.pipeline.window))
         return [c]
 
-    def on_message(self, body, message):
+    def on_message(self, message):
         try:
-            self.qpid.send(str(body), message.headers)
-            message.ack()
-            self.count += 1
+            self.settle(*self.qpid.send(message.body, message.headers, (message, time.time())))
         except Exception as e:
             log.exception('Exception while publishing message to QPID, requeueing')
-            message.requeue()
-            self.qpid.sender = None
+            failed = self.qpid.disconnect()
+            if not any(m is message for m, _ in failed):
+                failed.append((message, None))
+            self.settle([], failed)
+
+    def on_iteration(self):
+        # confirm a partial window once it is old enough
+        try:
+            self.settle(*self.qpid.confirm())
+        except Exception as e:
+            log.exception('Exception while confirming messages sent to QPID, requeueing')
+            self.settle([], self.qpid.disconnect())
+
+    @staticmethod
+    def ack(messages):
+        """
+        Acknowledge messages with one multiple ack per channel. Every earlier
+        message of the channel has been sent to QPID and either confirmed
+        (and is acknowledged here) or already requeued.
+        """
+        last = {}
+        for message in messages:
+            channel_id = id(message.channel)
+            if channel_id not in last or message.delivery_tag > last[channel_id].delivery_tag:
+                last[channel_id] = message
+        for message in last.itervalues():
+            message.channel.basic_ack(message.delivery_tag, multiple=True)
+
+    def settle(self, confirmed, failed):
+        if confirmed:
+            self.ack([message for message, _ in confirmed])
+        if failed:
+            log.error('Requeueing %d messages not confirmed by QPID', len(failed))
+            for message, _ in failed:
+                message.requeue()
+        self.stats.record([received for _, received in confirmed], len(failed))
 
     def get_current_queue_depth(self):
         try:
@@ -101,11 +284,11 @@ class RabbitConsumer(ConsumerMixin):
             name = result.queue
             count = result.message_count
         except ChannelError:
-            if self.count > 0:
+            if self.stats.sent > 0:
                 log.exception('Exception getting queue count')
             name = 'UNK'
             count = 0
-        return name, count, self.count
+        return name, count, self.stats.sent
 
 
 class StatsReporter(Thread):
@@ -119,6 +302,7 @@ class StatsReporter(Thread):
     def run(self):
         while True:
             queue_name, queue_depth, sent_count = self.rabbit.get_current_queue_depth()
+            _, requeued, latency, throughput = self.rabbit.stats.report()
             now = time.time()
             if self.last_time is not None:
                 elapsed = now - self.last_time
@@ -126,7 +310,14 @@ class StatsReporter(Thread):
                     rate = float(sent_count - self.last_count) / elapsed
                 else:
                     rate = -1
-                log.info('Queue: %s Depth: %d Sent Count: %d Rate: %.2f/s', queue_name, queue_depth, sent_count, rate)
+                log.info('Queue: %s Depth: %d Sent Count: %d Rate: %.2f/s Requeued: %d',
+                         queue_name, queue_depth, sent_count, rate, requeued)
+                if latency.count:
+                    log.info('Latency (s) p50: %g p90: %g p99: %g max: %.3f [%s]', latency.percentile(50),
+                             latency.percentile(90), latency.percentile(99), latency.max, latency)
+                if throughput.count:
+                    log.info('Throughput (msgs/s) p10: %g p50: %g p90: %g max: %d [%s]', throughput.percentile(10),
+                             throughput.percentile(50), throughput.percentile(90), throughput.max, throughput)
 
             self.last_time = now
             self.last_count = sent_count
@@ -142,14 +333,24 @@ def main():
     rabbit_url = options['<rabbit_url>']
     rabbit_queue = options['<rabbit_queue>']
     rabbit_key = options['<rabbit_key>']
+    window = int(options['--window'])
+    channels = int(options['--channels'])
     log.info('Starting shovel: %r', options)
 
-    qpid = QpidProducer(qpid_url, qpid_queue)
-    rabbit = RabbitConsumer(rabbit_url, rabbit_queue, rabbit_key, qpid)
-    reporter = StatsReporter(rabbit)
+    stats = ShovelStats()
+    consumers = []
+    for _ in xrange(channels):
+        qpid = QpidProducer(qpid_url, qpid_queue, window=window)
+        consumers.append(RabbitConsumer(rabbit_url, rabbit_queue, rabbit_key, qpid, stats))
+
+    reporter = StatsReporter(consumers[0])
     reporter.daemon = True
     reporter.start()
-    rabbit.run()
+    for consumer in consumers[1:]:
+        thread = Thread(target=consumer.run)
+        thread.daemon = True
+        thread.start()
+    consumers[0].run()
 
 
 if __name__ == '__main__':
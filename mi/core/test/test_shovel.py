@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.test.test_shovel
+@file mi/core/test/test_shovel.py
+@brief Test cases for the shovel acknowledgements and statistics
+"""
+
+__license__ = 'Apache 2.0'
+
+from kombu import Connection, Consumer, Exchange, Queue
+from mock import Mock, patch
+from nose.plugins.attrib import attr
+
+from mi.core.instrument.serializer import get_serializer, serializer_for_headers
+from mi.core.shovel import Histogram, ShovelStats, RabbitConsumer
+from mi.core.unit_test import MiUnitTest
+
+
+class FakeChannel(object):
+    def __init__(self):
+        self.acks = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acks.append((delivery_tag, multiple))
+
+
+class FakeMessage(object):
+    def __init__(self, channel, delivery_tag):
+        self.channel = channel
+        self.delivery_tag = delivery_tag
+        self.requeued = False
+
+    def requeue(self):
+        self.requeued = True
+
+
+@attr('UNIT', group='mi')
+class TestUnitShovel(MiUnitTest):
+
+    def test_histogram(self):
+        histogram = Histogram([1, 2, 4, 8])
+        self.assertIsNone(histogram.percentile(50))
+        for value in [0.5, 1, 1.5, 3, 3, 3, 7, 20]:
+            histogram.add(value)
+        self.assertEqual(histogram.counts, [2, 1, 3, 1, 1])
+        self.assertEqual(histogram.percentile(10), 1)
+        self.assertEqual(histogram.percentile(50), 4)
+        self.assertEqual(histogram.percentile(100), 20)
+        self.assertEqual(str(histogram), '<=1:2 <=2:1 <=4:3 <=8:1 >8:1')
+
+    def test_throughput(self):
+        stats = ShovelStats()
+        with patch('mi.core.shovel.time.time', return_value=100.5):
+            stats._second = 100
+            stats.record([100.0] * 30)
+        with patch('mi.core.shovel.time.time', return_value=103.2):
+            stats.record([103.0] * 5, requeued=2)
+            sent, requeued, latency, throughput = stats.report()
+
+        self.assertEqual((sent, requeued), (35, 2))
+        self.assertEqual(latency.count, 35)
+        # 30 messages in second 100, nothing in 101 and 102, 103 not complete yet
+        self.assertEqual(throughput.count, 3)
+        self.assertEqual(throughput.max, 30)
+        self.assertEqual(throughput.counts[0], 2)
+
+        # the histograms are reset by each report
+        self.assertEqual(stats.report()[2].count, 0)
+
+    def test_multiple_ack(self):
+        first, second = FakeChannel(), FakeChannel()
+        messages = [FakeMessage(first, 1), FakeMessage(second, 1), FakeMessage(first, 3),
+                    FakeMessage(first, 2), FakeMessage(second, 2)]
+        RabbitConsumer.ack(messages)
+        self.assertEqual(first.acks, [(3, True)])
+        self.assertEqual(second.acks, [(2, True)])
+
+    def test_settle(self):
+        consumer = RabbitConsumer.__new__(RabbitConsumer)
+        consumer.stats = ShovelStats()
+        channel = FakeChannel()
+        confirmed = [(FakeMessage(channel, tag), 0) for tag in (1, 2)]
+        failed = [(FakeMessage(channel, tag), 0) for tag in (3, 4)]
+        consumer.settle(confirmed, failed)
+        self.assertEqual(channel.acks, [(2, True)])
+        self.assertTrue(all(message.requeued for message, _ in failed))
+        self.assertEqual((consumer.stats.sent, consumer.stats.requeued), (2, 2))
+
+    def test_msgpack_passthrough(self):
+        """
+        A msgpack message is forwarded to QPID as sent, with its codec header
+        """
+        serializer = get_serializer('msgpack')
+        events = [{'type': 'DRIVER_ASYNC_EVENT_SAMPLE', 'value': 1}]
+        body = serializer.dumps(events)
+
+        connection = Connection('memory://')
+        self.addCleanup(connection.release)
+        exchange = Exchange('amq.direct', type='direct')
+        queue = Queue('shovel', exchange=exchange, routing_key='shovel')
+        connection.Producer(exchange=exchange, routing_key='shovel').publish(
+            body, headers=serializer.headers({}), content_type=serializer.content_type, declare=[queue])
+
+        consumer = RabbitConsumer.__new__(RabbitConsumer)
+        consumer.queue = queue
+        consumer.stats = ShovelStats()
+        consumer.qpid = Mock()
+        consumer.qpid.pipeline.window = 10
+        consumer.qpid.send.return_value = [], []
+        channel = connection.channel()
+        for each in consumer.get_consumers(lambda *args, **kwargs: Consumer(channel, *args, **kwargs), channel):
+            each.consume()
+        connection.drain_events(timeout=1)
+
+        sent, headers, _ = consumer.qpid.send.call_args[0]
+        self.assertEqual(sent, body)
+        self.assertEqual(serializer_for_headers(headers).loads(sent), events)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.test.test_watchdog
+@file mi/core/test/test_watchdog.py
+@brief Test cases for the deadline watchdog
+"""
+
+__license__ = 'Apache 2.0'
+
+import threading
+import time
+
+from nose.plugins.attrib import attr
+
+from mi.core.unit_test import MiUnitTest
+from mi.core.watchdog import Watchdog, get_watchdog
+
+
+@attr('UNIT', group='mi')
+class TestUnitWatchdog(MiUnitTest):
+
+    def setUp(self):
+        self.watchdog = Watchdog()
+        self.expired = []
+        self.event = threading.Event()
+
+    def callback(self, name):
+        def expired():
+            self.expired.append((name, time.time()))
+            self.event.set()
+        return expired
+
+    def test_expiry_order(self):
+        start = time.time()
+        self.watchdog.register(0.2, self.callback('slow'))
+        self.watchdog.register(0.05, self.callback('fast'))
+        time.sleep(0.4)
+        self.assertEqual([name for name, _ in self.expired], ['fast', 'slow'])
+        self.assertGreaterEqual(self.expired[0][1] - start, 0.05)
+        self.assertEqual(len(self.watchdog), 0)
+
+    def test_reset(self):
+        start = time.time()
+        timer = self.watchdog.register(0.1, self.callback('timer'))
+        for _ in xrange(5):
+            time.sleep(0.05)
+            timer.reset()
+        self.assertEqual(self.expired, [])
+        # resets only move the deadline, the heap keeps one entry
+        self.assertEqual(len(self.watchdog), 1)
+        self.assertTrue(self.event.wait(1))
+        self.assertGreaterEqual(self.expired[0][1] - start, 0.35)
+        self.assertFalse(timer.armed)
+
+    def test_reset_earlier(self):
+        start = time.time()
+        timer = self.watchdog.register(10, self.callback('timer'))
+        timer.reset(0.05)
+        self.assertTrue(self.event.wait(1))
+        self.assertLess(self.expired[0][1] - start, 1)
+
+    def test_cancel(self):
+        timer = self.watchdog.register(0.05, self.callback('timer'))
+        timer.cancel()
+        time.sleep(0.1)
+        self.assertEqual(self.expired, [])
+        timer.reset()
+        self.assertTrue(self.event.wait(1))
+
+    def test_rearm_from_callback(self):
+        count = []
+
+        def expired():
+            count.append(1)
+            if len(count) < 3:
+                timer.reset()
+            else:
+                self.event.set()
+
+        timer = self.watchdog.register(0.02, expired)
+        self.assertTrue(self.event.wait(1))
+        time.sleep(0.05)
+        self.assertEqual(len(count), 3)
+
+    def test_callback_exception(self):
+        def fail():
+            raise ValueError('failed')
+
+        self.watchdog.register(0.01, fail)
+        self.watchdog.register(0.02, self.callback('timer'))
+        self.assertTrue(self.event.wait(1))
+
+    def test_no_thread_per_timer(self):
+        self.watchdog.register(10, self.callback('first'))
+        threads = threading.active_count()
+        timers = [self.watchdog.register(10, self.callback(n)) for n in xrange(100)]
+        for timer in timers:
+            timer.reset()
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_shared(self):
+        self.assertIs(get_watchdog(), get_watchdog())
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.watchdog
+@file mi/core/watchdog.py
+@brief Deadline timers serviced by a single thread
+
+A Watchdog keeps a heap of deadlines and runs one thread which calls each
+timer's callback once its deadline passes. Timers are reset without
+creating threads: moving a deadline later only updates the timer, its
+heap entry is rescheduled when it comes due, so the heap holds at most one
+entry per timer. Callbacks run on the watchdog thread and must not block,
+they may reset (re-arm) their own timer.
+
+get_watchdog returns the watchdog shared by everything in the process.
+"""
+import atexit
+import heapq
+import itertools
+import threading
+import time
+
+from mi.core.log import get_logger
+
+__license__ = 'Apache 2.0'
+
+log = get_logger()
+
+
+class WatchdogTimer(object):
+    """
+    A timer registered with a Watchdog, created with Watchdog.register
+    """
+    def __init__(self, watchdog, timeout, callback, name=None):
+        self._watchdog = watchdog
+        self.timeout = timeout
+        self.callback = callback
+        self.name = name
+        # when the callback is due, None if not armed
+        self.deadline = None
+        # deadline of this timer's entry in the heap, None if not in the heap
+        self.scheduled = None
+
+    def reset(self, delay=None):
+        """
+        (Re-)arm the timer to expire delay seconds from now, timeout if None
+        """
+        self._watchdog.reset(self, delay)
+
+    def cancel(self):
+        self._watchdog.cancel(self)
+
+    @property
+    def armed(self):
+        return self.deadline is not None
+
+    def __repr__(self):
+        return '<WatchdogTimer %s timeout=%r deadline=%r>' % (self.name, self.timeout, self.deadline)
+
+
+class Watchdog(object):
+    def __init__(self, name='watchdog'):
+        self.name = name
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._heap = []
+        # tie breaker, timers do not compare
+        self._sequence = itertools.count()
+        self._thread = None
+        self._stopped = False
+
+    def register(self, timeout, callback, name=None, start=True):
+        """
+        Create a timer calling callback() once timeout seconds pass without a reset
+        @param start arm the timer now, otherwise it waits for the first reset
+        """
+        timer = WatchdogTimer(self, timeout, callback, name)
+        if start:
+            timer.reset()
+        return timer
+
+    def reset(self, timer, delay=None):
+        deadline = time.time() + (timer.timeout if delay is None else delay)
+        with self._lock:
+            timer.deadline = deadline
+            # an earlier heap entry is rescheduled when it comes due
+            if timer.scheduled is None or deadline < timer.scheduled:
+                self._push(timer)
+            self._start()
+
+    def cancel(self, timer):
+        with self._lock:
+            # the heap entry is discarded when it comes due
+            timer.deadline = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
+
+    def _push(self, timer):
+        timer.scheduled = timer.deadline
+        heapq.heappush(self._heap, (timer.deadline, next(self._sequence), timer))
+        if self._heap[0][2] is timer:
+            self._wakeup.notify()
+
+    def _start(self):
+        self._stopped = False
+        if self._thread is None or not self._thread.is_alive():
+            if self._thread is None:
+                # end the thread before the interpreter tears down its modules
+                atexit.register(self.stop)
+            self._thread = threading.Thread(target=self._run, name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop the watchdog thread, resetting any timer starts it again
+        """
+        with self._lock:
+            self._stopped = True
+            self._wakeup.notify()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(1)
+
+    def _next_expired(self):
+        """
+        Wait for the next timer to expire and disarm it, None once stopped
+        """
+        with self._lock:
+            while True:
+                if self._stopped:
+                    return None
+                if not self._heap:
+                    self._wakeup.wait()
+                    continue
+
+                deadline, _, timer = self._heap[0]
+                now = time.time()
+                if deadline > now:
+                    self._wakeup.wait(deadline - now)
+                    continue
+
+                heapq.heappop(self._heap)
+                timer.scheduled = None
+                if timer.deadline is None:
+                    # cancelled
+                    continue
+                if timer.deadline > now:
+                    # reset since this entry was pushed
+                    self._push(timer)
+                    continue
+
+                timer.deadline = None
+                return timer
+
+    def _run(self):
+        while True:
+            timer = self._next_expired()
+            if timer is None:
+                break
+            try:
+                timer.callback()
+            except Exception:
+                log.exception('Exception in watchdog callback for %r', timer)
+
+
+_watchdog = None
+_watchdog_lock = threading.Lock()
+
+
+def get_watchdog():
+    """
+    Return the process wide watchdog
+    """
+    global _watchdog
+    with _watchdog_lock:
+        if _watchdog is None:
+            _watchdog = Watchdog()
+        return _watchdog
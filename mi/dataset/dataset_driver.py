@@ -1,4 +1,5 @@
 import os
+from itertools import groupby
 
 from mi.logging import config
 from mi.core.log import get_logger
@@ -9,6 +10,9 @@ from mi.core.common import BaseEnum
 __author__ = 'wordenm'
 log = get_logger()
 
+# number of records requested from the parser at a time by processFileStream
+DEFAULT_BATCH_SIZE = 100
+
 
 class ProcessingInfoKey(BaseEnum):
     """
@@ -31,6 +35,10 @@ class ParticleDataHandler(object):
         log.debug("Sample type: %s, Sample data: %s", sample_type, sample)
         self._samples.setdefault(sample_type, []).append(sample)
 
+    def addParticleSamples(self, sample_type, samples):
+        log.debug("Sample type: %s, %d samples", sample_type, len(samples))
+        self._samples.setdefault(sample_type, []).extend(samples)
+
     def setParticleDataCaptureFailure(self):
         log.debug("Particle data capture failed")
         self._failure = True
@@ -50,11 +58,26 @@ class DataSetDriver(object):
     which is called directly from uFrame
     """
 
-    def __init__(self, parser, particle_data_handler):
-
+    def __init__(self, parser, particle_data_handler, batch_size=None):
+        """
+        @param parser The parser to pull records from
+        @param particle_data_handler The handler to pass the particles to. If the handler
+            has an addParticleSamples(sample_type, samples) method, particles are passed to
+            it in lists, otherwise to addParticleSample one at a time. If the handler has
+            an accepts_dicts attribute set True, particles are passed as dictionaries
+            rather than JSON strings.
+        @param batch_size The number of records to request from the parser at a time,
+            defaults to the handler batch_size attribute or DEFAULT_BATCH_SIZE
+        """
         self._parser = parser
         self._particle_data_handler = particle_data_handler
 
+        if batch_size is None:
+            batch_size = getattr(particle_data_handler, 'batch_size', DEFAULT_BATCH_SIZE)
+        self._batch_size = batch_size
+        self._add_samples = getattr(particle_data_handler, 'addParticleSamples', None)
+        self._accepts_dicts = getattr(particle_data_handler, 'accepts_dicts', False)
+
     def processFileStream(self):
         """
         Method to extract records from a parser's get_records method
@@ -62,19 +85,36 @@ class DataSetDriver(object):
         """
         while True:
             try:
-                records = self._parser.get_records(1)
+                records = self._parser.get_records(self._batch_size)
 
                 if len(records) == 0:
                     log.debug("Done retrieving records.")
                     break
 
-                for record in records:
-                    self._particle_data_handler.addParticleSample(record.data_particle_type(), record.generate())
+                self._add_records(records)
             except Exception as e:
                 log.error(e)
                 self._particle_data_handler.setParticleDataCaptureFailure()
                 break
 
+    def _generate(self, record):
+        if self._accepts_dicts:
+            return record.generate_dict()
+        return record.generate()
+
+    def _add_records(self, records):
+        """
+        Pass records to the particle data handler, consecutive records of the same
+        type are passed in a single call if the handler supports it
+        """
+        if self._add_samples is None:
+            for record in records:
+                self._particle_data_handler.addParticleSample(record.data_particle_type(), self._generate(record))
+            return
+
+        for sample_type, group in groupby(records, lambda record: record.data_particle_type()):
+            self._add_samples(sample_type, [self._generate(record) for record in group])
+
 
 class SimpleDatasetDriver(DataSetDriver):
     """
@@ -11,7 +11,11 @@ out of files and feed them into the system.
 __author__ = 'Steve Foley'
 __license__ = 'Apache 2.0'
 
+import sys
 import time
+import types
+from collections import deque
+
 import ntplib
 
 from mi.core.log import get_logger
@@ -42,6 +46,9 @@ class DataSetDriverConfigKeys(BaseEnum):
 
 class Parser(object):
     """ abstract class to show API needed for plugin poller objects """
+    # (type, value, traceback) of an error hit while filling the record buffer,
+    # raised once the particles parsed before it have been returned
+    _deferred_exc_info = None
 
     def __init__(self, config, stream_handle, state, sieve_fn,
                  state_callback, publish_callback, exception_callback=None):
@@ -91,6 +98,23 @@ class Parser(object):
         """
         raise NotImplementedException("get_records() not overridden!")
 
+    def _defer_exception(self):
+        """
+        Called from an except block while filling the record buffer. The error is
+        raised straight away if nothing was buffered, otherwise the buffered
+        particles are returned first, as they would be when asked for one at a time.
+        """
+        self._deferred_exc_info = sys.exc_info()
+
+    def _raise_deferred_exception(self):
+        """
+        Raise the deferred error once the record buffer is empty
+        """
+        if self._deferred_exc_info is not None and not self._record_buffer:
+            exc_type, exc_value, exc_traceback = self._deferred_exc_info
+            self._deferred_exc_info = None
+            raise exc_type, exc_value, exc_traceback
+
     def _publish_sample(self, samples):
         """
         Publish the samples with the given publishing callback.
@@ -189,11 +213,15 @@ class BufferLoadingParser(Parser):
         """
         if num_records <= 0:
             return []
-        try:
-            while len(self._record_buffer) < num_records:
-                self._load_particle_buffer()        
-        except EOFError:
-            self._process_end_of_file()
+        if self._deferred_exc_info is None:
+            try:
+                while len(self._record_buffer) < num_records:
+                    self._load_particle_buffer()
+            except EOFError:
+                self._process_end_of_file()
+            except Exception:
+                self._defer_exception()
+        self._raise_deferred_exception()
         return self._yank_particles(num_records)
 
     def _process_end_of_file(self):
@@ -284,19 +312,24 @@ class BufferLoadingParser(Parser):
 
 class SimpleParser(Parser):
 
-    def __init__(self, config, stream_handle, exception_callback):
+    def __init__(self, config, stream_handle, exception_callback, buffer_size=None):
         """
         Initialize the simple parser, which does not use state or the chunker
         and sieve functions.
         @param config: The parser configuration dictionary
         @param stream_handle: The stream handle of the file to parse
         @param exception_callback: The callback to use when an exception occurs
+        @param buffer_size: The number of particles to read ahead when parse_file
+            is a generator. By default only the particles requested are read.
         """
 
-        # the record buffer which will store all parsed particles
+        # the record buffer which will store parsed particles until they are requested
         self._record_buffer = []
         # a flag indicating if the file has been parsed or not
         self._file_parsed = False
+        # the generator returned by parse_file, if it yields particles
+        self._particle_generator = None
+        self._buffer_size = buffer_size
 
         super(SimpleParser, self).__init__(config,
                                            stream_handle,
@@ -308,26 +341,54 @@ class SimpleParser(Parser):
 
     def parse_file(self):
         """
-        This method must be overridden.  This method should open and read the file and parser the data within, and at
-        the end of this method self._record_buffer will be filled with all the particles in the file.
+        This method must be overridden.  This method should open and read the file and parse the data within.
+        It may either be a generator which yields each particle as it is parsed, which keeps memory bounded
+        for large files, or at the end of this method self._record_buffer must be filled with all the
+        particles in the file.
         """
         raise NotImplementedException("parse_file() not overridden!")
 
     def get_records(self, number_requested=1):
         """
         Initiate parsing the file if it has not been done already, and pop particles off the record buffer to
-        return as many as requested if they are available in the buffer.
+        return as many as requested if they are available in the buffer. If parse_file is a generator, only
+        enough particles to satisfy the request are parsed.
         @param number_requested the number of records requested to be returned
         @return an array of particles, with a length of the number requested or less
         """
         particles_to_return = []
 
+        if number_requested > 0 and self._deferred_exc_info is None:
+            try:
+                if self._file_parsed is False:
+                    particles = self.parse_file()
+                    if isinstance(particles, types.GeneratorType):
+                        self._particle_generator = particles
+                    self._file_parsed = True
+
+                self._fill_record_buffer(max(number_requested, self._buffer_size or 0))
+            except Exception:
+                self._defer_exception()
+
         if number_requested > 0:
-            if self._file_parsed is False:
-                self.parse_file()
-                self._file_parsed = True
+            # popping from the front of a list is O(n), so switch to a deque once parsing has started
+            if not isinstance(self._record_buffer, deque):
+                self._record_buffer = deque(self._record_buffer)
+            self._raise_deferred_exception()
 
         while len(particles_to_return) < number_requested and len(self._record_buffer) > 0:
-            particles_to_return.append(self._record_buffer.pop(0))
+            particles_to_return.append(self._record_buffer.popleft())
 
         return particles_to_return
+
+    def _fill_record_buffer(self, count):
+        """
+        Pull particles from the parse_file generator until the record buffer holds count particles,
+        particles parse_file adds to the record buffer itself stay in order.
+        @param count the number of particles to buffer
+        """
+        while self._particle_generator is not None and len(self._record_buffer) < count:
+            try:
+                self._record_buffer.append(next(self._particle_generator))
+            except StopIteration:
+                self._particle_generator = None
@@ -10,7 +10,8 @@ Release notes:
 initial release
 """
 import datetime as dt
-import struct
+from collections import deque
+from itertools import izip
 
 from mi.core.common import BaseEnum
 from mi.core.exceptions import RecoverableSampleException
@@ -18,9 +19,7 @@ from mi.core.exceptions import UnexpectedDataException
 from mi.core.instrument.dataset_data_particle import DataParticle, DataParticleKey
 from mi.core.log import get_logger
 from mi.dataset.dataset_parser import SimpleParser, DataSetDriverConfigKeys
-from mi.dataset.parser.pd0_parser import AdcpPd0Record, \
-    PD0ParsingException, BadHeaderException, \
-    BadOffsetException, ChecksumException, UnhandledBlockException
+from mi.dataset.parser.pd0_parser import find_ensembles, iter_records
 
 __author__ = 'Jeff Roy'
 __license__ = 'Apache 2.0'
@@ -631,79 +630,55 @@ class AdcpPd0Parser(SimpleParser):
         self._particle_classes = self._config[DataSetDriverConfigKeys.PARTICLE_CLASSES_DICT]
         self._particle_classes = {k: globals()[v] for k, v in self._particle_classes.iteritems()}
         self._glider = GliderConfig in self._particle_classes.values()
-        self._last_values = {}
+        self._last_digests = {}
 
     def _changed(self, particle):
-        particle_dict = particle.generate_dict()
-        stream = particle_dict.get('stream_name')
-        values = particle_dict.get('values')
-        last_values = self._last_values.get(stream)
-        if values == last_values:
+        stream = particle.data_particle_type()
+        digest = particle.value_digest()
+        if digest == self._last_digests.get(stream):
             return False
 
-        self._last_values[stream] = values
+        self._last_digests[stream] = digest
         return True
 
     def parse_file(self):
         """
         Entry point into parsing the file
-        Loop through the file one ensemble at a time
+        Find all valid ensembles in the file, decode them in bulk and
+        generate the particles one ensemble at a time, reporting each
+        ensemble with a bad checksum where it occurs in the file
         """
+        data = self._stream_handle.read()
+        scan = find_ensembles(data)
+        bad_checksums = deque(scan.bad_checksums)
 
-        position = 0  # set position to beginning of file
-        header_id_bytes = self._stream_handle.read(2)  # read the first two bytes of the file
+        for ensemble, pd0 in izip(scan.ensembles, iter_records(data, scan.ensembles, glider=self._glider)):
+            while bad_checksums and bad_checksums[0] < ensemble.offset:
+                bad_checksums.popleft()
+                self._exception_callback(RecoverableSampleException("Exception parsing PD0"))
 
-        while header_id_bytes:  # will be None when EOF is found
+            velocity = self._particle_classes['velocity'](pd0)
+            self._record_buffer.append(velocity)
 
-            if header_id_bytes == ADCPS_PD0_HEADER_REGEX:
+            config = self._particle_classes['config'](pd0)
+            engineering = self._particle_classes['engineering'](pd0)
 
-                # get the ensemble size from the next 2 bytes (excludes checksum bytes)
-                num_bytes = struct.unpack("<H", self._stream_handle.read(2))[0]
+            for particle in [config, engineering]:
+                if self._changed(particle):
+                    self._record_buffer.append(particle)
 
-                self._stream_handle.seek(position)  # reset to beginning of ensemble
-                input_buffer = self._stream_handle.read(num_bytes + 2)  # read entire ensemble
+            if hasattr(pd0, 'bottom_track'):
+                bt = self._particle_classes['bottom_track'](pd0)
+                bt_config = self._particle_classes['bottom_track_config'](pd0)
+                self._record_buffer.append(bt)
 
-                if len(input_buffer) == num_bytes + 2:  # make sure there are enough bytes including checksum
+                if self._changed(bt_config):
+                    self._record_buffer.append(bt_config)
 
-                    try:
-                        pd0 = AdcpPd0Record(input_buffer, glider=self._glider)
+        for _ in bad_checksums:
+            self._exception_callback(RecoverableSampleException("Exception parsing PD0"))
 
-                        velocity = self._particle_classes['velocity'](pd0)
-                        self._record_buffer.append(velocity)
-
-                        config = self._particle_classes['config'](pd0)
-                        engineering = self._particle_classes['engineering'](pd0)
-
-                        for particle in [config, engineering]:
-                            if self._changed(particle):
-                                self._record_buffer.append(particle)
-
-                        if hasattr(pd0, 'bottom_track'):
-                            bt = self._particle_classes['bottom_track'](pd0)
-                            bt_config = self._particle_classes['bottom_track_config'](pd0)
-                            self._record_buffer.append(bt)
-
-                            if self._changed(bt_config):
-                                self._record_buffer.append(bt_config)
-
-                    except (BadOffsetException, UnhandledBlockException, BadHeaderException, struct.error):
-                        self._stream_handle.seek(position + 2)
-
-                    except PD0ParsingException:
-                        # seek to just past this header match
-                        self._stream_handle.seek(position + 2)
-                        self._exception_callback(RecoverableSampleException("Exception parsing PD0"))
-
-                else:  # reached EOF
-                    log.warn("not enough bytes left for complete ensemble")
-                    self._exception_callback(UnexpectedDataException("Found incomplete ensemble at end of file"))
-
-            else:  # did not get header ID bytes
-                # if we do not find the header ID bytes go to next bytes and try again
-                # we are not logging anything or passing an exception back to reduce
-                # log noise.
-                pass
-
-            position = self._stream_handle.tell()  # set the new file position
-            header_id_bytes = self._stream_handle.read(2)  # read the next two bytes of the file
+        if scan.incomplete:
+            log.warn("not enough bytes left for complete ensemble")
+            self._exception_callback(UnexpectedDataException("Found incomplete ensemble at end of file"))
 
@@ -55,7 +55,7 @@ class AdcptAcfgmDclPd0Parser(Parser):
 
         self._file_parsed = False
         self._record_buffer = []
-        self._last_values = {}
+        self._last_digests = {}
 
         super(AdcptAcfgmDclPd0Parser, self).__init__(config,
                                                      stream_handle,
@@ -66,14 +66,12 @@ class AdcptAcfgmDclPd0Parser(Parser):
                                                      exception_callback)
 
     def _changed(self, particle):
-        particle_dict = particle.generate_dict()
-        stream = particle_dict.get('stream_name')
-        values = particle_dict.get('values')
-        last_values = self._last_values.get(stream)
-        if values == last_values:
+        stream = particle.data_particle_type()
+        digest = particle.value_digest()
+        if digest == self._last_digests.get(stream):
             return False
 
-        self._last_values[stream] = values
+        self._last_digests[stream] = digest
         return True
 
     def _parse_file(self):
@@ -121,8 +121,8 @@ class DclFileCommonParser(SimpleParser):
 
     def parse_file(self):
         """
-        This method reads the file and parses the data within, and at
-        the end of this method self._record_buffer will be filled with all the particles in the file.
+        This method reads the file and parses the data within, yielding each
+        particle as it is parsed.
         """
 
         # If not set from config & no InstrumentParameterException error from constructor
@@ -146,7 +146,7 @@ class DclFileCommonParser(SimpleParser):
                                                 None,
                                                 sensor_match.groups(),
                                                 preferred_ts=DataParticleKey.PORT_TIMESTAMP)
-                self._record_buffer.append(particle)
+                yield particle
 
             # It's not a sensor data record, see if it's a metadata record.
             else:
@@ -1055,7 +1055,7 @@ class GliderParser(SimpleParser):
 
     def parse_file(self):
         """
-        Create particles from the data in the file
+        Create particles from the data in the file, yielding each one as it is created
         """
         # the header was already read in the init, start at the first sample line
 
@@ -1070,8 +1070,7 @@ class GliderParser(SimpleParser):
                 # create the timestamp
                 timestamp = ntplib.system_to_ntp_time(float(data_dict[GliderParticleKey.M_PRESENT_TIME]))
                 # create the particle
-                self._record_buffer.append(self._extract_sample(
-                    self._particle_class, None, data_dict, internal_timestamp=timestamp))
+                yield self._extract_sample(self._particle_class, None, data_dict, internal_timestamp=timestamp)
 
     @staticmethod
     def _has_science_data(data_dict, particle_class):
@@ -1140,7 +1139,7 @@ class GliderEngineeringParser(GliderParser):
 
     def parse_file(self):
         """
-        Create particles out of the data in the file
+        Create particles out of the data in the file, yielding each one as it is created
         """
 
         # Create the gps position interpolator
@@ -1156,13 +1155,12 @@ class GliderEngineeringParser(GliderParser):
             # handle this particle if it is an engineering metadata particle
             # this is the glider_eng_metadata* particle
             if not self._metadata_sent:
-                self._record_buffer.append(self.handle_metadata_particle(timestamp))
+                yield self.handle_metadata_particle(timestamp)
 
             # check for the presence of engineering data in the raw data row before continuing
             # This is the glider_eng* particle
             if GliderParser._has_science_data(data_dict, self._particle_class):
-                self._record_buffer.append(self._extract_sample(
-                    self._particle_class, None, data_dict, internal_timestamp=timestamp))
+                yield self._extract_sample(self._particle_class, None, data_dict, internal_timestamp=timestamp)
 
             # check for the presence of GPS data in the raw data row before continuing
             # This is the glider_gps_position particle
@@ -1175,12 +1173,12 @@ class GliderEngineeringParser(GliderParser):
             # check for the presence of science particle data in the raw data row before continuing
             # This is the glider_eng_sci* particle
             if GliderParser._has_science_data(data_dict, self._science_class):
-                self._record_buffer.append(self._extract_sample(
-                    self._science_class, None, data_dict, internal_timestamp=timestamp))
+                yield self._extract_sample(self._science_class, None, data_dict, internal_timestamp=timestamp)
 
         # If there are GPS entries, interpolate them if they contain gps lat/lon values
         if gps_interpolator.get_size() > 0:
-            self._record_buffer.extend(gps_interpolator.process_and_get_objects())
+            for particle in gps_interpolator.process_and_get_objects():
+                yield particle
 
     def handle_metadata_particle(self, timestamp):
         """
@@ -10,6 +10,7 @@ from collections import namedtuple
 import pprint
 import struct
 
+import numpy as np
 import sys
 
 namedtuple_store = {}
@@ -52,6 +53,176 @@ class BlockId(object):
     AUV_NAV_DATA = 8192
 
 
+HEADER_FORMAT = (
+    ('id', 'B'),
+    ('data_source', 'B'),
+    ('num_bytes', 'H'),
+    ('spare', 'B'),
+    ('num_data_types', 'B')
+)
+
+FIXED_FORMAT = (
+    ('id', 'H'),
+    ('cpu_firmware_version', 'B'),
+    ('cpu_firmware_revision', 'B'),
+    ('system_configuration', 'H'),
+    ('simulation_data_flag', 'B'),
+    ('lag_length', 'B'),
+    ('number_of_beams', 'B'),
+    ('number_of_cells', 'B'),
+    ('pings_per_ensemble', 'H'),
+    ('depth_cell_length', 'H'),
+    ('blank_after_transmit', 'H'),
+    ('signal_processing_mode', 'B'),
+    ('low_corr_threshold', 'B'),
+    ('num_code_reps', 'B'),
+    ('minimum_percentage', 'B'),
+    ('error_velocity_max', 'H'),
+    ('tpp_minutes', 'B'),
+    ('tpp_seconds', 'B'),
+    ('tpp_hundredths', 'B'),
+    ('coord_transform', 'B'),
+    ('heading_alignment', 'H'),
+    ('heading_bias', 'H'),
+    ('sensor_source', 'B'),
+    ('sensor_available', 'B'),
+    ('bin_1_distance', 'H'),
+    ('transmit_pulse_length', 'H'),
+    ('starting_depth_cell', 'B'),
+    ('ending_depth_cell', 'B'),
+    ('false_target_threshold', 'B'),
+    ('spare1', 'B'),
+    ('transmit_lag_distance', 'H'),
+    ('cpu_board_serial_number', 'Q'),
+    ('system_bandwidth', 'H'),
+    ('system_power', 'B'),
+    ('spare2', 'B'),
+    ('serial_number', 'I'),
+    ('beam_angle', 'B')
+)
+
+VARIABLE_FORMAT = (
+    ('id', 'H'),
+    ('ensemble_number', 'H'),
+    ('rtc_year', 'B'),
+    ('rtc_month', 'B'),
+    ('rtc_day', 'B'),
+    ('rtc_hour', 'B'),
+    ('rtc_minute', 'B'),
+    ('rtc_second', 'B'),
+    ('rtc_hundredths', 'B'),
+    ('ensemble_roll_over', 'B'),
+    ('bit_result', 'H'),
+    ('speed_of_sound', 'H'),
+    ('depth_of_transducer', 'H'),
+    ('heading', 'H'),
+    ('pitch', 'h'),
+    ('roll', 'h'),
+    ('salinity', 'H'),
+    ('temperature', 'h'),
+    ('mpt_minutes', 'B'),
+    ('mpt_seconds', 'B'),
+    ('mpt_hundredths', 'B'),
+    ('heading_standard_deviation', 'B'),
+    ('pitch_standard_deviation', 'B'),
+    ('roll_standard_deviation', 'B'),
+    ('transmit_current', 'B'),
+    ('transmit_voltage', 'B'),
+    ('ambient_temperature', 'B'),
+    ('pressure_positive', 'B'),
+    ('pressure_negative', 'B'),
+    ('attitude_temperature', 'B'),
+    ('attitude', 'B'),
+    ('contamination_sensor', 'B'),
+    ('error_status_word', 'I'),
+    ('reserved', 'H'),
+    ('pressure', 'I'),
+    ('pressure_variance', 'I'),
+    ('spare', 'B'),
+    ('rtc_y2k_century', 'B'),
+    ('rtc_y2k_year', 'B'),
+    ('rtc_y2k_month', 'B'),
+    ('rtc_y2k_day', 'B'),
+    ('rtc_y2k_hour', 'B'),
+    ('rtc_y2k_minute', 'B'),
+    ('rtc_y2k_seconds', 'B'),
+    ('rtc_y2k_hundredths', 'B')
+)
+
+BOTTOM_TRACK_FORMAT = (
+    ('id', 'H'),
+    ('pings_per_ensemble', 'H'),
+    ('delay_before_reacquire', 'H'),
+    ('correlation_mag_min', 'B'),
+    ('eval_amplitude_min', 'B'),
+    ('percent_good_minimum', 'B'),
+    ('mode', 'B'),
+    ('error_velocity_max', 'H'),
+    ('reserved', 'I'),
+    ('range_1', 'H'),
+    ('range_2', 'H'),
+    ('range_3', 'H'),
+    ('range_4', 'H'),
+    ('velocity_1', 'h'),
+    ('velocity_2', 'h'),
+    ('velocity_3', 'h'),
+    ('velocity_4', 'h'),
+    ('corr_1', 'B'),
+    ('corr_2', 'B'),
+    ('corr_3', 'B'),
+    ('corr_4', 'B'),
+    ('amp_1', 'B'),
+    ('amp_2', 'B'),
+    ('amp_3', 'B'),
+    ('amp_4', 'B'),
+    ('pcnt_1', 'B'),
+    ('pcnt_2', 'B'),
+    ('pcnt_3', 'B'),
+    ('pcnt_4', 'B'),
+    ('ref_layer_min', 'H'),
+    ('ref_layer_near', 'H'),
+    ('ref_layer_far', 'H'),
+    ('ref_velocity_1', 'h'),
+    ('ref_velocity_2', 'h'),
+    ('ref_velocity_3', 'h'),
+    ('ref_velocity_4', 'h'),
+    ('ref_corr_1', 'B'),
+    ('ref_corr_2', 'B'),
+    ('ref_corr_3', 'B'),
+    ('ref_corr_4', 'B'),
+    ('ref_amp_1', 'B'),
+    ('ref_amp_2', 'B'),
+    ('ref_amp_3', 'B'),
+    ('ref_amp_4', 'B'),
+    ('ref_pcnt_1', 'B'),
+    ('ref_pcnt_2', 'B'),
+    ('ref_pcnt_3', 'B'),
+    ('ref_pcnt_4', 'B'),
+    ('max_depth', 'H'),
+    ('rssi_1', 'B'),
+    ('rssi_2', 'B'),
+    ('rssi_3', 'B'),
+    ('rssi_4', 'B'),
+    ('gain', 'B'),
+    ('range_msb_1', 'B'),
+    ('range_msb_2', 'B'),
+    ('range_msb_3', 'B'),
+    ('range_msb_4', 'B'),
+)
+
+
+def format_namedtuple(name, formatter):
+    if name not in namedtuple_store:
+        namedtuple_store[name] = namedtuple(name, [item[0] for item in formatter])
+    return namedtuple_store[name]
+
+
+def cell_namedtuple(name):
+    if name not in namedtuple_store:
+        namedtuple_store[name] = namedtuple(name, ('id', 'beam1', 'beam2', 'beam3', 'beam4'))
+    return namedtuple_store[name]
+
+
 def count_zero_bits(bitmask):
     if not bitmask:
         return 0
@@ -67,7 +238,13 @@ def count_zero_bits(bitmask):
 
 
 class AdcpPd0Record(object):
-    def __init__(self, data, glider=False):
+    def __init__(self, data, glider=False, decoded=None):
+        """
+        @param data the bytes of a single ensemble
+        @param glider decode the sensor source/available fields in the ExplorerDVL layout
+        @param decoded dictionary of already validated and decoded blocks (see decode_ensembles),
+                       if present the ensemble is not validated or unpacked again
+        """
         self.data = data
         self.header = None
         self.offsets = None
@@ -83,7 +260,11 @@ class AdcpPd0Record(object):
         self.bit_result = None
         self.error_word = None
         self.stored_checksum = None
-        self._process(glider)
+        if decoded is None:
+            self._process(glider)
+        else:
+            self.__dict__.update(decoded)
+            self._parse_bitmapped(glider)
 
     def __str__(self):
         return repr(self)
@@ -93,15 +274,12 @@ class AdcpPd0Record(object):
 
     def _unpack_from_format(self, name, formatter, offset):
         format_string = ''.join([item[1] for item in formatter])
-        fields = [item[0] for item in formatter]
         data = struct.unpack_from('<' + format_string, self.data, offset)
-        if name not in namedtuple_store:
-            namedtuple_store[name] = namedtuple(name, fields)
-        _class = namedtuple_store[name]
+        _class = format_namedtuple(name, formatter)
         return _class(*data)
 
     def _unpack_cell_data(self, name, format_string, offset):
-        _class = namedtuple(name, ('id', 'beam1', 'beam2', 'beam3', 'beam4'))
+        _class = cell_namedtuple(name)
         data = struct.unpack_from('<H%d%s' % (self.fixed_data.number_of_cells * 4, format_string), self.data, offset)
         _object = _class(data[0], [], [], [], [])
         _object.beam1[:] = data[1::4]
@@ -164,6 +342,9 @@ class AdcpPd0Record(object):
     def _process(self, glider):
         self._validate()
         self._parse_offset_data()
+        self._parse_bitmapped(glider)
+
+    def _parse_bitmapped(self, glider):
         self._parse_sysconfig()
         self._parse_coord_transform()
         self._parse_sensor_source(glider)
@@ -172,14 +353,7 @@ class AdcpPd0Record(object):
         self._parse_error_word()
 
     def _process_header(self):
-        header_format = (
-            ('id', 'B'),
-            ('data_source', 'B'),
-            ('num_bytes', 'H'),
-            ('spare', 'B'),
-            ('num_data_types', 'B')
-        )
-        self.header = self._unpack_from_format('header', header_format, 0)
+        self.header = self._unpack_from_format('header', HEADER_FORMAT, 0)
         self.data = self.data[:self.header.num_bytes + 2]
 
         if len(self.data) < self.header.num_bytes + 2:
@@ -217,96 +391,10 @@ class AdcpPd0Record(object):
                 raise UnhandledBlockException('Found unhandled data type id: %d' % block_id)
 
     def _parse_fixed(self, offset):
-        fixed_format = (
-            ('id', 'H'),
-            ('cpu_firmware_version', 'B'),
-            ('cpu_firmware_revision', 'B'),
-            ('system_configuration', 'H'),
-            ('simulation_data_flag', 'B'),
-            ('lag_length', 'B'),
-            ('number_of_beams', 'B'),
-            ('number_of_cells', 'B'),
-            ('pings_per_ensemble', 'H'),
-            ('depth_cell_length', 'H'),
-            ('blank_after_transmit', 'H'),
-            ('signal_processing_mode', 'B'),
-            ('low_corr_threshold', 'B'),
-            ('num_code_reps', 'B'),
-            ('minimum_percentage', 'B'),
-            ('error_velocity_max', 'H'),
-            ('tpp_minutes', 'B'),
-            ('tpp_seconds', 'B'),
-            ('tpp_hundredths', 'B'),
-            ('coord_transform', 'B'),
-            ('heading_alignment', 'H'),
-            ('heading_bias', 'H'),
-            ('sensor_source', 'B'),
-            ('sensor_available', 'B'),
-            ('bin_1_distance', 'H'),
-            ('transmit_pulse_length', 'H'),
-            ('starting_depth_cell', 'B'),
-            ('ending_depth_cell', 'B'),
-            ('false_target_threshold', 'B'),
-            ('spare1', 'B'),
-            ('transmit_lag_distance', 'H'),
-            ('cpu_board_serial_number', 'Q'),
-            ('system_bandwidth', 'H'),
-            ('system_power', 'B'),
-            ('spare2', 'B'),
-            ('serial_number', 'I'),
-            ('beam_angle', 'B')
-        )
-        self.fixed_data = self._unpack_from_format('fixed', fixed_format, offset)
+        self.fixed_data = self._unpack_from_format('fixed', FIXED_FORMAT, offset)
 
     def _parse_variable(self, offset):
-        variable_format = (
-            ('id', 'H'),
-            ('ensemble_number', 'H'),
-            ('rtc_year', 'B'),
-            ('rtc_month', 'B'),
-            ('rtc_day', 'B'),
-            ('rtc_hour', 'B'),
-            ('rtc_minute', 'B'),
-            ('rtc_second', 'B'),
-            ('rtc_hundredths', 'B'),
-            ('ensemble_roll_over', 'B'),
-            ('bit_result', 'H'),
-            ('speed_of_sound', 'H'),
-            ('depth_of_transducer', 'H'),
-            ('heading', 'H'),
-            ('pitch', 'h'),
-            ('roll', 'h'),
-            ('salinity', 'H'),
-            ('temperature', 'h'),
-            ('mpt_minutes', 'B'),
-            ('mpt_seconds', 'B'),
-            ('mpt_hundredths', 'B'),
-            ('heading_standard_deviation', 'B'),
-            ('pitch_standard_deviation', 'B'),
-            ('roll_standard_deviation', 'B'),
-            ('transmit_current', 'B'),
-            ('transmit_voltage', 'B'),
-            ('ambient_temperature', 'B'),
-            ('pressure_positive', 'B'),
-            ('pressure_negative', 'B'),
-            ('attitude_temperature', 'B'),
-            ('attitude', 'B'),
-            ('contamination_sensor', 'B'),
-            ('error_status_word', 'I'),
-            ('reserved', 'H'),
-            ('pressure', 'I'),
-            ('pressure_variance', 'I'),
-            ('spare', 'B'),
-            ('rtc_y2k_century', 'B'),
-            ('rtc_y2k_year', 'B'),
-            ('rtc_y2k_month', 'B'),
-            ('rtc_y2k_day', 'B'),
-            ('rtc_y2k_hour', 'B'),
-            ('rtc_y2k_minute', 'B'),
-            ('rtc_y2k_seconds', 'B'),
-            ('rtc_y2k_hundredths', 'B')
-        )
-        self.variable_data = self._unpack_from_format('variable', variable_format, offset)
+        self.variable_data = self._unpack_from_format('variable', VARIABLE_FORMAT, offset)
 
     def _parse_velocity(self, offset):
         self.velocities = self._unpack_cell_data('velocity', 'h', offset)
@@ -321,67 +409,7 @@ class AdcpPd0Record(object):
         self.percent_good = self._unpack_cell_data('percent_good', 'B', offset)
 
     def _parse_bottom_track(self, offset):
-        bottom_track_format = (
-            ('id', 'H'),
-            ('pings_per_ensemble', 'H'),
-            ('delay_before_reacquire', 'H'),
-            ('correlation_mag_min', 'B'),
-            ('eval_amplitude_min', 'B'),
-            ('percent_good_minimum', 'B'),
-            ('mode', 'B'),
-            ('error_velocity_max', 'H'),
-            ('reserved', 'I'),
-            ('range_1', 'H'),
-            ('range_2', 'H'),
-            ('range_3', 'H'),
-            ('range_4', 'H'),
-            ('velocity_1', 'h'),
-            ('velocity_2', 'h'),
-            ('velocity_3', 'h'),
-            ('velocity_4', 'h'),
-            ('corr_1', 'B'),
-            ('corr_2', 'B'),
-            ('corr_3', 'B'),
-            ('corr_4', 'B'),
-            ('amp_1', 'B'),
-            ('amp_2', 'B'),
-            ('amp_3', 'B'),
-            ('amp_4', 'B'),
-            ('pcnt_1', 'B'),
-            ('pcnt_2', 'B'),
-            ('pcnt_3', 'B'),
-            ('pcnt_4', 'B'),
-            ('ref_layer_min', 'H'),
-            ('ref_layer_near', 'H'),
-            ('ref_layer_far', 'H'),
-            ('ref_velocity_1', 'h'),
-            ('ref_velocity_2', 'h'),
-            ('ref_velocity_3', 'h'),
-            ('ref_velocity_4', 'h'),
-            ('ref_corr_1', 'B'),
-            ('ref_corr_2', 'B'),
-            ('ref_corr_3', 'B'),
-            ('ref_corr_4', 'B'),
-            ('ref_amp_1', 'B'),
-            ('ref_amp_2', 'B'),
-            ('ref_amp_3', 'B'),
-            ('ref_amp_4', 'B'),
-            ('ref_pcnt_1', 'B'),
-            ('ref_pcnt_2', 'B'),
-            ('ref_pcnt_3', 'B'),
-            ('ref_pcnt_4', 'B'),
-            ('max_depth', 'H'),
-            ('rssi_1', 'B'),
-            ('rssi_2', 'B'),
-            ('rssi_3', 'B'),
-            ('rssi_4', 'B'),
-            ('gain', 'B'),
-            ('range_msb_1', 'B'),
-            ('range_msb_2', 'B'),
-            ('range_msb_3', 'B'),
-            ('range_msb_4', 'B'),
-        )
-        self.bottom_track = self._unpack_from_format('bottom_track', bottom_track_format, offset)
+        self.bottom_track = self._unpack_from_format('bottom_track', BOTTOM_TRACK_FORMAT, offset)
 
     def _parse_sysconfig(self):
         """
@@ -612,3 +640,259 @@ class AdcpPd0Record(object):
         )
 
         self.error_word = self._unpack_bitmapped('error_word', error_word_format, self.variable_data.error_status_word)
+
+
+# Bulk decoding
+#
+# find_ensembles walks a whole buffer for valid ensembles, decode_ensembles
+# groups them by layout (size, block offsets and ids, number of cells) and
+# decodes each group with one structured numpy view per block.
+
+HEADER_ID = b'\x7f\x7f'
+VALID_BLOCK_IDS = frozenset(value for key, value in BlockId.__dict__.iteritems() if not key.startswith('_'))
+CELL_BLOCKS = {
+    BlockId.VELOCITY_DATA: ('velocities', 'velocity', '<i2'),
+    BlockId.CORRELATION_DATA: ('correlation_magnitudes', 'correlation', 'u1'),
+    BlockId.ECHO_INTENSITY_DATA: ('echo_intensity', 'echo_intensity', 'u1'),
+    BlockId.PERCENT_GOOD_DATA: ('percent_good', 'percent_good', 'u1'),
+}
+LEADER_BLOCKS = {
+    BlockId.FIXED_DATA: ('fixed_data', 'fixed', FIXED_FORMAT),
+    BlockId.VARIABLE_DATA: ('variable_data', 'variable', VARIABLE_FORMAT),
+    BlockId.BOTTOM_TRACK: ('bottom_track', 'bottom_track', BOTTOM_TRACK_FORMAT),
+}
+_NUMPY_FORMATS = {'B': 'u1', 'b': 'i1', 'H': '<u2', 'h': '<i2', 'I': '<u4', 'i': '<i4', 'Q': '<u8'}
+_FORMAT_SIZES = {}
+_DTYPES = {}
+
+# outcome of checking a candidate header
+ENSEMBLE_VALID = 0
+ENSEMBLE_INVALID = 1
+ENSEMBLE_BAD_CHECKSUM = 2
+ENSEMBLE_INCOMPLETE = 3
+
+# most ensembles decoded together, bounding the memory used by a group
+MAX_GROUP_SIZE = 1000
+
+Ensemble = namedtuple('Ensemble', 'offset size layout')
+EnsembleScan = namedtuple('EnsembleScan', 'ensembles bad_checksums incomplete')
+
+
+def _format_size(formatter):
+    if formatter not in _FORMAT_SIZES:
+        _FORMAT_SIZES[formatter] = struct.calcsize('<' + ''.join(item[1] for item in formatter))
+    return _FORMAT_SIZES[formatter]
+
+
+def _leader_dtype(formatter, offset, size):
+    """
+    Structured dtype reading the fields of formatter at offset of a record of size bytes
+    """
+    key = (formatter, offset, size)
+    if key not in _DTYPES:
+        names, formats, offsets = [], [], []
+        position = offset
+        for name, format_string in formatter:
+            names.append(name)
+            formats.append(_NUMPY_FORMATS[format_string])
+            offsets.append(position)
+            position += struct.calcsize(format_string)
+        _DTYPES[key] = np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': size})
+    return _DTYPES[key]
+
+
+def _cell_dtype(format_string, cells, offset, size):
+    key = (format_string, cells, offset, size)
+    if key not in _DTYPES:
+        _DTYPES[key] = np.dtype({'names': ['id', 'cells'], 'formats': ['<u2', (format_string, (cells, 4))],
+                                 'offsets': [offset, offset + 2], 'itemsize': size})
+    return _DTYPES[key]
+
+
+def check_ensemble(data, checksums, offset):
+    """
+    Check the ensemble starting at offset, applying the same checks as AdcpPd0Record.
+    @param data buffer holding the ensemble
+    @param checksums running 16 bit sum of data (see running_checksums)
+    @returns (outcome, size, layout), layout being a tuple of the ensemble size,
+             the (block id, offset) pairs and the number of cells
+    """
+    end = len(data)
+    if offset + 4 > end:
+        return ENSEMBLE_INCOMPLETE, None, None
+
+    num_bytes = struct.unpack_from('<H', data, offset + 2)[0]
+    size = num_bytes + 2
+    if offset + size > end:
+        return ENSEMBLE_INCOMPLETE, size, None
+
+    if size < 6:
+        return ENSEMBLE_INVALID, size, None
+    num_data_types = struct.unpack_from('B', data, offset + 5)[0]
+    if not (5 < num_data_types < 10) or 6 + 2 * num_data_types > size:
+        return ENSEMBLE_INVALID, size, None
+
+    blocks = []
+    cells = None
+    for block_offset in struct.unpack_from('<%dH' % num_data_types, data, offset + 6):
+        if block_offset > size - 2:
+            return ENSEMBLE_INVALID, size, None
+        block_id = struct.unpack_from('<H', data, offset + block_offset)[0]
+        if block_id not in VALID_BLOCK_IDS:
+            return ENSEMBLE_INVALID, size, None
+        blocks.append((block_id, block_offset))
+        if block_id == BlockId.FIXED_DATA and block_offset + _format_size(FIXED_FORMAT) <= size:
+            cells = struct.unpack_from('B', data, offset + block_offset + 9)[0]
+
+    calculated = (int(checksums[offset + num_bytes]) - int(checksums[offset])) & 65535
+    if calculated != struct.unpack_from('<H', data, offset + num_bytes)[0]:
+        return ENSEMBLE_BAD_CHECKSUM, size, None
+
+    # make sure every block we decode fits in the ensemble
+    for block_id, block_offset in blocks:
+        if block_id in LEADER_BLOCKS:
+            block_size = _format_size(LEADER_BLOCKS[block_id][2])
+        elif block_id in CELL_BLOCKS:
+            if cells is None:
+                return ENSEMBLE_INVALID, size, None
+            block_size = 2 + cells * 4 * np.dtype(CELL_BLOCKS[block_id][2]).itemsize
+        else:
+            continue
+        if block_offset + block_size > size:
+            return ENSEMBLE_INVALID, size, None
+
+    if cells is None:
+        return ENSEMBLE_INVALID, size, None
+
+    return ENSEMBLE_VALID, size, (size, tuple(blocks), cells)
+
+
+def running_checksums(data):
+    """
+    Return the running sum of the bytes in data modulo 2**16, with a leading zero,
+    so the PD0 checksum of data[start:end] is checksums[end] - checksums[start]
+    """
+    checksums = np.zeros(len(data) + 1, dtype=np.uint16)
+    np.cumsum(np.frombuffer(data, dtype=np.uint8), dtype=np.uint16, out=checksums[1:])
+    return checksums
+
+
+def find_ensembles(data):
+    """
+    Walk data for ensembles the way AdcpPd0Parser always has: header ids are
+    only looked for on two byte boundaries from the end of the last ensemble
+    (or the start of the data), and an incomplete ensemble ends the search.
+    @returns an EnsembleScan of the valid Ensembles, the offsets of the ensembles
+             with a bad checksum and whether the data ended with an incomplete ensemble
+    """
+    checksums = running_checksums(data) if len(data) else None
+    ensembles = []
+    bad_checksums = []
+    position = 0
+    index = data.find(HEADER_ID)
+    while index != -1:
+        if (index - position) % 2:
+            index = data.find(HEADER_ID, index + 1)
+            continue
+
+        outcome, size, layout = check_ensemble(data, checksums, index)
+        if outcome == ENSEMBLE_INCOMPLETE:
+            return EnsembleScan(ensembles, bad_checksums, True)
+
+        if outcome == ENSEMBLE_VALID:
+            ensembles.append(Ensemble(index, size, layout))
+            position = index + size
+        else:
+            if outcome == ENSEMBLE_BAD_CHECKSUM:
+                bad_checksums.append(index)
+            position = index + 2
+        index = data.find(HEADER_ID, position)
+
+    return EnsembleScan(ensembles, bad_checksums, False)
+
+
+class EnsembleGroup(object):
+    """
+    Ensembles sharing a layout, decoded into numpy arrays. Leader blocks are
+    structured arrays (one element per ensemble), cell blocks are arrays of
+    shape (ensembles, cells, 4).
+    """
+    def __init__(self, data, ensembles):
+        self.ensembles = ensembles
+        self.layout = size, blocks, cells = ensembles[0].layout
+        self.offsets = np.array([ensemble.offset for ensemble in ensembles], dtype=np.intp)
+        raw = np.frombuffer(data, dtype=np.uint8)
+        # gather the ensembles into one contiguous (ensembles, size) block
+        self.raw = raw[self.offsets[:, None] + np.arange(size)]
+
+        self.header = np.frombuffer(self.raw, dtype=_leader_dtype(HEADER_FORMAT, 0, size))
+        self.blocks = {}
+        self.cells = {}
+        for block_id, block_offset in blocks:
+            if block_id in LEADER_BLOCKS:
+                attribute, _, formatter = LEADER_BLOCKS[block_id]
+                self.blocks[attribute] = np.frombuffer(self.raw, dtype=_leader_dtype(formatter, block_offset, size))
+            elif block_id in CELL_BLOCKS:
+                attribute, _, format_string = CELL_BLOCKS[block_id]
+                self.cells[attribute] = np.frombuffer(self.raw, dtype=_cell_dtype(format_string, cells, block_offset,
+                                                                                  size))
+
+    def __len__(self):
+        return len(self.ensembles)
+
+    def records(self, glider=False):
+        """
+        Generate an AdcpPd0Record for each ensemble in the group
+        """
+        size, blocks, _ = self.layout
+        offsets = tuple(block_offset for _, block_offset in blocks)
+        columns = [('header', format_namedtuple('header', HEADER_FORMAT), self.header.tolist())]
+        for block_id in (BlockId.FIXED_DATA, BlockId.VARIABLE_DATA, BlockId.BOTTOM_TRACK):
+            attribute, name, formatter = LEADER_BLOCKS[block_id]
+            if attribute in self.blocks:
+                columns.append((attribute, format_namedtuple(name, formatter), self.blocks[attribute].tolist()))
+
+        cell_columns = []
+        for block_id in sorted(CELL_BLOCKS):
+            attribute, name, _ = CELL_BLOCKS[block_id]
+            if attribute in self.cells:
+                block = self.cells[attribute]
+                # (ensembles, 4, cells) so each row lists the values of each beam
+                cell_columns.append((attribute, cell_namedtuple(name), block['id'].tolist(),
+                                     block['cells'].transpose(0, 2, 1).tolist()))
+
+        checksums = self.raw[:, size - 2].astype(np.uint16) | (self.raw[:, size - 1].astype(np.uint16) << 8)
+        checksums = checksums.tolist()
+        for row, ensemble in enumerate(self.ensembles):
+            decoded = {'offsets': offsets, 'stored_checksum': checksums[row]}
+            for attribute, _class, values in columns:
+                decoded[attribute] = _class(*values[row])
+            for attribute, _class, ids, beams in cell_columns:
+                decoded[attribute] = _class(ids[row], *beams[row])
+            yield AdcpPd0Record(self.raw[row].tostring(), glider=glider, decoded=decoded)
+
+
+def decode_ensembles(data, ensembles, max_group_size=MAX_GROUP_SIZE):
+    """
+    Decode ensembles (as returned by find_ensembles) one group at a time, each
+    group being a run of up to max_group_size consecutive ensembles sharing a layout
+    @returns generator of EnsembleGroup, in file order
+    """
+    group = []
+    for ensemble in ensembles:
+        if group and (ensemble.layout != group[0].layout or len(group) == max_group_size):
+            yield EnsembleGroup(data, group)
+            group = []
+        group.append(ensemble)
+    if group:
+        yield EnsembleGroup(data, group)
+
+
+def iter_records(data, ensembles, glider=False):
+    """
+    Generate an AdcpPd0Record for each of ensembles, in their original order,
+    decoding them in bulk one group at a time
+    """
+    for group in decode_ensembles(data, ensembles):
+        for record in group.records(glider):
+            yield record
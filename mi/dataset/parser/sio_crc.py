@@ -0,0 +1,68 @@
+"""
+@package mi.dataset.parser
+@file mi-dataset/mi/dataset/parser/sio_crc.py
+@brief CRC used in the SIO controller block header
+
+The SIO checksum is the reflected CRC-16 with polynomial 0x8408, an initial
+value of 0xFFFF and the result inverted (CRC-16/X-25). crc16 runs it through
+binascii.crc_hqx, the C implementation of the non-reflected CRC-CCITT, by
+bit reversing the input bytes and the result. crc16_table is the equivalent
+256 entry lookup table implementation in pure python.
+"""
+import binascii
+
+__license__ = 'Apache 2.0'
+
+CRC_POLYNOMIAL = 0x8408
+CRC_INITIAL = 0xFFFF
+
+
+def _reverse_bits(value, width):
+    result = 0
+    for _ in xrange(width):
+        result = (result << 1) | (value & 1)
+        value >>= 1
+    return result
+
+
+def _make_table():
+    table = []
+    for byte in xrange(256):
+        crc = byte
+        for _ in xrange(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ CRC_POLYNOMIAL
+            else:
+                crc >>= 1
+        table.append(crc)
+    return table
+
+CRC_TABLE = _make_table()
+REVERSED_BYTES = [_reverse_bits(byte, 8) for byte in xrange(256)]
+# str.translate table which reverses the bits of each byte
+REVERSE_BITS = ''.join(chr(byte) for byte in REVERSED_BYTES)
+
+
+def crc16_table(data):
+    """
+    Calculate the SIO CRC of data one byte at a time using the lookup table
+    @param data a string or bytearray
+    @returns the CRC as an integer
+    """
+    crc = CRC_INITIAL
+    table = CRC_TABLE
+    for byte in bytearray(data):
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return ~crc & 0xFFFF
+
+
+def crc16(data):
+    """
+    Calculate the SIO CRC of data
+    @param data a string or bytearray
+    @returns the CRC as an integer
+    """
+    crc = binascii.crc_hqx(data.translate(REVERSE_BITS), CRC_INITIAL)
+    # reverse the 16 bit result
+    crc = REVERSED_BYTES[crc & 0xFF] << 8 | REVERSED_BYTES[crc >> 8]
+    return ~crc & 0xFFFF
@@ -12,13 +12,13 @@ __author__ = 'Emily Hahn'
 __license__ = 'Apache 2.0'
 
 import re
-import struct
 import time
 import ntplib
 
 from mi.core.log import get_logger
 log = get_logger()
 from mi.dataset.dataset_parser import BufferLoadingParser
+from mi.dataset.parser.sio_crc import crc16
 
 # SIO Main controller header (ascii) and data (binary):
 #   Start of header
@@ -97,33 +97,9 @@ class SioParser(BufferLoadingParser):
         """
         Calculate SIO header checksum of data
         @param: data input data to calculate the checksum on
+        @returns: the checksum as a string of 4 upper case hex digits
         """
-        crc = 65535
-        if len(data) == 0:
-            return '0000'
-        for iData in range(0, len(data)):
-            short = struct.unpack('H', data[iData] + '\x00')
-            point = 255 & short[0]
-            crc ^= point
-            for i in range(7, -1, -1):
-                if crc & 1:
-                    crc = (crc >> 1) ^ 33800
-                else:
-                    crc >>= 1
-        crc = ~crc
-        # convert to unsigned
-        if crc < 0:
-            crc += 65536
-        # get rid of the '0x' from the hex string
-        crc = "%s" % hex(crc)[2:].upper()
-        # make sure we have the right format for comparing, must be 4 hex digits
-        if len(crc) == 3:
-            crc = '0' + crc
-        elif len(crc) == 2:
-            crc = '00' + crc
-        elif len(crc) == 1:
-            crc = '000' + crc
-        return crc
+        return '%04X' % crc16(data)
 
     def get_records(self, num_records):
         """
@@ -171,17 +147,7 @@ class SioParser(BufferLoadingParser):
         This function reads the entire input file.
         @returns: A string containing the contents of the entire file.
         """
-        input_buffer = ''
-
-        while True:
-            # read data in small blocks in order to not block processing
-            next_data = self._stream_handle.read(1024)
-            if next_data != '':
-                input_buffer = input_buffer + next_data
-            else:
-                break
-
-        return input_buffer
+        return self._stream_handle.read()
 
     def sieve_function(self, raw_data):
         """
@@ -194,6 +160,7 @@ class SioParser(BufferLoadingParser):
         @returns: list of matched start,end index found in raw_data
         """
         return_list = []
+        raw_len = len(raw_data)
 
         #
         # Search the entire input buffer to find all possible SIO headers.
@@ -208,33 +175,33 @@ class SioParser(BufferLoadingParser):
             data_len = int(match.group(SIO_HEADER_GROUP_DATA_LENGTH), 16)
             end_packet_idx = match.end(0) + data_len
 
-            if end_packet_idx < len(raw_data):
+            if end_packet_idx < raw_len:
                 #
                 # Get the last byte of the SIO block
                 # and make sure it matches the expected value.
                 #
-                end_packet = raw_data[end_packet_idx]
+                end_packet = raw_data[end_packet_idx:end_packet_idx + 1]
                 if end_packet == SIO_BLOCK_END:
                     #
                     # Calculate the checksum on the data portion of the
                     # SIO block (excludes start of header, header,
                     # and end of header).
                     #
-                    actual_checksum = SioParser.calc_checksum(
-                        raw_data[match.end(0):end_packet_idx])
+                    actual_checksum = crc16(raw_data[match.end(0):end_packet_idx])
 
                     expected_checksum = match.group(SIO_HEADER_GROUP_CHECKSUM)
 
                     #
                     # If the checksums match, add the start,end indices to
                     # the return list.  The end of SIO block byte is included.
+                    # The received checksum is upper case hex.
                     #
-                    if actual_checksum == expected_checksum:
+                    if '%04X' % actual_checksum == expected_checksum:
                         # even if this is not the right instrument, keep track that
                         # this packet was processed
                         return_list.append((match.start(0), end_packet_idx+1))
                     else:
-                        log.debug("Calculated checksum %s != received checksum %s for header %s and packet %d to %d",
+                        log.debug("Calculated checksum %04X != received checksum %s for header %s and packet %d to %d",
                                   actual_checksum, expected_checksum,
                                   match.group(0)[1:32],
                                   match.end(0), end_packet_idx)
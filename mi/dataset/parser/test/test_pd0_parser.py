@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+"""
+@package mi.dataset.parser.test
+@file mi-dataset/mi/dataset/parser/test/test_pd0_parser.py
+@brief Test code for the bulk PD0 ensemble decoder
+"""
+
+import os
+from StringIO import StringIO
+
+from nose.plugins.attrib import attr
+
+from mi.core.unit_test import MiUnitTestCase
+from mi.dataset.dataset_parser import DataSetDriverConfigKeys
+from mi.dataset.driver.adcpa_n.resource import RESOURCE_PATH
+from mi.dataset.parser.adcp_pd0 import AdcpPd0Parser
+from mi.dataset.parser.pd0_parser import AdcpPd0Record, find_ensembles, decode_ensembles, iter_records
+
+
+RECORD_ATTRIBUTES = ['header', 'offsets', 'fixed_data', 'variable_data', 'velocities', 'correlation_magnitudes',
+                     'echo_intensity', 'percent_good', 'sysconfig', 'coord_transform', 'sensor_source',
+                     'sensor_avail', 'bit_result', 'error_word', 'stored_checksum', 'data']
+
+
+@attr('UNIT', group='mi')
+class Pd0BulkDecodeUnitTestCase(MiUnitTestCase):
+
+    def setUp(self):
+        with open(os.path.join(RESOURCE_PATH, 'adcp_auv_51.pd0'), 'rb') as fh:
+            self.data = fh.read()
+
+    def assert_same_record(self, bulk, single):
+        for name in RECORD_ATTRIBUTES:
+            self.assertEqual(getattr(bulk, name), getattr(single, name), name)
+        self.assertEqual(hasattr(bulk, 'bottom_track'), hasattr(single, 'bottom_track'))
+        if hasattr(single, 'bottom_track'):
+            self.assertEqual(bulk.bottom_track, single.bottom_track)
+
+    def test_matches_single_record(self):
+        """
+        Each bulk decoded ensemble matches the record decoded on its own
+        """
+        scan = find_ensembles(self.data)
+        self.assertEqual(len(scan.ensembles), 51)
+        self.assertEqual(scan.bad_checksums, [])
+        self.assertFalse(scan.incomplete)
+
+        for ensemble, record in zip(scan.ensembles, iter_records(self.data, scan.ensembles)):
+            single = AdcpPd0Record(self.data[ensemble.offset:ensemble.offset + ensemble.size])
+            self.assert_same_record(record, single)
+
+    def test_groups(self):
+        """
+        Cell data is decoded into one (ensembles, cells, 4) array per group
+        """
+        scan = find_ensembles(self.data)
+        groups = list(decode_ensembles(self.data, scan.ensembles))
+        self.assertEqual(sum(len(group) for group in groups), 51)
+
+        group = groups[0]
+        single = AdcpPd0Record(self.data[group.ensembles[0].offset:group.ensembles[0].offset + group.layout[0]])
+        velocities = group.cells['velocities']['cells']
+        self.assertEqual(velocities.shape, (len(group), single.fixed_data.number_of_cells, 4))
+        self.assertEqual(velocities[0, :, 0].tolist(), single.velocities.beam1)
+        self.assertEqual(group.blocks['variable_data']['ensemble_number'][0], single.variable_data.ensemble_number)
+
+    def test_bad_data(self):
+        """
+        A corrupted checksum is noted and skipped, a truncated ensemble ends the scan
+        """
+        first = find_ensembles(self.data).ensembles[0]
+        data = bytearray(self.data)
+        # corrupt a velocity byte of the first ensemble
+        data[first.offset + first.size - 10] ^= 0xFF
+        data = str(data[:-10])
+
+        scan = find_ensembles(data)
+        self.assertEqual(scan.bad_checksums, [first.offset])
+        self.assertTrue(scan.incomplete)
+        self.assertEqual(len(scan.ensembles), 49)
+        self.assertNotIn(first.offset, [ensemble.offset for ensemble in scan.ensembles])
+
+    def test_group_order(self):
+        """
+        Groups are runs of consecutive ensembles, decoded in file order
+        """
+        scan = find_ensembles(self.data)
+        groups = list(decode_ensembles(self.data, scan.ensembles, max_group_size=10))
+        self.assertEqual([len(group) for group in groups], [10, 10, 10, 10, 10, 1])
+        self.assertEqual(sum((group.ensembles for group in groups), []), scan.ensembles)
+
+    def test_bad_checksum_order(self):
+        """
+        The parser reports a bad checksum after the particles of the ensembles before it
+        """
+        config = {
+            DataSetDriverConfigKeys.PARTICLE_MODULE: 'mi.dataset.parser.adcpa_n',
+            DataSetDriverConfigKeys.PARTICLE_CLASSES_DICT: {
+                'velocity': 'VelocityInst',
+                'engineering': 'AuvEngineering',
+                'config': 'AuvConfig',
+                'bottom_track': 'InstBottom',
+                'bottom_track_config': 'BottomConfig',
+            }
+        }
+        ensembles = find_ensembles(self.data).ensembles
+        bad = ensembles[2]
+        data = bytearray(self.data)
+        data[bad.offset + bad.size - 10] ^= 0xFF
+
+        before = AdcpPd0Parser(config, StringIO(self.data[:bad.offset]), self.fail).get_records(100)
+
+        reported = []
+        parser = AdcpPd0Parser(config, StringIO(str(data)), lambda e: reported.append(len(parser._record_buffer)))
+        parser.get_records(1)
+        self.assertEqual(reported, [len(before)])
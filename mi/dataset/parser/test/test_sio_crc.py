@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""
+@package mi.dataset.parser.test
+@file mi-dataset/mi/dataset/parser/test/test_sio_crc.py
+@brief Test code for the SIO header CRC
+"""
+
+import os
+
+from nose.plugins.attrib import attr
+
+from mi.core.unit_test import MiUnitTestCase
+from mi.dataset.parser.sio_crc import crc16, crc16_table
+from mi.dataset.parser.sio_mule_common import SioParser
+
+
+def crc16_bitwise(data):
+    """
+    Reference bit at a time implementation of the SIO CRC
+    """
+    crc = 0xFFFF
+    for byte in bytearray(data):
+        crc ^= byte
+        for _ in xrange(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0x8408
+            else:
+                crc >>= 1
+    return ~crc & 0xFFFF
+
+
+@attr('UNIT', group='mi')
+class SioCrcUnitTestCase(MiUnitTestCase):
+
+    def test_known_value(self):
+        # CRC-16/X-25 check value
+        self.assertEqual(crc16('123456789'), 0x906E)
+        self.assertEqual(crc16_table('123456789'), 0x906E)
+        self.assertEqual(SioParser.calc_checksum('123456789'), '906E')
+
+    def test_empty(self):
+        self.assertEqual(crc16(''), 0)
+        self.assertEqual(SioParser.calc_checksum(''), '0000')
+
+    def test_matches_bitwise(self):
+        for length in [1, 2, 3, 16, 255, 1024]:
+            data = os.urandom(length)
+            expected = crc16_bitwise(data)
+            self.assertEqual(crc16(data), expected)
+            self.assertEqual(crc16(bytearray(data)), expected)
+            self.assertEqual(crc16_table(data), expected)
+            self.assertEqual(SioParser.calc_checksum(data), '%04X' % expected)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""
+@package mi.dataset.test.test_dataset_driver
+@file mi/dataset/test/test_dataset_driver.py
+@brief Test code for the DataSetDriver record batching
+"""
+
+import json
+
+from mock import Mock
+from nose.plugins.attrib import attr
+
+from mi.core.unit_test import MiUnitTestCase
+from mi.dataset.dataset_driver import DataSetDriver, ParticleDataHandler
+from mi.dataset.dataset_parser import SimpleParser
+
+
+class FakeParticle(object):
+    def __init__(self, stream, value):
+        self.stream = stream
+        self.value = value
+
+    def data_particle_type(self):
+        return self.stream
+
+    def generate_dict(self):
+        return {'value': self.value}
+
+    def generate(self):
+        return json.dumps(self.generate_dict())
+
+
+class FakeParser(object):
+    def __init__(self, particles):
+        self.particles = particles
+        self.requests = []
+
+    def get_records(self, count):
+        self.requests.append(count)
+        records, self.particles = self.particles[:count], self.particles[count:]
+        return records
+
+
+class GeneratorParser(SimpleParser):
+    """
+    Parser yielding a particle per record, failing on a None record
+    """
+    def parse_file(self):
+        for particle in self._stream_handle:
+            if particle is None:
+                raise ValueError('bad record')
+            yield particle
+
+
+class SingleSampleHandler(object):
+    """
+    A handler which only implements the original per particle API
+    """
+    def __init__(self):
+        self.samples = []
+        self.failure = False
+
+    def addParticleSample(self, sample_type, sample):
+        self.samples.append((sample_type, sample))
+
+    def setParticleDataCaptureFailure(self):
+        self.failure = True
+
+
+@attr('UNIT', group='mi')
+class DataSetDriverUnitTestCase(MiUnitTestCase):
+
+    def setUp(self):
+        self.particles = [FakeParticle('a', 1), FakeParticle('a', 2), FakeParticle('b', 3), FakeParticle('a', 4)]
+
+    def test_batches(self):
+        parser = FakeParser(self.particles)
+        handler = ParticleDataHandler()
+        handler.addParticleSamples = Mock(wraps=handler.addParticleSamples)
+
+        DataSetDriver(parser, handler, batch_size=3).processFileStream()
+
+        self.assertEqual(parser.requests, [3, 3, 3])
+        self.assertEqual(handler.addParticleSamples.call_count, 3)
+        self.assertEqual(handler._samples, {'a': ['{"value": 1}', '{"value": 2}', '{"value": 4}'],
+                                            'b': ['{"value": 3}']})
+        self.assertFalse(handler._failure)
+
+    def test_handler_options(self):
+        parser = FakeParser(self.particles)
+        handler = ParticleDataHandler()
+        handler.batch_size = 10
+        handler.accepts_dicts = True
+
+        DataSetDriver(parser, handler).processFileStream()
+
+        self.assertEqual(parser.requests, [10, 10])
+        self.assertEqual(handler._samples, {'a': [{'value': 1}, {'value': 2}, {'value': 4}],
+                                            'b': [{'value': 3}]})
+
+    def test_single_sample_handler(self):
+        handler = SingleSampleHandler()
+
+        DataSetDriver(FakeParser(self.particles), handler).processFileStream()
+
+        self.assertEqual(handler.samples, [('a', '{"value": 1}'), ('a', '{"value": 2}'),
+                                           ('b', '{"value": 3}'), ('a', '{"value": 4}')])
+        self.assertFalse(handler.failure)
+
+    def test_failure(self):
+        handler = ParticleDataHandler()
+
+        DataSetDriver(FakeParser(self.particles + [None]), handler).processFileStream()
+
+        self.assertTrue(handler._failure)
+
+    def test_failure_mid_batch(self):
+        # the records parsed before the bad one are delivered, as they are one at a time
+        for batch_size in [1, 100]:
+            handler = SingleSampleHandler()
+            parser = GeneratorParser({}, self.particles[:3] + [None] + self.particles[3:], None)
+
+            DataSetDriver(parser, handler, batch_size=batch_size).processFileStream()
+
+            self.assertEqual(handler.samples, [('a', '{"value": 1}'), ('a', '{"value": 2}'), ('b', '{"value": 3}')])
+            self.assertTrue(handler.failure)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""
+@package mi.dataset.test.test_dataset_parser
+@file mi/dataset/test/test_dataset_parser.py
+@brief Test code for the SimpleParser record buffering
+"""
+
+from nose.plugins.attrib import attr
+
+from mi.core.unit_test import MiUnitTestCase
+from mi.dataset.dataset_parser import SimpleParser
+
+
+class ListParser(SimpleParser):
+    """
+    Parser filling the record buffer the original way
+    """
+    def parse_file(self):
+        for line in self._stream_handle:
+            self._record_buffer.append(line)
+        self._record_buffer.insert(0, 'header')
+
+
+class GeneratorParser(SimpleParser):
+    """
+    Parser yielding its particles, recording how far it has read
+    """
+    def __init__(self, config, stream_handle, exception_callback, buffer_size=None):
+        self.parsed = 0
+        super(GeneratorParser, self).__init__(config, stream_handle, exception_callback, buffer_size)
+
+    def parse_file(self):
+        for line in self._stream_handle:
+            self.parsed += 1
+            if line == 'bad':
+                raise ValueError('bad record')
+            if line == 'b':
+                # particles added to the record buffer directly come out ahead of the one yielded
+                self._record_buffer.append('before b')
+            yield line
+
+
+@attr('UNIT', group='mi')
+class SimpleParserUnitTestCase(MiUnitTestCase):
+
+    def test_record_buffer(self):
+        parser = ListParser({}, ['a', 'b', 'c'], None)
+
+        self.assertEqual(parser.get_records(0), [])
+        self.assertEqual(parser.get_records(2), ['header', 'a'])
+        self.assertEqual(parser.get_records(5), ['b', 'c'])
+        self.assertEqual(parser.get_records(1), [])
+
+    def test_generator(self):
+        parser = GeneratorParser({}, ['a', 'b', 'c', 'd'], None)
+
+        self.assertEqual(parser.get_records(1), ['a'])
+        self.assertEqual(parser.parsed, 1)
+        self.assertEqual(parser.get_records(2), ['before b', 'b'])
+        self.assertEqual(parser.parsed, 2)
+        self.assertEqual(parser.get_records(5), ['c', 'd'])
+        self.assertEqual(parser.get_records(1), [])
+
+    def test_generator_buffer_size(self):
+        parser = GeneratorParser({}, ['a', 'b', 'c', 'd'], None, buffer_size=3)
+
+        # reading 'b' buffers two particles
+        self.assertEqual(parser.get_records(1), ['a'])
+        self.assertEqual(parser.parsed, 2)
+        self.assertEqual(parser.get_records(1), ['before b'])
+        self.assertEqual(parser.parsed, 3)
+        self.assertEqual(parser.get_records(10), ['b', 'c', 'd'])
+
+    def test_generator_error(self):
+        parser = GeneratorParser({}, ['a', 'c', 'bad', 'd'], None)
+
+        # the particles parsed before the error are returned first
+        self.assertEqual(parser.get_records(10), ['a', 'c'])
+        with self.assertRaises(ValueError):
+            parser.get_records(10)
+
+    def test_generator_error_buffered(self):
+        parser = GeneratorParser({}, ['a', 'c', 'bad'], None, buffer_size=10)
+
+        self.assertEqual(parser.get_records(1), ['a'])
+        self.assertEqual(parser.get_records(1), ['c'])
+        with self.assertRaises(ValueError):
+            parser.get_records(1)
+
+    def test_error_first(self):
+        parser = GeneratorParser({}, ['bad', 'a'], None)
+
+        with self.assertRaises(ValueError):
+            parser.get_records(10)
@@ -1,6 +1,7 @@
 import ntplib
 import cPickle as pickle
-from threading import Lock
+from Queue import Queue
+from threading import Lock, Thread
 
 from mi.core.driver_scheduler import DriverSchedulerConfigKey, TriggerType
 from mi.core.exceptions import InstrumentProtocolException, InstrumentParameterException
@@ -10,7 +11,8 @@ from mi.core.instrument.port_agent_client import PortAgentPacket
 from mi.core.instrument.protocol_param_dict import ParameterDictVisibility, ParameterDictType
 from mi.core.log import get_logger, get_logging_metaclass
 from mi.core.service_registry import ConsulPersistentStore
-from mi.instrument.antelope.orb.ooicore.packet_log import PacketLog, GapException
+from mi.instrument.antelope.orb.ooicore.orb_frame import FrameAssembler
+from mi.instrument.antelope.orb.ooicore.packet_log import PacketLog, GapException, BinPlan
 from mi.core.common import BaseEnum, Units
 from mi.core.instrument.instrument_driver import SingleConnectionInstrumentDriver, DriverConfigKey
 from mi.core.instrument.instrument_driver import DriverProtocolState
@@ -24,6 +26,19 @@ log = get_logger()
 META_LOGGER = get_logging_metaclass('trace')
 
 ORBOLDEST = -13
+# flushes waiting for the writer thread before the flush handler blocks
+MAX_PENDING_FLUSHES = 4
+
+# bin size (seconds) by sampling rate
+BIN_SIZES = {
+    1: 86400,       # 1 day
+    8: 86400,       # 1 day
+    40: 86400,      # 1 day
+    200: 86400,     # 1 day
+    64000: 60 * 5,  # 5 minutes
+    256000: 60,     # 1 minute
+}
+DEFAULT_BIN_SIZE = 60
 
 
 class ProtocolState(BaseEnum):
@@ -41,6 +56,7 @@ class ProtocolEvent(BaseEnum):
     SET = DriverEvent.SET
     FLUSH = 'PROTOCOL_EVENT_FLUSH'
     CONFIG_ERROR = 'PROTOCOL_EVENT_CONFIG_ERROR'
+    WRITE_ERROR = 'PROTOCOL_EVENT_WRITE_ERROR'
 
 
 class Capability(BaseEnum):
@@ -104,6 +120,41 @@ class AntelopeMetadataParticle(DataParticle):
         ]
 
 
+class BinWriter(Thread):
+    """
+    Writes sealed bins to disk for the protocol, so binning never waits on I/O.
+    Flushes are written in the order they are queued, the queue is bounded so a
+    writer falling behind blocks the flush handler rather than growing memory.
+    """
+    def __init__(self, write, maxsize=MAX_PENDING_FLUSHES):
+        super(BinWriter, self).__init__(name='antelope-bin-writer')
+        self.daemon = True
+        self._write = write
+        self.queue = Queue(maxsize)
+
+    def put(self, flush):
+        self.queue.put(flush)
+
+    def stop(self):
+        """
+        Write any queued flushes, then end the thread
+        """
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            flush = self.queue.get()
+            try:
+                if flush is None:
+                    break
+                self._write(flush)
+            except Exception:
+                log.exception('Exception writing antelope bins')
+            finally:
+                self.queue.task_done()
+
+
 class InstrumentDriver(SingleConnectionInstrumentDriver):
     """
     Generic antelope instrument driver
@@ -136,6 +187,7 @@ class Protocol(InstrumentProtocol):
                 (ProtocolEvent.GET, self._handler_get),
                 (ProtocolEvent.FLUSH, self._flush),
                 (ProtocolEvent.CONFIG_ERROR, self._handler_config_error),
+                (ProtocolEvent.WRITE_ERROR, self._handler_write_error),
             ),
             ProtocolState.WRITE_ERROR: (
                 (ProtocolEvent.ENTER, self._handler_error_enter),
@@ -160,14 +212,18 @@ class Protocol(InstrumentProtocol):
         self._protocol_fsm.start(ProtocolState.UNKNOWN)
         self._logs = {}
         self._filled_logs = []
+        self._plans = {}
         self._pickle_cache = []
+        self._frames = FrameAssembler()
 
         self._persistent_store = None
 
-        # lock for flush actions to prevent writing or altering the data files
-        # during flush
+        # lock for the open and filled logs, held while binning packets and
+        # while sealing the logs for a flush, never during disk writes
         self._lock = Lock()
         self._pktid = None
+        self._writer = None
+        self._write_failed = False
 
     def _filter_capabilities(self, events):
         """
@@ -285,42 +341,50 @@ class Protocol(InstrumentProtocol):
         PacketLog.is_diverted = self._param_dict.get(Parameter.IS_DIVERTED)
 
     def _flush(self):
-        particles = []
+        """
+        Seal the samples binned since the last flush and queue them for the writer
+        """
         with self._lock:
-            for _log in self._logs.itervalues():
-                try:
-                    _log.flush()
-                except InstrumentProtocolException as ex:
-                    # Ensure the current logs are clear to prevent residual data from being flushed.
-                    self._driver_event(DriverAsyncEvent.ERROR, ex)
-                    self._logs = {}
-                    self._filled_logs = []
-                    return ProtocolState.WRITE_ERROR, (ProtocolState.WRITE_ERROR, None)
-
-                particles.append(AntelopeMetadataParticle(_log, preferred_timestamp=DataParticleKey.INTERNAL_TIMESTAMP))
-
-            for _log in self._filled_logs:
-                try:
-                    _log.flush()
-                except InstrumentProtocolException as ex:
-                    # Ensure the current logs are clear to prevent residual data from being flushed.
-                    self._driver_event(DriverAsyncEvent.ERROR, ex)
-                    self._logs = {}
-                    self._filled_logs = []
-                    return ProtocolState.WRITE_ERROR, (ProtocolState.WRITE_ERROR, None)
-
-                particles.append(AntelopeMetadataParticle(_log, preferred_timestamp=DataParticleKey.INTERNAL_TIMESTAMP))
-                _log.data = []
-
+            bins = []
+            for _log in self._logs.values() + self._filled_logs:
+                particle = AntelopeMetadataParticle(_log, preferred_timestamp=DataParticleKey.INTERNAL_TIMESTAMP)
+                bins.append((_log, _log.seal(), particle.generate()))
             self._filled_logs = []
-            if self._pktid is not None:
+            pktid = self._pktid
+
+        self._writer.put((bins, pktid))
+        return None, (None, None)
+
+    def _write_bins(self, flush):
+        """
+        Write one flush on the writer thread. The pktid is only checkpointed once
+        every bin of the flush is on disk, so a restart resumes from data not yet written.
+        Any exception stops further writes and raises WRITE_ERROR.
+        """
+        bins, pktid = flush
+        if self._write_failed:
+            return
+
+        try:
+            for _log, segments, _ in bins:
+                _log.write(segments)
+
+            if pktid is not None:
                 log.info('updating persistent store')
-                self._persistent_store['pktid'] = self._pktid
+                self._persistent_store['pktid'] = pktid
 
-        for particle in particles:
-            self._driver_event(DriverAsyncEvent.SAMPLE, particle.generate())
+            for _, _, particle in bins:
+                self._driver_event(DriverAsyncEvent.SAMPLE, particle)
 
-        return None, (None, None)
+        except Exception as ex:
+            log.exception('Exception writing antelope bins')
+            # Ensure the current logs are clear to prevent residual data from being flushed.
+            self._write_failed = True
+            self._driver_event(DriverAsyncEvent.ERROR, ex)
+            with self._lock:
+                self._logs = {}
+                self._filled_logs = []
+            self._async_raise_fsm_event(ProtocolEvent.WRITE_ERROR)
 
     # noinspection PyProtectedMember
     def _orbstart(self):
@@ -348,7 +412,13 @@ class Protocol(InstrumentProtocol):
         data_length = port_agent_packet.get_data_length()
         data_type = port_agent_packet.get_header_type()
 
-        if data_type == PortAgentPacket.PICKLED_FROM_INSTRUMENT:
+        if data_type == PortAgentPacket.FRAMED_FROM_INSTRUMENT:
+            # see orb_frame, the samples are copied by _bin_data before the next frame reuses them
+            packet = self._frames.add(port_agent_packet.get_data())
+            if packet is not None:
+                self._got_packet(packet)
+        elif data_type == PortAgentPacket.PICKLED_FROM_INSTRUMENT:
+            # older port agents
             self._pickle_cache.append(port_agent_packet.get_data())
             # this is the max size (65535) minus the header size (16)
             # any packet of this length will be followed by one or more packets
@@ -357,45 +427,41 @@ class Protocol(InstrumentProtocol):
             if data_length != 65519:
                 data = pickle.loads(''.join(self._pickle_cache))
                 self._pickle_cache = []
-                # Check that the data contains a sampling rate > 0, otherwise downstream calculations will fail.
-                if data['samprate'] > 0:
-                    self._bin_data(data)
-                else:
-                    raise InstrumentProtocolException('Received Antelope data packets with samprate <= 0')
+                self._got_packet(data)
+        else:
+            raise InstrumentProtocolException('Received unexpected data from port agent')
+
+    def _got_packet(self, packet):
+        # Check that the data contains a sampling rate > 0, otherwise downstream calculations will fail.
+        if packet['samprate'] > 0:
+            self._bin_data(packet)
         else:
-            raise InstrumentProtocolException('Received unpickled data from port agent')
+            raise InstrumentProtocolException('Received Antelope data packets with samprate <= 0')
 
     def got_raw(self, port_agent_packet):
         pass
 
-    def _get_bin(self, packet):
-        rate_map = {
-            1: 86400,       # 1 day
-            8: 86400,       # 1 day
-            40: 86400,      # 1 day
-            200: 86400,     # 1 day
-            64000: 60 * 5,  # 5 minutes
-            256000: 60,     # 1 minute
-        }
-        start_time = packet['time']
+    def _get_plan(self, key, packet):
+        """
+        Return the bin plan for a channel, created on its first packet or when its rate changes
+        """
+        plan = self._plans.get(key)
         rate = packet['samprate']
-        bin_size = rate_map.get(rate, 60)
-        bin_value = int(start_time/bin_size)
-        bin_start = bin_value * bin_size
-        bin_end = (bin_value + 1) * bin_size
-
-        return bin_start, bin_end
+        if plan is None or plan.rate != rate:
+            plan = self._plans[key] = BinPlan(rate, BIN_SIZES.get(rate, DEFAULT_BIN_SIZE))
+        return plan
 
     def _bin_data(self, packet):
         key = '%s.%s.%s.%s' % (packet['net'], packet.get('location', ''),
                                packet.get('sta', ''), packet['chan'])
-        start, end = self._get_bin(packet)
+        refdes = self._param_dict.get(Parameter.REFDES)
 
         with self._lock:
             self._pktid = packet['pktid']
+            plan = self._get_plan(key, packet)
 
             if key not in self._logs:
-                self._logs[key] = PacketLog.from_packet(packet, start, end, self._param_dict.get(Parameter.REFDES))
+                self._logs[key] = PacketLog.from_packet(packet, plan, refdes)
 
             try:
                 while True:
@@ -407,8 +473,7 @@ class Protocol(InstrumentProtocol):
                     self._filled_logs.append(self._logs[key])
                     del self._logs[key]
                     # create the new log...
-                    start, end = self._get_bin(packet)
-                    self._logs[key] = PacketLog.from_packet(packet, start, end, self._param_dict.get(Parameter.REFDES))
+                    self._logs[key] = PacketLog.from_packet(packet, plan, refdes)
 
             except GapException:
                 log.info('************ Triggered GapException')
@@ -416,8 +481,7 @@ class Protocol(InstrumentProtocol):
                 self._filled_logs.append(self._logs[key])
                 del self._logs[key]
                 # create the new log...
-                start, end = self._get_bin(packet)
-                self._logs[key] = PacketLog.from_packet(packet, start, end, self._param_dict.get(Parameter.REFDES))
+                self._logs[key] = PacketLog.from_packet(packet, plan, refdes)
                 self._logs[key].add_packet(packet)
 
     ########################################################################
@@ -460,6 +524,9 @@ class Protocol(InstrumentProtocol):
         try:
             self._init_params()
             self._build_persistent_dict()
+            self._write_failed = False
+            self._writer = BinWriter(self._write_bins)
+            self._writer.start()
             self._add_scheduler_event(ScheduledJob.FLUSH, ProtocolEvent.FLUSH)
             self._orbstart()
 
@@ -474,12 +541,20 @@ class Protocol(InstrumentProtocol):
         """
         self.stop_scheduled_job(ScheduledJob.FLUSH)
         self._orbstop()
+        if self._writer is not None:
+            self._writer.stop()
+            self._writer = None
 
     def _handler_config_error(self, *args, **kwargs):
         next_state = ProtocolState.CONFIG_ERROR
         result = None
         return next_state, (next_state, result)
 
+    def _handler_write_error(self, *args, **kwargs):
+        next_state = ProtocolState.WRITE_ERROR
+        result = None
+        return next_state, (next_state, result)
+
     ######################################################
     # ERROR handlers
     ######################################################
@@ -0,0 +1,115 @@
+"""
+@package mi.instrument.antelope.orb.ooicore.orb_frame
+@file mi/instrument/antelope/orb/ooicore/orb_frame.py
+@brief Framed binary ORB packets from the antelope port agent
+
+A frame carries one ORB packet: a fixed size little-endian header
+(FRAME_HEADER) followed by the samples as little-endian int32. Frames longer
+than the data of one port agent packet continue in the following packets,
+the header is always at the start of the first. Unlike pickled packets the
+samples are not converted to Python objects, they are copied from the port
+agent packets straight into a NumPy buffer.
+"""
+import struct
+
+import numpy as np
+
+from mi.core.exceptions import InstrumentProtocolException
+
+__license__ = 'Apache 2.0'
+
+FRAME_MAGIC = 'ORBF'
+FRAME_VERSION = 1
+# magic, version, pktid, time, samprate, calib, calper, nsamp, net, sta, loc, chan
+FRAME_HEADER = struct.Struct('<4sHqddddI8s8s8s8s')
+SAMPLE_DTYPE = np.dtype('<i4')
+INITIAL_SAMPLES = 65536
+
+
+def pack_frame(packet):
+    """
+    Encode an ORB packet (dict) as a frame
+    """
+    data = np.asarray(packet['data'], dtype=SAMPLE_DTYPE)
+    header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, packet['pktid'], packet['time'], packet['samprate'],
+                               packet['calib'], packet['calper'], len(data), packet['net'], packet['sta'],
+                               packet['loc'], packet['chan'])
+    return header + data.tobytes()
+
+
+class FrameAssembler(object):
+    """
+    Rebuilds ORB packets from the data of consecutive port agent packets.
+
+    The samples of a frame split over several port agent packets are copied
+    into a buffer reused for every frame, a packet's data is only valid until
+    the next call to add.
+    """
+    def __init__(self):
+        self._buffer = np.empty(INITIAL_SAMPLES, dtype=SAMPLE_DTYPE)
+        self._packet = None
+        self._size = 0
+        self._received = 0
+
+    def add(self, data):
+        """
+        Add the data of one port agent packet
+        @returns the ORB packet (dict) once its frame is complete, otherwise None
+        @raises InstrumentProtocolException if the frame is malformed
+        """
+        offset = 0
+        if self._packet is None:
+            self._packet = self._unpack_header(data)
+            self._size = self._packet['nsamp'] * SAMPLE_DTYPE.itemsize
+            self._received = 0
+            offset = FRAME_HEADER.size
+
+            if len(data) - offset == self._size:
+                # the whole frame is in this packet, no need to copy
+                packet, self._packet = self._packet, None
+                packet['data'] = np.frombuffer(data, dtype=SAMPLE_DTYPE, count=packet['nsamp'], offset=offset)
+                return packet
+
+            if self._packet['nsamp'] > len(self._buffer):
+                self._buffer = np.empty(self._packet['nsamp'], dtype=SAMPLE_DTYPE)
+
+        count = len(data) - offset
+        if self._received + count > self._size:
+            self._packet = None
+            raise InstrumentProtocolException('Antelope frame longer than its header: %d bytes of samples, '
+                                              'expected %d' % (self._received + count, self._size))
+        if count:
+            buf = self._buffer.view(np.uint8)
+            buf[self._received:self._received + count] = np.frombuffer(data, dtype=np.uint8, count=count,
+                                                                       offset=offset)
+            self._received += count
+
+        if self._received < self._size:
+            return None
+
+        packet, self._packet = self._packet, None
+        packet['data'] = self._buffer[:packet['nsamp']]
+        return packet
+
+    @staticmethod
+    def _unpack_header(data):
+        if len(data) < FRAME_HEADER.size:
+            raise InstrumentProtocolException('Antelope frame too short: %d bytes' % len(data))
+
+        (magic, version, pktid, time, samprate, calib, calper, nsamp,
+         net, sta, loc, chan) = FRAME_HEADER.unpack_from(data)
+        if magic != FRAME_MAGIC or version != FRAME_VERSION:
+            raise InstrumentProtocolException('Not an antelope frame: %r version %d' % (magic, version))
+
+        return {
+            'pktid': pktid,
+            'time': time,
+            'samprate': samprate,
+            'calib': calib,
+            'calper': calper,
+            'nsamp': nsamp,
+            'net': net.rstrip('\0'),
+            'sta': sta.rstrip('\0'),
+            'loc': loc.rstrip('\0'),
+            'chan': chan.rstrip('\0'),
+        }
@@ -1,18 +1,98 @@
 import os
 import math
+import struct
 import uuid
 from datetime import datetime
-from decimal import Decimal, getcontext
+from fractions import Fraction
+from io import BytesIO
 
 from obspy.core import Stats
 import numpy as np
-from obspy import Trace, Stream
+from obspy import Trace, UTCDateTime
 
 from mi.core.log import get_logger
 from mi.core.exceptions import InstrumentProtocolException
 
 log = get_logger()
-getcontext().prec = 7
+
+# MiniSEED record length written by obspy by default
+RECORD_LENGTH = 4096
+# offset and format of the number of samples in the fixed header of a (big endian) record
+RECORD_NSAMP_OFFSET = 30
+RECORD_NSAMP_FORMAT = '>H'
+MAX_SEQUENCE_NUMBER = 999999
+
+NANOS = 10 ** 9
+# A sample this close to a bin boundary belongs to the bin starting there. ORB
+# packet times are doubles, good to about 0.25 us at current epochs, and 256 kHz
+# samples are 3.9 us apart.
+TIME_TOLERANCE_NS = 1000
+# sampling rates are held as exact fractions with at most this denominator
+MAX_RATE_DENOMINATOR = 10 ** 6
+
+
+def to_nanos(seconds):
+    """
+    Convert epoch seconds to integer nanoseconds
+    """
+    whole = math.floor(seconds)
+    return int(whole) * NANOS + int(round((seconds - whole) * NANOS))
+
+
+def to_seconds(nanos):
+    return nanos // NANOS + (nanos % NANOS) / float(NANOS)
+
+
+def packet_time_ns(packet):
+    """
+    Start time of an ORB packet in nanoseconds, residual packets returned by
+    PacketLog.add_packet carry it exactly
+    """
+    time_ns = packet.get('time_ns')
+    if time_ns is None:
+        time_ns = to_nanos(packet['time'])
+    return time_ns
+
+
+class BinPlan(object):
+    """
+    Time arithmetic for the packets of one channel, in integer nanoseconds and
+    sample counts: the bins of bin_size seconds its samples are written to and
+    the duration of a number of samples at its sampling rate.
+    """
+    def __init__(self, rate, bin_size):
+        self.rate = rate
+        self.bin_size = bin_size
+        self.bin_ns = to_nanos(bin_size)
+        rate = Fraction(rate).limit_denominator(MAX_RATE_DENOMINATOR)
+        self._rate_num = rate.numerator
+        self._rate_den = rate.denominator
+
+    def bin(self, time_ns):
+        """
+        @returns the start and end (nanoseconds) of the bin holding a sample at time_ns
+        """
+        start = (time_ns + TIME_TOLERANCE_NS) // self.bin_ns * self.bin_ns
+        return start, start + self.bin_ns
+
+    def duration(self, nsamp):
+        """
+        @returns the nanoseconds spanned by nsamp samples, rounded to the nearest nanosecond
+        """
+        return (2 * nsamp * NANOS * self._rate_den + self._rate_num) // (2 * self._rate_num)
+
+    def samples_before(self, time_ns, end_ns):
+        """
+        @returns the number of samples starting at time_ns which fall before end_ns
+        """
+        span = (end_ns - TIME_TOLERANCE_NS - time_ns) * self._rate_num
+        return max(0, -(-span // (NANOS * self._rate_den)))
+
+    def contiguous(self, end_ns, time_ns):
+        """
+        @returns True if a sample at time_ns is within half a sample of end_ns
+        """
+        return 2 * abs(time_ns - end_ns) * self._rate_num <= NANOS * self._rate_den
 
 
 class Vector(object):
@@ -37,9 +117,13 @@ class Vector(object):
         self.index = new_index
 
     def _realloc(self, new_index):
-        while new_index >= self.length:
-            self.length = int(self.length * self.factor)
-            self.backing_store.resize((self.length,))
+        if new_index >= self.length:
+            while new_index >= self.length:
+                self.length = max(self.length + 1, int(self.length * self.factor))
+            # copy rather than resize in place, views returned by get may still exist
+            backing_store = np.zeros(self.length, dtype=self.dtype)
+            backing_store[:self.index] = self.backing_store[:self.index]
+            self.backing_store = backing_store
 
     def get(self):
         return self.backing_store[:self.index]
@@ -92,14 +176,17 @@ class PacketLogHeader(object):
 
     @property
     def stats(self):
+        return self.segment_stats(self.starttime, self.num_samples)
+
+    def segment_stats(self, starttime, npts):
         return Stats({
             'network': self.net,
             'location': self.location,
             'station': self.station,
             'channel': self.channel,
-            'starttime': self.starttime,
+            'starttime': starttime,
             'sampling_rate': self.rate,
-            'npts': self.num_samples,
+            'npts': npts,
             'calib': self.calib
         })
 
@@ -117,7 +204,23 @@ class PacketLogHeader(object):
 
 
 class PacketLog(object):
+    """
+    Bins the samples of ORB packets into a MiniSEED file.
+
+    Contiguous packets are merged into one growing sample buffer (data),
+    samples not contiguous with the buffer start a new segment. Times are
+    integer nanoseconds, a packet is split at the end of the bin by slicing
+    its samples (see BinPlan). A flush is
+    split in two: seal hands over the samples received since the last flush
+    and is cheap enough to run while packets are being binned, write appends
+    them to the file as MiniSEED records and may run on another thread, one
+    write at a time. The last record written may be partial, its samples are
+    kept (tail) and encoded again with the samples of the next write. The file
+    holds the same records obspy writes for a stream, so it reads back the
+    same.
+    """
     TIME_FUDGE_PCNT = 10
+    INITIAL_SAMPLES = 4096
     base_dir = './antelope_data'
     is_diverted = False
 
@@ -125,14 +228,31 @@ class PacketLog(object):
         self.header = None
         self.needs_flush = False
         self.closed = False
-        self.data = Stream([])
+        self.plan = None
+        self._min_ns = None
+        self._max_ns = None
+        # samples received since the last seal, data starts at _segment_start (ns)
+        self.data = Vector(self.INITIAL_SAMPLES, 'i')
+        self._segment_start = None
+        # earlier segments (start, samples) received since the last seal
+        self._segments = []
+        # written samples of the last (partial) record, starting at _tail_start
+        self._tail = None
+        self._tail_start = None
+        # file offset and sequence number of the first record not yet complete
+        self._offset = 0
+        self._sequence = 1
         self._relpath = None
 
         # Generate a UUID for this PacketLog
         self.bin_uuid = str(uuid.uuid4())
 
-    def create(self, net, location, station, channel, start, mintime, maxtime, rate, calib, calper, refdes):
+    def create(self, net, location, station, channel, start, mintime, maxtime, rate, calib, calper, refdes,
+               plan=None):
         self.header = PacketLogHeader(net, location, station, channel, start, mintime, maxtime, rate, calib, calper, refdes)
+        self.plan = plan or BinPlan(rate, maxtime - mintime)
+        self._min_ns = to_nanos(mintime)
+        self._max_ns = to_nanos(maxtime)
         if not os.path.exists(self.abspath):
             try:
                 os.makedirs(self.abspath)
@@ -142,7 +262,11 @@ class PacketLog(object):
             raise InstrumentProtocolException('Error creating file path: File exists with same name: ' + self.abspath)
 
     @staticmethod
-    def from_packet(packet, bin_start, bin_end, refdes):
+    def from_packet(packet, plan, refdes):
+        """
+        Create the log for the bin of plan holding the first sample of packet
+        """
+        bin_start, bin_end = plan.bin(packet_time_ns(packet))
         packet_log = PacketLog()
         packet_log.create(
             packet.get('net', ''),
@@ -150,12 +274,13 @@ class PacketLog(object):
             packet.get('sta', ''),
             packet.get('chan', ''),
             packet['time'],
-            bin_start,
-            bin_end,
+            to_seconds(bin_start),
+            to_seconds(bin_end),
             packet['samprate'],
             packet['calib'],
             packet['calper'],
-            refdes
+            refdes,
+            plan
             )
         return packet_log
 
@@ -186,70 +311,122 @@ class PacketLog(object):
         return os.path.join(self.base_dir, self.header.refdes, self.relname)
 
     def add_packet(self, packet):
-        # If the current packet is not within the 5 min file, then move to the next 5 minute file
-        if self.header.mintime > packet['time'] or packet['time'] >= self.header.maxtime:
-            log.info('******** GAP EXCEPTION ABOUT TO BE RAISED ********')
-            log.info('packet[\'time\']: %s' % str(packet['time']))
-            log.info('starttime: %s' % str(self.header.starttime))
-            log.info('mintime: %s' % str(self.header.mintime))
-            log.info('maxtime: %s' % str(self.header.maxtime))
-            log.info('num_samples: %s' % str(self.header.num_samples))
+        """
+        Add the samples of a packet up to the end of the bin
+        @returns None, or the rest of the packet if it runs past the end of the bin
+        @raises GapException if the packet does not start in the bin
+        """
+        time_ns = packet_time_ns(packet)
+        if not self._min_ns - TIME_TOLERANCE_NS <= time_ns < self._max_ns - TIME_TOLERANCE_NS:
+            log.info('packet at %s outside of bin %s - %s', to_seconds(time_ns), self.header.mintime,
+                     self.header.maxtime)
             raise GapException()
 
-        # Check that the packet is fully contained in the 5m file
-        packet_endtime = float(Decimal(str(packet['time'])) + (Decimal(self.header.delta) * Decimal(str(packet['nsamp']))))
-        if self.header.maxtime >= packet_endtime:
-            self._write_data(packet['data'], float(Decimal(str(packet['time']))))
+        data = np.asarray(packet['data'], dtype='i')
+        count = self.plan.samples_before(time_ns, self._max_ns)
+        if count >= len(data):
+            self._write_data(data, time_ns)
             return None
 
-        # Check the time delta between the current 5m max time and packet start time
-        # Used to tell whether we are on a boundary
-        diff = Decimal(str(self.header.maxtime)) - Decimal(str(packet['time']))
-        # Check if diff is > 0
-        if float(diff) > 0:
-            log.info('maxtime: %s' % str(self.header.maxtime))
-            log.info('packet[\'time\']: %s' % str(packet['time']))
-            log.info('diff: %s' % str(diff))
-
-            # Number of samples between the packet start time and 5 min mark
-            # The maximum number of samples can be 19,200,000 for a 5 minute file, need to check this condition
-            nsamps = int(math.ceil(diff * Decimal(str(self.header.rate))))
-            log.info('nsamps before: %s' % str(nsamps))
-
-            # Write the data up to the current 5m mark
-            data_before = packet['data'][:nsamps]
-            self._write_data(data_before, float(Decimal(str(packet['time']))))
-
-            # Prepare the remaining data in the packet and send back for the next 5m file
-            packet['data'] = packet['data'][nsamps:]
-            packet['nsamp'] = len(packet['data'])
-
-            packet['time'] = float(Decimal(str(packet['time'])) + (Decimal(self.header.delta) * Decimal(str(len(data_before)))))
-            log.info('nsamps after: %s' % str(packet['nsamp']))
-            log.info('packet[\'time\'] after: %s' % str(packet['time']))
-            return packet
-        else:
-            return None
+        # write the samples up to the end of the bin, return the rest for the next bin
+        self._write_data(data[:count], time_ns)
+        packet['data'] = data[count:]
+        packet['nsamp'] = len(packet['data'])
+        packet['time_ns'] = time_ns + self.plan.duration(count)
+        packet['time'] = to_seconds(packet['time_ns'])
+        return packet
 
-    def _write_data(self, data, mintime):
-        # Append Trace to Stream
+    @property
+    def _data_end(self):
+        # time of the sample following the buffered data
+        return self._segment_start + self.plan.duration(self.data.index)
+
+    def _write_data(self, data, time_ns):
         count = len(data)
-        # Set the number of data points in the Trace metadata
+        # Set the number of data points in the metadata
         self.header.num_samples = count
-        # Set the Trace metadata starttime to the packet's first data point time
-        self.header.starttime = float(Decimal(str(mintime)))
-        self.data.append(Trace(np.asarray(data, dtype='i'), self.header.stats))
+        # Set the metadata starttime to the packet's first data point time
+        self.header.starttime = to_seconds(time_ns)
+
+        if self.data.index and not self.plan.contiguous(self._data_end, time_ns):
+            # not contiguous, start a new segment
+            self._segments.append((self._segment_start, self.data.get()))
+            self.data = Vector(max(self.INITIAL_SAMPLES, count), 'i')
+        if not self.data.index:
+            self._segment_start = time_ns
+        self.data.extend(data)
         self.needs_flush = True
 
-    def _write_trace(self):
-        # Write multi-trace Stream to MSEED
-        log.info('_write_trace: Hydrophone data rate: %s' % str(self.header.rate))
-        stream = self.data
-        stream.write(self.absname, format='MSEED')
+    def _encode(self, start_ns, samples):
+        """
+        Encode samples as MiniSEED records, numbered from the current sequence number
+        @returns the records and the number of samples in the last record
+        """
+        buf = BytesIO()
+        trace = Trace(samples, self.header.segment_stats(UTCDateTime(ns=start_ns), len(samples)))
+        trace.write(buf, format='MSEED', reclen=RECORD_LENGTH, sequence_number=self._sequence)
+        records = buf.getvalue()
+        self._sequence = (self._sequence + len(records) / RECORD_LENGTH - 1) % MAX_SEQUENCE_NUMBER + 1
+        last_samples, = struct.unpack_from(RECORD_NSAMP_FORMAT, records, len(records) - RECORD_LENGTH +
+                                           RECORD_NSAMP_OFFSET)
+        return records, last_samples
+
+    def seal(self):
+        """
+        Take the samples received since the last seal, to be passed to write
+        @returns a list of segments (start, samples)
+        """
+        segments = self._segments
+        if self.data.index:
+            segments.append((self._segment_start, self.data.get()))
+            self.data = Vector(self.INITIAL_SAMPLES, 'i')
+        self._segments = []
+        self.needs_flush = False
+        return segments
+
+    def write(self, segments):
+        """
+        Append the records of sealed segments, replacing the last (partial) record of the previous write
+        """
+        if not segments:
+            return
+
+        segments = list(segments)
+        if self._tail is not None:
+            tail_end = self._tail_start + self.plan.duration(len(self._tail))
+            start, samples = segments[0]
+            if self.plan.contiguous(tail_end, start):
+                segments[0] = self._tail_start, np.concatenate((self._tail, samples))
+            else:
+                segments.insert(0, (self._tail_start, self._tail))
+
+        records = []
+        for start, samples in segments:
+            data, last_samples = self._encode(start, samples)
+            records.append(data)
+
+        try:
+            with open(self.absname, 'r+b' if self._offset else 'wb') as fh:
+                fh.seek(self._offset)
+                fh.truncate()
+                for data in records:
+                    fh.write(data)
+                end = fh.tell()
+                # the caller checkpoints its position in the ORB once this returns
+                fh.flush()
+                os.fsync(fh.fileno())
+        except (IOError, OSError) as e:
+            raise InstrumentProtocolException('Error writing %s: %s' % (self.absname, e))
+
+        # keep the samples of the last record, it is written again with any new samples
+        self._offset = end - RECORD_LENGTH
+        self._sequence = (self._sequence - 2) % MAX_SEQUENCE_NUMBER + 1
+        start, samples = segments[-1]
+        consumed = len(samples) - last_samples
+        self._tail_start = start + self.plan.duration(consumed)
+        self._tail = samples[consumed:].copy()
 
     def flush(self):
         if self.needs_flush:
             log.info('flush: %-40s', self.absname)
-            self._write_trace()
-
-            self.needs_flush = False
+            self.write(self.seal())
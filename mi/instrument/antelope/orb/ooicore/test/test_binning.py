@@ -0,0 +1,178 @@
+"""
+@package mi.instrument.antelope.orb.ooicore.test.test_binning
+@file mi/instrument/antelope/orb/ooicore/test/test_binning.py
+@brief Test cases for binning synthetic multi-rate ORB packet streams
+"""
+import shutil
+import tempfile
+from itertools import izip_longest
+
+import numpy as np
+from mock import Mock, patch
+from nose.plugins.attrib import attr
+from unittest import TestCase
+
+from mi.instrument.antelope.orb.ooicore.driver import Protocol, Parameter, BIN_SIZES, DEFAULT_BIN_SIZE
+from mi.instrument.antelope.orb.ooicore.packet_log import BinPlan, PacketLog, NANOS, TIME_TOLERANCE_NS, \
+    to_nanos, to_seconds
+
+__license__ = 'Apache 2.0'
+
+# 2016-01-01T00:00:00Z
+MIDNIGHT = 1451606400.0
+
+
+@attr('UNIT', group='mi')
+class BinPlanUnitTest(TestCase):
+    def test_to_nanos(self):
+        self.assertEqual(to_nanos(1451606400.5), 1451606400500000000)
+        self.assertEqual(to_nanos(-0.25), -250000000)
+        self.assertEqual(to_seconds(1451606400500000000), 1451606400.5)
+
+    def test_duration(self):
+        plan = BinPlan(256000.0, 60)
+        # 256 kHz samples are 3906.25 ns apart, durations do not accumulate rounding
+        self.assertEqual(plan.duration(1), 3906)
+        self.assertEqual(plan.duration(4), 15625)
+        self.assertEqual(plan.duration(256000), NANOS)
+        self.assertEqual(BinPlan(0.1, 86400).duration(3), 30 * NANOS)
+
+    def test_bin(self):
+        plan = BinPlan(64000, 300)
+        start = to_nanos(MIDNIGHT)
+        self.assertEqual(plan.bin(start), (start, start + 300 * NANOS))
+        self.assertEqual(plan.bin(start - 1)[0], start)
+        # a time within the tolerance of the boundary belongs to the next bin
+        self.assertEqual(plan.bin(start - 100)[0], start)
+        self.assertEqual(plan.bin(start - TIME_TOLERANCE_NS - 1)[0], start - 300 * NANOS)
+
+    def test_samples_before(self):
+        plan = BinPlan(256000, 60)
+        end = to_nanos(MIDNIGHT)
+        self.assertEqual(plan.samples_before(end - plan.duration(100), end), 100)
+        # float packet times are only good to a few hundred nanoseconds
+        self.assertEqual(plan.samples_before(end - plan.duration(100) + 200, end), 100)
+        self.assertEqual(plan.samples_before(end - plan.duration(100) - 200, end), 100)
+        self.assertEqual(plan.samples_before(end + 5, end), 0)
+
+    def test_contiguous(self):
+        plan = BinPlan(200, 86400)
+        self.assertTrue(plan.contiguous(0, 2499999))
+        self.assertFalse(plan.contiguous(0, 2500001))
+
+
+@attr('UNIT', group='mi')
+class BinDataUnitTest(TestCase):
+    def setUp(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        patcher = patch.object(PacketLog, 'base_dir', base_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.protocol = Protocol(Mock())
+        self.protocol._param_dict.set_value(Parameter.REFDES, 'test')
+        self.pktid = 0
+
+    @staticmethod
+    def stream(chan, rate, start, nsamp, count, first=0):
+        """
+        Contiguous packets of nsamp samples, numbered from first
+        """
+        for index in xrange(count):
+            offset = index * nsamp
+            yield {'net': 'OO', 'sta': 'AXAS1', 'chan': chan, 'loc': '', 'samprate': rate, 'calib': 1.0,
+                   'calper': 0.0, 'time': start + offset / float(rate), 'nsamp': nsamp,
+                   'data': np.arange(first + offset, first + offset + nsamp, dtype='i')}
+
+    def bin_data(self, *streams):
+        # interleave the channels, as the ORB would
+        for packets in izip_longest(*streams):
+            for packet in packets:
+                if packet is not None:
+                    self.pktid += 1
+                    packet['pktid'] = self.pktid
+                    self.protocol._bin_data(packet)
+
+    def logs(self, chan):
+        logs = [_log for _log in self.protocol._filled_logs + self.protocol._logs.values()
+                if _log.header.channel == chan]
+        return sorted(logs, key=lambda _log: _log.header.mintime)
+
+    def assert_binned(self, chan, rate, start, total):
+        """
+        Assert every sample of a contiguous stream is in the log of its bin, in order
+        """
+        logs = self.logs(chan)
+        plan = BinPlan(rate, BIN_SIZES.get(rate, DEFAULT_BIN_SIZE))
+        start_ns = to_nanos(start)
+        samples = []
+        for _log in logs:
+            segments = _log.seal()
+            self.assertEqual(len(segments), 1)
+            segment_start, data = segments[0]
+            # the first sample of a bin follows the last sample of the previous bin
+            self.assertLess(abs(segment_start - (start_ns + plan.duration(len(samples)))), TIME_TOLERANCE_NS)
+            # the first and last samples are in the bin
+            bin_start, bin_end = to_nanos(_log.header.mintime), to_nanos(_log.header.maxtime)
+            self.assertEqual(bin_end - bin_start, plan.bin_ns)
+            self.assertEqual(plan.bin(segment_start), (bin_start, bin_end))
+            self.assertEqual(plan.bin(segment_start + plan.duration(len(data) - 1)), (bin_start, bin_end))
+            samples.extend(data)
+        np.testing.assert_array_equal(samples, np.arange(total))
+        return logs
+
+    def test_multi_rate(self):
+        streams = [
+            ('LHZ', 1, 100, 36),
+            ('BHZ', 40, 400, 50),
+            ('HHZ', 200, 1000, 40),
+            ('HDH', 64000, 32000, 80),
+            ('HNZ', 256000, 100000, 100),
+        ]
+        # every stream crosses midnight, the boundary of all bin sizes
+        start = MIDNIGHT - 30.5
+        self.bin_data(*[self.stream(chan, rate, start, nsamp, count) for chan, rate, nsamp, count in streams])
+
+        for chan, rate, nsamp, count in streams:
+            logs = self.assert_binned(chan, rate, start, nsamp * count)
+            self.assertEqual([_log.header.maxtime for _log in logs][:1], [MIDNIGHT], chan)
+            self.assertEqual(len(logs), 2, chan)
+        self.assertEqual(self.protocol._pktid, self.pktid)
+
+    def test_many_bins(self):
+        # 3 kHz samples are not a whole number of nanoseconds apart, the packets
+        # do not divide the (default, 1 minute) bins
+        start = MIDNIGHT + 0.25
+        self.bin_data(self.stream('HGZ', 3000, start, 7001, 100))
+        logs = self.assert_binned('HGZ', 3000, start, 700100)
+        self.assertEqual([_log.header.mintime - MIDNIGHT for _log in logs], [0, 60, 120, 180])
+
+    def test_boundary_time_error(self):
+        # a packet meant to start on a bin boundary, with a timestamp slightly early
+        packets = list(self.stream('HDH', 64000, MIDNIGHT + 60, 100, 2))
+        packets[1]['time'] = MIDNIGHT + 300 - 2e-7
+        self.bin_data(packets)
+        logs = self.logs('HDH')
+        self.assertEqual([_log.header.mintime for _log in logs], [MIDNIGHT, MIDNIGHT + 300])
+        self.assertEqual([_log.data.index for _log in logs], [100, 100])
+
+    def test_gap_between_bins(self):
+        start = MIDNIGHT + 30
+        self.bin_data(self.stream('HNZ', 256000, start, 256000, 2))
+        self.bin_data(self.stream('HNZ', 256000, start + 3600, 256000, 1, first=512000))
+        logs = self.logs('HNZ')
+        self.assertEqual([_log.header.mintime for _log in logs], [MIDNIGHT, MIDNIGHT + 3600])
+        self.assertEqual([_log.data.index for _log in logs], [512000, 256000])
+
+    def test_residual(self):
+        plan = BinPlan(256000, 60)
+        packet = next(self.stream('HNZ', 256000, MIDNIGHT + 60 - 10 / 256000.0, 1000, 1))
+        packet_log = PacketLog.from_packet(packet, plan, 'test')
+        residual = packet_log.add_packet(packet)
+
+        self.assertEqual(packet_log.data.index, 10)
+        self.assertEqual(residual['nsamp'], 990)
+        self.assertLess(abs(residual['time_ns'] - to_nanos(MIDNIGHT + 60)), TIME_TOLERANCE_NS)
+        self.assertEqual(residual['time'], to_seconds(residual['time_ns']))
+        np.testing.assert_array_equal(residual['data'][:2], [10, 11])
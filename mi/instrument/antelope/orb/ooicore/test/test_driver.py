@@ -13,13 +13,18 @@ USAGE:
        $ bin/test_driver -q [-t testname]
 """
 
+import shutil
+import tempfile
+import threading
 import time
 
 import ntplib
-from mock import Mock
+from mock import Mock, patch
 from nose.plugins.attrib import attr
 import os
 
+from mi.core.exceptions import InstrumentProtocolException
+from mi.core.instrument.instrument_driver import DriverAsyncEvent
 from mi.core.instrument.port_agent_client import PortAgentPacket
 from mi.core.log import get_logger
 from mi.idk.unit_test import InstrumentDriverTestCase
@@ -29,7 +34,9 @@ from mi.idk.unit_test import DriverTestMixin
 from mi.idk.unit_test import ParameterTestConfigKey
 from mi.core.instrument.instrument_driver import DriverConfigKey
 from mi.instrument.antelope.orb.ooicore.driver import Capability, ProtocolState, InstrumentDriver, Protocol,\
-                                                        ProtocolEvent, Parameter, AntelopeMetadataParticleKey
+                                                        ProtocolEvent, Parameter, AntelopeMetadataParticleKey,\
+                                                        BinWriter
+from mi.instrument.antelope.orb.ooicore.packet_log import PacketLog
 
 __author__ = 'Pete Cable'
 __license__ = 'Apache 2.0'
@@ -114,7 +121,8 @@ class AntelopeTestMixinSub(DriverTestMixin):
         ProtocolState.UNKNOWN: ['DRIVER_EVENT_DISCOVER'],
         ProtocolState.AUTOSAMPLE: ['DRIVER_EVENT_GET',
                                    'PROTOCOL_EVENT_FLUSH',
-                                   'PROTOCOL_EVENT_CONFIG_ERROR'],
+                                   'PROTOCOL_EVENT_CONFIG_ERROR',
+                                   'PROTOCOL_EVENT_WRITE_ERROR'],
         ProtocolState.CONFIG_ERROR: [],
         ProtocolState.WRITE_ERROR: [],
     }
@@ -267,6 +275,89 @@ class DriverUnitTest(InstrumentDriverUnitTestCase, AntelopeTestMixinSub):
         driver = InstrumentDriver(self._got_data_event_callback)
         self.assert_driver_schema(driver, self._driver_parameters, self._driver_capabilities)
 
+    def _create_flush_protocol(self, write=None):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        patcher = patch.object(PacketLog, 'base_dir', base_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        protocol = Protocol(Mock())
+        protocol._param_dict.set_value(Parameter.REFDES, 'test')
+        protocol._persistent_store = {}
+        protocol._async_raise_fsm_event = Mock()
+        protocol._writer = BinWriter(write or protocol._write_bins)
+        protocol._writer.start()
+        self.addCleanup(protocol._writer.stop)
+        return protocol
+
+    @staticmethod
+    def _antelope_packet(pktid, start, nsamp=200):
+        return {'net': 'OO', 'sta': 'AXAS1', 'chan': 'EHE', 'loc': '', 'time': start, 'samprate': 200,
+                'calib': 1.0, 'calper': 0.0, 'nsamp': nsamp, 'data': range(nsamp), 'pktid': pktid}
+
+    def test_flush_off_thread(self):
+        """
+        Verify binning continues while a flush is written and pktid is stored once the bins are on disk
+        """
+        writing = threading.Event()
+        release = threading.Event()
+
+        def write(flush):
+            writing.set()
+            release.wait(5)
+            protocol._write_bins(flush)
+
+        protocol = self._create_flush_protocol(write)
+        protocol._bin_data(self._antelope_packet(1, 1000.0))
+        protocol._flush()
+        self.assertTrue(writing.wait(5))
+
+        # the write is blocked, binning is not
+        protocol._bin_data(self._antelope_packet(2, 1001.0))
+        self.assertNotIn('pktid', protocol._persistent_store)
+
+        release.set()
+        protocol._writer.queue.join()
+        self.assertEqual(protocol._persistent_store['pktid'], 1)
+        _log = protocol._logs.values()[0]
+        self.assertTrue(os.path.exists(_log.absname))
+        self.assertEqual(protocol._driver_event.call_args[0][0], DriverAsyncEvent.SAMPLE)
+
+        protocol._flush()
+        protocol._writer.queue.join()
+        self.assertEqual(protocol._persistent_store['pktid'], 2)
+
+    def test_flush_write_error(self):
+        """
+        Verify a failed write raises WRITE_ERROR without storing pktid
+        """
+        self._assert_write_error(InstrumentProtocolException('disk full'))
+
+    def test_flush_unexpected_error(self):
+        """
+        Verify any exception writing a flush raises WRITE_ERROR, not only InstrumentProtocolException
+        """
+        self._assert_write_error(ValueError('cannot encode'))
+
+    def _assert_write_error(self, exception):
+        protocol = self._create_flush_protocol()
+        protocol._bin_data(self._antelope_packet(1, 1000.0))
+        with patch.object(PacketLog, 'write', side_effect=exception):
+            protocol._flush()
+            protocol._writer.queue.join()
+
+        self.assertNotIn('pktid', protocol._persistent_store)
+        self.assertEqual(protocol._logs, {})
+        self.assertEqual(protocol._driver_event.call_args[0], (DriverAsyncEvent.ERROR, exception))
+        protocol._async_raise_fsm_event.assert_called_once_with(ProtocolEvent.WRITE_ERROR)
+
+        # bins queued before the error is handled are dropped
+        protocol._bin_data(self._antelope_packet(2, 1001.0))
+        protocol._flush()
+        protocol._writer.queue.join()
+        self.assertNotIn('pktid', protocol._persistent_store)
+
 
 ###############################################################################
 #                            INTEGRATION TESTS                                #
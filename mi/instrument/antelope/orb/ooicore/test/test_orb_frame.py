@@ -0,0 +1,131 @@
+"""
+@package mi.instrument.antelope.orb.ooicore.test.test_orb_frame
+@file mi/instrument/antelope/orb/ooicore/test/test_orb_frame.py
+@brief Test cases for framed binary ORB packets
+"""
+import cPickle as pickle
+import shutil
+import tempfile
+
+import numpy as np
+from mock import Mock, patch
+from nose.plugins.attrib import attr
+from unittest import TestCase
+
+from mi.core.exceptions import InstrumentProtocolException
+from mi.core.instrument.port_agent_client import PortAgentPacket
+from mi.instrument.antelope.orb.ooicore.driver import Protocol, Parameter
+from mi.instrument.antelope.orb.ooicore.orb_frame import FrameAssembler, pack_frame, FRAME_HEADER
+from mi.instrument.antelope.orb.ooicore.packet_log import PacketLog
+
+__license__ = 'Apache 2.0'
+
+# the most data a port agent packet carries
+MAX_DATA = 65519
+
+
+def orb_packet(pktid, time, nsamp, first=0):
+    return {'pktid': pktid, 'net': 'OO', 'sta': 'AXAS1', 'loc': '', 'chan': 'HNZ', 'time': time,
+            'samprate': 256000.0, 'calib': 1.0, 'calper': 0.0, 'nsamp': nsamp,
+            'data': np.arange(first, first + nsamp, dtype='i') * 3 - 1000}
+
+
+def fragments(data, size=MAX_DATA):
+    return [data[index:index + size] for index in xrange(0, len(data), size)]
+
+
+@attr('UNIT', group='mi')
+class FrameAssemblerUnitTest(TestCase):
+    def setUp(self):
+        self.assembler = FrameAssembler()
+
+    def assert_packet(self, packet, expected):
+        for key in expected:
+            if key == 'data':
+                np.testing.assert_array_equal(packet['data'], expected['data'])
+            else:
+                self.assertEqual(packet[key], expected[key], key)
+
+    def test_single(self):
+        expected = orb_packet(7, 1451606400.25, 100)
+        packet = self.assembler.add(pack_frame(expected))
+        self.assert_packet(packet, expected)
+        self.assertEqual(packet['data'].dtype.itemsize, 4)
+
+    def test_fragments(self):
+        # 16 bytes per fragment do not line up with the samples
+        expected = orb_packet(7, 1451606400.25, 1000)
+        data = pack_frame(expected)
+        pieces = [data[:FRAME_HEADER.size + 3]] + fragments(data[FRAME_HEADER.size + 3:], 16)
+        for piece in pieces[:-1]:
+            self.assertIsNone(self.assembler.add(piece))
+        self.assert_packet(self.assembler.add(pieces[-1]), expected)
+
+        # and again, reusing the buffer
+        expected = orb_packet(8, 1451606401.25, 50000, first=1000)
+        packets = [self.assembler.add(piece) for piece in fragments(pack_frame(expected))]
+        self.assertEqual(packets[:-1], [None] * (len(packets) - 1))
+        self.assert_packet(packets[-1], expected)
+
+    def test_empty(self):
+        packet = self.assembler.add(pack_frame(orb_packet(7, 1451606400.25, 0)))
+        self.assertEqual(len(packet['data']), 0)
+
+    def test_bad_frames(self):
+        with self.assertRaises(InstrumentProtocolException):
+            self.assembler.add('ORBF')
+        with self.assertRaises(InstrumentProtocolException):
+            self.assembler.add(pickle.dumps(orb_packet(7, 1451606400.25, 100), protocol=2))
+
+        # too many samples, the next frame is read again
+        data = pack_frame(orb_packet(7, 1451606400.25, 10))
+        self.assertIsNone(self.assembler.add(data[:-8]))
+        with self.assertRaises(InstrumentProtocolException):
+            self.assembler.add(data[-8:] + '\0' * 4)
+        self.assertEqual(self.assembler.add(data)['pktid'], 7)
+
+
+@attr('UNIT', group='mi')
+class GotDataUnitTest(TestCase):
+    def setUp(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        patcher = patch.object(PacketLog, 'base_dir', base_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.protocol = Protocol(Mock())
+        self.protocol._param_dict.set_value(Parameter.REFDES, 'test')
+
+    def got_data(self, packet_type, data):
+        for fragment in fragments(data):
+            port_agent_packet = PortAgentPacket(packet_type)
+            port_agent_packet.attach_data(fragment)
+            port_agent_packet.attach_timestamp(3660000000.0)
+            port_agent_packet.pack_header()
+            self.protocol.got_data(port_agent_packet)
+
+    def binned(self):
+        return np.concatenate([samples for _log in self.protocol._filled_logs + self.protocol._logs.values()
+                               for _, samples in _log.seal()])
+
+    def test_framed(self):
+        for index in xrange(3):
+            packet = orb_packet(index, 1451606400 + index * 0.25, 64000, first=index * 64000)
+            self.got_data(PortAgentPacket.FRAMED_FROM_INSTRUMENT, pack_frame(packet))
+        self.assertEqual(self.protocol._pktid, 2)
+        np.testing.assert_array_equal(self.binned(), np.arange(192000) * 3 - 1000)
+
+    def test_pickled(self):
+        # packets from older port agents
+        for index in xrange(3):
+            packet = orb_packet(index, 1451606400 + index * 0.25, 64000, first=index * 64000)
+            packet['data'] = packet['data'].tolist()
+            self.got_data(PortAgentPacket.PICKLED_FROM_INSTRUMENT, pickle.dumps(packet, protocol=2))
+        self.assertEqual(self.protocol._pktid, 2)
+        np.testing.assert_array_equal(self.binned(), np.arange(192000) * 3 - 1000)
+
+    def test_samprate(self):
+        packet = dict(orb_packet(1, 1451606400, 10), samprate=0.0)
+        with self.assertRaises(InstrumentProtocolException):
+            self.got_data(PortAgentPacket.FRAMED_FROM_INSTRUMENT, pack_frame(packet))
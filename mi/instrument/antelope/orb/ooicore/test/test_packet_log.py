@@ -1,9 +1,13 @@
-import mock
+import os
+import shutil
+import tempfile
 
+import numpy as np
 from io import BytesIO
+from obspy import read
 from unittest import TestCase
 from nose.plugins.attrib import attr
-from mi.instrument.antelope.orb.ooicore.packet_log import PacketLogHeader, PacketLog, GapException
+from mi.instrument.antelope.orb.ooicore.packet_log import PacketLogHeader, PacketLog, GapException, RECORD_LENGTH
 from collections import namedtuple
 
 from mi.core.log import get_logger
@@ -11,8 +15,9 @@ log = get_logger()
 
 __author__ = 'petercable'
 
-HeaderTuple = namedtuple('HeaderTuple', 'net, location, station, channel, starttime, maxtime, rate, calib, calper refdes')
-header_values = HeaderTuple('OO', 'XX', 'AXAS1', 'EHE', 1.0, 100.0, 200.0, 1.0, 0.0, 'refdes')
+HeaderTuple = namedtuple('HeaderTuple',
+                         'net, location, station, channel, starttime, mintime, maxtime, rate, calib, calper refdes')
+header_values = HeaderTuple('OO', 'XX', 'AXAS1', 'EHE', 1.0, 1.0, 100.0, 200.0, 1.0, 0.0, 'refdes')
 
 PacketTuple = namedtuple('PacketTuple',
                          'net, loc, sta, chan, time, rate, calib, calper, nsamp, data')
@@ -31,11 +36,11 @@ class PacketLogUnitTest(TestCase):
     def test_header_properties(self):
         header = PacketLogHeader(*header_values)
 
-        self.assertEqual(header.time, '1970-01-01T00:00:01.000000')
+        self.assertEqual(header.time, '1970-01-01T00:00:01.000000Z')
         self.assertEqual(header.delta, 1.0 / header_values.rate)
         self.assertEqual(header.name, 'OO-AXAS1-XX-EHE')
         self.assertEqual(header.endtime, header.starttime)
-        self.assertEqual(header.fname, 'OO-AXAS1-XX-EHE-1970-01-01T00:00:01.000000.mseed')
+        self.assertEqual(header.fname, 'OO-AXAS1-XX-EHE-1970-01-01T00:00:01.000000Z.mseed')
 
         # add some samples, verify the endtime advances
         header.num_samples = 200
@@ -53,7 +58,7 @@ class PacketLogUnitTest(TestCase):
         log.create(*header_values)
 
         self.assertEqual(log.absname, './antelope_data/refdes/1970/01/01/'
-                                      'OO-AXAS1-XX-EHE-1970-01-01T00:00:01.000000.mseed')
+                                      'OO-AXAS1-XX-EHE-1970-01-01T00:00:01.000000Z.mseed')
 
     def test_log_add_packet(self):
         packet_log = PacketLog()
@@ -64,34 +69,89 @@ class PacketLogUnitTest(TestCase):
 
         self.assertEqual(list(packet_log.data.get()), packet_values.data)
 
-    def test_log_flush(self):
-        # here we'll mock the methods that actually write to disk
-        # so we can test the flush interface without creating any files
-        trace_write = 'obspy.core.trace.Trace.write'
-
-        with mock.patch(trace_write, new_callable=mock.Mock) as mocked_write:
-            packet_log = PacketLog()
-            packet_log.filehandle = BytesIO()
-            packet_log.create(*header_values)
+    def create_log(self):
+        PacketLog.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, PacketLog.base_dir)
+        packet_log = PacketLog()
+        packet_log.create(*header_values)
+        return packet_log
 
-            packet_log.add_packet(packet_values._asdict())
-            # assert the record was updated
-            self.assertEqual(packet_log.header.num_samples, 5)
+    @staticmethod
+    def packet(time, data):
+        return dict(packet_values._asdict(), time=time, nsamp=len(data), data=data)
 
-            packet_log.flush()
+    @staticmethod
+    def read(packet_log):
+        return read(packet_log.absname)
 
-            # assert Trace.write was called
-            mocked_write.assert_called_once_with(packet_log.absname, format='MSEED')
+    def test_log_flush(self):
+        packet_log = self.create_log()
 
-    def test_packet_gap_exception(self):
+        packet_log.add_packet(packet_values._asdict())
+        # assert the record was updated
+        self.assertEqual(packet_log.header.num_samples, 5)
+
+        packet_log.flush()
+        self.assertFalse(packet_log.needs_flush)
+
+        stream = self.read(packet_log)
+        self.assertEqual(len(stream), 1)
+        self.assertEqual(list(stream[0].data), packet_values.data)
+        self.assertEqual(stream[0].stats.starttime.timestamp, 1.0)
+        self.assertEqual(stream[0].stats.sampling_rate, 200.0)
+
+    def test_merge_contiguous(self):
+        packet_log = self.create_log()
+        packet_log.add_packet(self.packet(1.0, range(5)))
+        packet_log.add_packet(self.packet(1.025, range(5, 10)))
+        self.assertEqual(list(packet_log.data.get()), range(10))
+
+    def test_flush_appends(self):
+        packet_log = self.create_log()
+        samples = np.arange(18000, dtype='i') * 7919 % 65536
+        time = 1.0
+        for start in xrange(0, len(samples), 1000):
+            packet_log.add_packet(self.packet(time, samples[start:start + 1000]))
+            time += 5.0
+            packet_log.flush()
+            # only the last record is written again by the next flush
+            self.assertEqual(packet_log._offset, os.path.getsize(packet_log.absname) - RECORD_LENGTH)
+            self.assertLessEqual(packet_log.data.index, start + 1000)
+
+        stream = self.read(packet_log)
+        self.assertEqual(len(stream), 1)
+        np.testing.assert_array_equal(stream[0].data, samples)
+        self.assertEqual(os.path.getsize(packet_log.absname) % RECORD_LENGTH, 0)
+
+        # sequence numbers continue across flushes
+        with open(packet_log.absname, 'rb') as fh:
+            contents = fh.read()
+        sequence = [int(contents[offset:offset + 6]) for offset in xrange(0, len(contents), RECORD_LENGTH)]
+        self.assertEqual(sequence, range(1, len(sequence) + 1))
+
+    def test_gap_segments(self):
+        packet_log = self.create_log()
+        packet_log.add_packet(self.packet(1.0, range(5)))
+        packet_log.flush()
+        packet_log.add_packet(self.packet(1.025, range(5, 10)))
+        packet_log.add_packet(self.packet(2.0, range(10, 15)))
+        packet_log.flush()
+
+        stream = self.read(packet_log)
+        self.assertEqual([list(trace.data) for trace in stream], [range(10), range(10, 15)])
+        self.assertEqual([trace.stats.starttime.timestamp for trace in stream], [1.0, 2.0])
+
+    def test_packet_gap(self):
         log = PacketLog()
         log.filehandle = BytesIO()
         log.create(*header_values)
 
         log.add_packet(packet_values._asdict())
 
-        with self.assertRaises(GapException):
-            log.add_packet(gap_packet_values._asdict())
+        # a gap inside the bin starts a new segment
+        self.assertIsNone(log.add_packet(gap_packet_values._asdict()))
+        self.assertEqual([(start, list(samples)) for start, samples in log.seal()],
+                         [(1000000000, packet_values.data), (50000000000, list(gap_packet_values.data))])
 
     def test_packet_range_exceptions(self):
         log = PacketLog()
@@ -115,9 +175,6 @@ class PacketLogUnitTest(TestCase):
 
         self.assertEqual(log.header.num_samples, 5)
 
-        # fudge our num_samples value to avoid gap exception
-        log.header.num_samples += 19775
-
         # add our overlapping data
         packet = log.add_packet(overlapping_packet_values._asdict())
 
@@ -125,6 +182,7 @@ class PacketLogUnitTest(TestCase):
         self.assertEqual(packet['nsamp'], 180)
         self.assertEqual(packet['time'], 100.0)
 
-        # assert our container is full
-        self.assertEqual(log.header.num_samples, 200 * 99)
-        self.assertEqual(log.header.endtime, 100.0)
+        # assert the samples up to the end of the bin were written
+        self.assertEqual(log.header.num_samples, 20)
+        self.assertAlmostEqual(log.header.endtime, 100.0)
+        self.assertEqual([len(samples) for _, samples in log.seal()], [5, 20])
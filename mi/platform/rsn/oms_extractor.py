@@ -3,8 +3,8 @@ import datetime
 import functools
 import socket
 import time
-from threading import Lock
-from xmlrpclib import ServerProxy
+from threading import Lock, local
+from xmlrpclib import Fault, MultiCall, ServerProxy
 from pkg_resources import resource_string
 
 import ntplib
@@ -24,6 +24,8 @@ log = get_logger()
 
 __license__ = 'Apache 2.0'
 DEFAULT_POOL_SIZE = 5
+# nodes fetched per system.multicall request, 0 to fetch each node with its own request
+DEFAULT_MULTICALL = 0
 DEFAULT_STREAM_DEF_FILENAME = 'node_config_files/stream_defs.yml'
 
 
@@ -66,6 +68,47 @@ class stopwatch(object):
         return decorated
 
 
+class OmsProxyPool(object):
+    """
+    One ServerProxy per thread, kept between rounds. The transport of a proxy
+    keeps its HTTP connection open, so each thread of the extractor reuses a
+    single connection to the OMS rather than connecting for every request.
+    """
+    def __init__(self, uri):
+        self.uri = uri
+        self._local = local()
+        self._lock = Lock()
+        # ServerProxy turns any attribute into a remote method, it can not be hashed
+        self._proxies = []
+
+    def get(self):
+        proxy = getattr(self._local, 'proxy', None)
+        if proxy is None:
+            proxy = self._local.proxy = ServerProxy(self.uri)
+            with self._lock:
+                self._proxies.append(proxy)
+        return proxy
+
+    def discard(self):
+        """
+        Drop this thread's proxy (and its connection) after an error
+        """
+        proxy, self._local.proxy = getattr(self._local, 'proxy', None), None
+        if proxy is not None:
+            with self._lock:
+                self._proxies = [p for p in self._proxies if p is not proxy]
+            proxy('close')()
+
+    def close(self):
+        """
+        Close the connections of every thread, their next requests reconnect
+        """
+        with self._lock:
+            proxies, self._proxies = self._proxies, []
+        for proxy in proxies:
+            proxy('close')()
+
+
 class PlatformParticle(DataParticle):
     """
     The contents of the parameter dictionary, published at the start of a scan
@@ -80,7 +123,9 @@ class OmsExtractor(object):
     def __init__(self, config):
         self.oms_uri = config.get('oms_uri')
         self.pool_size = config.get('pool_size', DEFAULT_POOL_SIZE)
+        self.multicall = config.get('multicall', DEFAULT_MULTICALL)
         self.thread_pool = ThreadPoolExecutor(self.pool_size)
+        self.proxies = OmsProxyPool(self.oms_uri)
         self.publisher = Publisher.from_url(config.get('publish_uri', 'log://'),
                                             headers=self.headers, max_events=1000, publish_interval=1)
         self.publisher.start()
@@ -95,12 +140,17 @@ class OmsExtractor(object):
         ntp_time = ntplib.system_to_ntp_time(time.time())
         max_time = ntp_time - 90
 
-        futures = []
+        requests = []
         for nc in self.node_configs:
             with self.times_lock:
                 t = max(max_time, self._last_times.get(nc.platform_id))
-            proxy = ServerProxy(self.oms_uri)
-            futures.append(self.thread_pool.submit(self._fetch, proxy, nc, t))
+            requests.append((nc, t))
+
+        if self.multicall:
+            futures = [self.thread_pool.submit(self._fetch_batch, requests[i:i + self.multicall])
+                       for i in xrange(0, len(requests), self.multicall)]
+        else:
+            futures = [self.thread_pool.submit(self._fetch, nc, t) for nc, t in requests]
 
         for f in futures:
             result = f.result()
@@ -137,15 +187,20 @@ class OmsExtractor(object):
 
         return attrs_return
 
-    @staticmethod
-    def _fetch_attrs(proxy, platform_id, attrs):
+    def _fetch_attrs(self, platform_id, attrs):
         with stopwatch(label='get_platform_attribute_values: %s' % platform_id, logger=log.info):
             try:
-                response = proxy.attr.get_platform_attribute_values(platform_id, attrs).get(platform_id, {})
+                response = self.proxies.get().attr.get_platform_attribute_values(platform_id, attrs)
             except socket.error:
                 log.exception('Error connecting to OMS')
+                self.proxies.discard()
                 response = {}
 
+        return OmsExtractor._parse_attrs(platform_id, response)
+
+    @staticmethod
+    def _parse_attrs(platform_id, response):
+        response = response.get(platform_id, {})
         return_dict = {}
         count = 0
         for key, value_list in response.iteritems():
@@ -168,11 +223,47 @@ class OmsExtractor(object):
         return particle
 
     @stopwatch(label='_fetch', logger=log.debug)
-    def _fetch(self, proxy, node_config, last_time):
+    def _fetch(self, node_config, last_time):
         log.info('_fetch: %r %r', node_config.platform_id, last_time)
-        base_refdes = node_config.node_meta_data['reference_designator']
         attrs = [(k, last_time) for k in node_config.attributes]
-        fetched = OmsExtractor._fetch_attrs(proxy, node_config.platform_id, attrs)
+        fetched = self._fetch_attrs(node_config.platform_id, attrs)
+        self._publish(node_config, fetched)
+
+    @stopwatch(label='_fetch_batch', logger=log.debug)
+    def _fetch_batch(self, requests):
+        """
+        Fetch the values of several nodes with one system.multicall request
+        @param requests list of (node_config, last_time)
+        """
+        multicall = MultiCall(self.proxies.get())
+        for node_config, last_time in requests:
+            attrs = [(k, last_time) for k in node_config.attributes]
+            multicall.attr.get_platform_attribute_values(node_config.platform_id, attrs)
+
+        with stopwatch(label='multicall: %d nodes' % len(requests), logger=log.info):
+            try:
+                responses = multicall()
+            except socket.error:
+                log.exception('Error connecting to OMS')
+                self.proxies.discard()
+                return
+            except Fault as e:
+                log.error('OMS multicall failed, fetching nodes individually: %s', e)
+                self.multicall = 0
+                for node_config, last_time in requests:
+                    self._fetch(node_config, last_time)
+                return
+
+        for index, (node_config, _) in enumerate(requests):
+            try:
+                response = responses[index]
+            except Fault as e:
+                log.error('Error fetching %s: %s', node_config.platform_id, e)
+                response = {}
+            self._publish(node_config, OmsExtractor._parse_attrs(node_config.platform_id, response))
+
+    def _publish(self, node_config, fetched):
+        base_refdes = node_config.node_meta_data['reference_designator']
         self._set_last_times(node_config.platform_id, fetched)
         for stream_name, stream_instances in node_config.node_streams.iteritems():
             for key, parameters in stream_instances.iteritems():
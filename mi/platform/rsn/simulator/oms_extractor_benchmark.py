@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""
+@package mi.platform.rsn.simulator.oms_extractor_benchmark
+@file    mi/platform/rsn/simulator/oms_extractor_benchmark.py
+@brief   Times OmsExtractor rounds against the OMS simulator, with a new
+         connection per node, with pooled connections and with multicall.
+
+ USAGE:
+    $ python mi/platform/rsn/simulator/oms_extractor_benchmark.py --nodes 60 --rounds 5
+"""
+
+__license__ = 'Apache 2.0'
+
+import argparse
+import logging
+import os
+import time
+from collections import namedtuple
+from xmlrpclib import ServerProxy
+
+from mock import Mock
+
+from mi.platform.rsn.oms_extractor import OmsExtractor, OmsProxyPool
+from mi.platform.rsn.simulator.oms_simulator_server import CIOMSSimulatorServer
+
+Node = namedtuple('Node', 'platform_id attributes node_meta_data node_streams')
+
+
+class NewProxyPool(OmsProxyPool):
+    """
+    A new proxy, and connection, for every request
+    """
+    def get(self):
+        return ServerProxy(self.uri)
+
+
+def create_nodes(uri, count):
+    """
+    count nodes cycling over the platforms of the simulated network
+    """
+    proxy = ServerProxy(uri)
+    platforms = sorted(proxy.config.get_platform_map())
+    nodes = []
+    for index in xrange(count):
+        platform_id = platforms[index % len(platforms)][0]
+        attributes = proxy.attr.get_platform_attributes(platform_id)[platform_id]
+        nodes.append(Node(platform_id, sorted(attributes), {'reference_designator': 'NODE%03d' % index}, {}))
+    return nodes
+
+
+def time_rounds(extractor, rounds):
+    extractor.fetch_all()
+    start = time.time()
+    for _ in xrange(rounds):
+        extractor.fetch_all()
+    return (time.time() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OmsExtractor round times against the OMS simulator')
+    parser.add_argument('--nodes', type=int, default=60, help='nodes fetched per round (default: 60)')
+    parser.add_argument('--rounds', type=int, default=5, help='rounds timed (default: 5)')
+    parser.add_argument('--pool-size', type=int, default=5, help='extractor threads (default: 5)')
+    parser.add_argument('--multicall', type=int, default=12, help='nodes per multicall (default: 12)')
+    opts = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    # the simulator writes its URI here
+    if not os.path.exists('logs'):
+        os.makedirs('logs')
+    server = CIOMSSimulatorServer('localhost', 0)
+    server._server.logRequests = False
+    uri = 'http://localhost:%d/' % server._server.socket.getsockname()[1]
+    nodes = create_nodes(uri, opts.nodes)
+
+    results = []
+    for label, pool_class, multicall in [('connection per node', NewProxyPool, 0),
+                                         ('pooled connections', OmsProxyPool, 0),
+                                         ('multicall', OmsProxyPool, opts.multicall)]:
+        extractor = OmsExtractor({'oms_uri': uri, 'pool_size': opts.pool_size, 'multicall': multicall})
+        extractor.publisher.stop()
+        extractor.publisher = Mock()
+        extractor.proxies = pool_class(uri)
+        extractor.node_configs = nodes
+        results.append((label, time_rounds(extractor, opts.rounds)))
+        extractor.proxies.close()
+        extractor.thread_pool.shutdown()
+
+    server.shutdown_server()
+
+    baseline = results[0][1]
+    print '%d nodes, %d threads, %d rounds' % (opts.nodes, opts.pool_size, opts.rounds)
+    for label, elapsed in results:
+        print '%-20s %8.1f ms/round  %5.2fx' % (label, elapsed * 1000, baseline / elapsed)
+
+
+if __name__ == '__main__':
+    main()
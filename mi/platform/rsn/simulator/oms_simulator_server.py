@@ -29,11 +29,27 @@ import logging
 
 from mi.platform.rsn.simulator.oms_simulator import CIOMSSimulator
 from mi.platform.util.network_util import NetworkUtil
-from SimpleXMLRPCServer import SimpleXMLRPCServer
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+from SocketServer import ThreadingMixIn
 from threading import Thread
 import time
 
 
+class KeepAliveRequestHandler(SimpleXMLRPCRequestHandler):
+    """
+    Lets clients keep their connection open between requests.
+    """
+    protocol_version = 'HTTP/1.1'
+
+
+class ThreadingXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    """
+    Serves each connection in its own thread, so a client keeping its
+    connection open does not hold up the others.
+    """
+    daemon_threads = True
+
+
 class CIOMSSimulatorWithExit(CIOMSSimulator):
     """
     Adds some special methods for coordination from integration tests:
@@ -126,7 +142,8 @@ class CIOMSSimulatorServer(object):
             log.debug("network serialization:\n   %s" % ser.replace('\n', '\n   '))
             log.debug("network.get_map() = %s\n" % self._sim.config.get_platform_map())
 
-        self._server = SimpleXMLRPCServer((host, port), allow_none=True)
+        self._server = ThreadingXMLRPCServer((host, port), requestHandler=KeepAliveRequestHandler,
+                                             allow_none=True)
 
         actual_port = self._server.socket.getsockname()[1]
         uri = "http://%s:%s/" % (host, actual_port)
@@ -136,6 +153,7 @@ class CIOMSSimulatorServer(object):
             f.write("rsn_oms_simulator_uri=%s\n" % uri)
 
         self._server.register_introspection_functions()
+        self._server.register_multicall_functions()
         self._server.register_instance(self._sim, allow_dotted_names=True)
 
         log.info("Methods:\n\t%s", "\n\t".join(self._server.system_listMethods()))
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+"""
+@package mi.platform.rsn.test.test_oms_extractor
+@file mi/platform/rsn/test/test_oms_extractor.py
+@brief Test cases for fetching attribute values with the OMS extractor
+"""
+
+__license__ = 'Apache 2.0'
+
+from collections import namedtuple
+from threading import Thread
+
+from mock import Mock
+from nose.plugins.attrib import attr
+
+from mi.core.unit_test import MiUnitTestCase
+from mi.platform.rsn.oms_extractor import OmsExtractor
+from mi.platform.rsn.simulator.oms_simulator_server import ThreadingXMLRPCServer, KeepAliveRequestHandler
+
+Node = namedtuple('Node', 'platform_id attributes node_meta_data node_streams')
+
+
+class FakeOms(object):
+    """
+    Returns two values of every requested attribute, counting connections and requests
+    """
+    def __init__(self, multicall=True):
+        self.attr = self
+        self.requests = []
+        self.connections = 0
+        self.server = ThreadingXMLRPCServer(('localhost', 0), requestHandler=KeepAliveRequestHandler,
+                                            allow_none=True, logRequests=False)
+        self.server.register_instance(self, allow_dotted_names=True)
+        if multicall:
+            self.server.register_multicall_functions()
+
+        process_request = self.server.process_request
+
+        def count_connections(request, client_address):
+            self.connections += 1
+            process_request(request, client_address)
+
+        self.server.process_request = count_connections
+        self.uri = 'http://localhost:%d/' % self.server.socket.getsockname()[1]
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_platform_attribute_values(self, platform_id, req_attrs):
+        self.requests.append(platform_id)
+        if platform_id == 'bad':
+            raise ValueError('unknown platform')
+        return {platform_id: dict((name, [[platform_id, 1000.0], [name, 2000.0]]) for name, t in req_attrs)}
+
+
+@attr('UNIT', group='mi')
+class TestOmsExtractor(MiUnitTestCase):
+
+    def create(self, nodes, oms_multicall=True, **config):
+        self.oms = FakeOms(oms_multicall)
+        self.addCleanup(self.oms.stop)
+        config['oms_uri'] = self.oms.uri
+        extractor = OmsExtractor(config)
+        self.addCleanup(extractor.proxies.close)
+        self.addCleanup(extractor.thread_pool.shutdown)
+        extractor.publisher = Mock()
+        extractor.node_configs = [Node(platform_id, ['a', 'b'], {'reference_designator': platform_id}, {})
+                                  for platform_id in nodes]
+        extractor._fetch_attrs = Mock(wraps=extractor._fetch_attrs)
+        extractor._publish = Mock(wraps=extractor._publish)
+        return extractor
+
+    def fetched(self, extractor):
+        return sorted((node_config.platform_id, fetched)
+                      for (node_config, fetched), _ in extractor._publish.call_args_list)
+
+    def test_connection_reuse(self):
+        nodes = ['node%02d' % index for index in xrange(20)]
+        extractor = self.create(nodes, pool_size=2)
+        for _ in xrange(3):
+            extractor.fetch_all()
+        self.assertEqual(len(self.oms.requests), 60)
+        # one connection per thread of the pool
+        self.assertLessEqual(self.oms.connections, 2)
+
+    def test_multicall(self):
+        nodes = ['node%02d' % index for index in xrange(10)]
+        extractor = self.create(nodes, pool_size=1)
+        extractor.fetch_all()
+        expected = self.fetched(extractor)
+
+        extractor = self.create(nodes, pool_size=2, multicall=4)
+        extractor.fetch_all()
+        self.assertEqual(self.fetched(extractor), expected)
+        self.assertEqual(sorted(self.oms.requests), nodes)
+        self.assertEqual(extractor._fetch_attrs.call_count, 0)
+
+    def test_multicall_fault(self):
+        # a fault fetching one node does not lose the others
+        extractor = self.create(['node1', 'bad', 'node2'], multicall=3)
+        extractor.fetch_all()
+        self.assertEqual(self.fetched(extractor)[0], ('bad', {}))
+        self.assertEqual(sorted(extractor._last_times), ['node1', 'node2'])
+        self.assertEqual(extractor.multicall, 3)
+
+    def test_multicall_unsupported(self):
+        nodes = ['node1', 'node2', 'node3']
+        extractor = self.create(nodes, oms_multicall=False, multicall=2)
+        extractor.fetch_all()
+        self.assertEqual(extractor.multicall, 0)
+        self.assertEqual([platform_id for platform_id, fetched in self.fetched(extractor) if fetched], nodes)
+        self.assertEqual(extractor._fetch_attrs.call_count, 3)
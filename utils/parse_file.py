@@ -2,15 +2,15 @@
 
 import importlib
 import json
+import multiprocessing
 import os
 from functools import wraps
 
 import click as click
 import datetime
-import pandas as pd
-import xarray as xr
-import numpy as np
 
+from mi.core.instrument.chunked_writer import WRITERS, chunked_writer
+from mi.core.instrument.particle_accumulator import ParticleAccumulator
 from mi.core.log import get_logger, LoggerManager
 
 try:
@@ -32,9 +32,11 @@ class StopWatch(object):
         self.start_time = datetime.datetime.now()
         self.message = message
 
+    def elapsed(self):
+        return datetime.datetime.now() - self.start_time
+
     def __repr__(self):
-        stop = datetime.datetime.now()
-        r = str(stop - self.start_time)
+        r = str(self.elapsed())
         if self.message:
             return self.message + ' ' + r
         return r
@@ -75,17 +77,25 @@ def log_timing(func):
 
 class ParticleHandler(object):
     """
-    Particle handler which flattens all data particle "values" lists to key: value pairs in the parent dictionary
+    Particle handler which accumulates the particles of each stream into columns, flattening the data
+    particle "values" lists to one column per parameter.
     Also contains a method to output the particle data as a dictionary of pandas dataframes
     """
-    def __init__(self, output_path=None, formatter=None):
-        self.samples = {}
+    # ask DataSetDriver for particle dictionaries rather than JSON
+    accepts_dicts = True
+
+    def __init__(self, output_path=None, formatter=None, chunk_rows=None):
         self.failure = False
         if output_path is None:
             output_path = os.getcwd()
         self.output_path = output_path
         self.formatter = formatter
         self.check_output_path()
+        if formatter in WRITERS:
+            # chunked formats are written out as the particles arrive
+            self.particles = chunked_writer(formatter, output_path, chunk_rows)
+        else:
+            self.particles = ParticleAccumulator()
 
     def check_output_path(self):
         op = self.output_path
@@ -96,47 +106,30 @@ class ParticleHandler(object):
         else:
             os.makedirs(op)
 
-    @staticmethod
-    def flatten(sample):
-        values = sample.pop('values')
-        for each in values:
-            sample[each['value_id']] = each['value']
-        return sample
-
     def addParticleSample(self, sample_type, sample):
-        sample = self.flatten(sample)
-        self.samples.setdefault(sample_type, []).append(sample)
+        self.particles.add_particle(sample_type, sample)
+
+    def addParticleSamples(self, sample_type, samples):
+        for sample in samples:
+            self.particles.add_particle(sample_type, sample)
 
     def setParticleDataCaptureFailure(self):
         self.failure = True
 
+    def merge(self, particles):
+        """
+        Add the particles accumulated by another handler (e.g. in a worker process)
+        """
+        for stream in sorted(particles.streams):
+            self.particles.add_columns(stream, particles.streams[stream])
+
     @log_timing
     def to_dataframes(self):
-        data_frames = {}
-        for particle_type in self.samples:
-            data_frames[particle_type] = self.fix_arrays(pd.DataFrame(self.samples[particle_type]))
-        return data_frames
+        return self.particles.to_dataframes()
 
-    def to_datasets(self):
-        datasets = {}
-        for particle_type in self.samples:
-            datasets[particle_type] = self.fix_arrays(pd.DataFrame(self.samples[particle_type]), return_as_xr=True)
-        return datasets
-
-    @staticmethod
     @log_timing
-    def fix_arrays(data_frame, return_as_xr=False):
-        # round-trip the dataframe through xray to get the multidimensional indexing correct
-        new_ds = xr.Dataset()
-        for each in data_frame:
-            if data_frame[each].dtype == 'object' and isinstance(data_frame[each].values[0], list):
-                data = np.array([np.array(x) for x in data_frame[each].values])
-                new_ds[each] = xr.DataArray(data)
-            else:
-                new_ds[each] = data_frame[each]
-        if return_as_xr:
-            return new_ds
-        return new_ds.to_dataframe()
+    def to_datasets(self):
+        return self.particles.to_datasets()
 
     @log_timing
     def to_csv(self):
@@ -147,10 +140,11 @@ class ParticleHandler(object):
 
     @log_timing
     def to_json(self):
-        for particle_type in self.samples:
+        records = self.particles.to_records()
+        for particle_type in records:
             file_path = os.path.join(self.output_path, '%s.json' % particle_type)
             with open(file_path, 'w') as fh:
-                json.dump(self.samples[particle_type], fh)
+                json.dump(records[particle_type], fh)
 
     @log_timing
     def to_pd_pickle(self):
@@ -168,12 +162,18 @@ class ParticleHandler(object):
             with open(file_path, 'w') as fh:
                 pickle.dump(datasets[particle_type], fh, protocol=-1)
 
+    @log_timing
+    def to_chunked(self):
+        self.particles.close()
+
     def write(self):
         option_map = {
             'csv': self.to_csv,
             'json': self.to_json,
             'pd-pickle': self.to_pd_pickle,
-            'xr-pickle': self.to_xr_pickle
+            'xr-pickle': self.to_xr_pickle,
+            'netcdf': self.to_chunked,
+            'parquet': self.to_chunked,
         }
         formatter = option_map[self.formatter]
         formatter()
@@ -190,26 +190,90 @@ def find_driver(driver_string):
     raise Exception('Unable to locate driver: %r', driver_string)
 
 
-def run(driver, files, fmt, out):
+def parse_one(args):
+    """
+    Parse a single file into a fresh handler, run in a worker process.
+    Returns the file path, the accumulated particles (None on error), the
+    capture failure flag, the elapsed time and the error message, if any.
+    """
+    driver, file_path = args
+    watch = StopWatch()
+    try:
+        module = find_driver(driver)
+        handler = ParticleHandler(formatter=None)
+        module.parse(base_path, file_path, handler)
+        return file_path, handler.particles, handler.failure, watch.elapsed(), None
+    except Exception as e:
+        log.exception('Exception parsing file: %s', file_path)
+        return file_path, None, True, watch.elapsed(), '%s: %s' % (type(e).__name__, e)
+
+
+def log_summary(timings, errors, watch):
+    log.info('Parsed %d files (%d failed) in %s, %s spent parsing', len(timings), len(errors), watch.elapsed(),
+             sum(timings.itervalues(), datetime.timedelta()))
+    for file_path in sorted(timings, key=timings.get, reverse=True)[:10]:
+        log.info('  %s %s', timings[file_path], file_path)
+    for file_path in errors:
+        log.error('Failed to parse %s: %s', file_path, errors[file_path])
+
+
+def run_parallel(driver, files, particle_handler, jobs):
+    """
+    Parse the files in a pool of jobs worker processes. Results are merged
+    into particle_handler in the order the files were given, a file which
+    fails to parse is logged and skipped.
+    """
+    watch = StopWatch()
+    timings = {}
+    errors = {}
+    pool = multiprocessing.Pool(jobs, initializer=monkey_patch_particles)
+    try:
+        results = pool.imap(parse_one, [(driver, file_path) for file_path in files])
+        for file_path, particles, failure, elapsed, error in results:
+            timings[file_path] = elapsed
+            if error is not None:
+                errors[file_path] = error
+            if failure:
+                particle_handler.setParticleDataCaptureFailure()
+            if particles is not None:
+                particle_handler.merge(particles)
+            log.info('Parsing file: %s took %s', file_path, elapsed)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    log_summary(timings, errors, watch)
+
+
+def run(driver, files, fmt, out, rows=None, jobs=None):
     monkey_patch_particles()
     log.info('Importing driver: %s', driver)
     module = find_driver(driver)
-    particle_handler = ParticleHandler(output_path=out, formatter=fmt)
-    for file_path in files:
-        log.info('Begin parsing: %s', file_path)
-        with StopWatch('Parsing file: %s took' % file_path):
-            module.parse(base_path, file_path, particle_handler)
+    particle_handler = ParticleHandler(output_path=out, formatter=fmt, chunk_rows=rows)
+    if jobs and jobs > 1 and len(files) > 1:
+        run_parallel(driver, files, particle_handler, jobs)
+    else:
+        for file_path in files:
+            log.info('Begin parsing: %s', file_path)
+            with StopWatch('Parsing file: %s took' % file_path):
+                module.parse(base_path, file_path, particle_handler)
 
     particle_handler.write()
 
 
 @click.command()
-@click.option('--fmt', type=click.Choice(['csv', 'json', 'pd-pickle', 'xr-pickle']), default='csv')
+@click.option('--fmt', type=click.Choice(['csv', 'json', 'pd-pickle', 'xr-pickle', 'netcdf', 'parquet']),
+              default='csv')
 @click.option('--out', type=click.Path(exists=False), default=None)
+@click.option('--rows', type=int, default=None, help='rows per chunk for the netcdf and parquet formats')
+@click.option('--jobs', type=int, default=1, help='number of files to parse in parallel')
 @click.argument('driver', nargs=1)
 @click.argument('files', nargs=-1, type=click.Path(exists=True))
-def main(driver, files, fmt, out):
-    run(driver, files, fmt, out)
+def main(driver, files, fmt, out, rows, jobs):
+    run(driver, files, fmt, out, rows, jobs)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""
+@package utils.test.test_parse_file
+@file utils/test/test_parse_file.py
+@brief Test cases for parsing files serially and with a pool of worker processes
+
+This module is also the driver parse_file is pointed at: each line of a file
+is a particle, a line reading 'bad' is a bad record and a file starting with
+'crash' fails before it is parsed.
+"""
+
+__license__ = 'Apache 2.0'
+
+import json
+import os
+import shutil
+import tempfile
+
+from mock import patch
+from nose.plugins.attrib import attr
+
+from mi.core.instrument.dataset_data_particle import DataParticle
+from mi.core.unit_test import MiUnitTestCase
+from mi.dataset.dataset_driver import DataSetDriver
+from mi.dataset.dataset_parser import SimpleParser
+from utils import parse_file
+
+DRIVER = __name__
+
+
+class LineParticle(object):
+    def __init__(self, file_name, value):
+        self.file_name = file_name
+        self.value = value
+
+    def data_particle_type(self):
+        return 'line'
+
+    def generate_dict(self):
+        return {'stream_name': 'line', 'file': self.file_name,
+                'values': [{'value_id': 'value', 'value': self.value}]}
+
+
+class LineParser(SimpleParser):
+    def parse_file(self):
+        file_name = os.path.basename(self._stream_handle.name)
+        for line in self._stream_handle:
+            line = line.strip()
+            if line == 'bad':
+                raise ValueError('bad record')
+            yield LineParticle(file_name, int(line))
+
+
+def parse(unused, source_file_path, particle_data_handler):
+    with open(source_file_path) as stream_handle:
+        if stream_handle.read(5) == 'crash':
+            raise IOError('unreadable file')
+        stream_handle.seek(0)
+        DataSetDriver(LineParser({}, stream_handle, None), particle_data_handler).processFileStream()
+    return particle_data_handler
+
+
+@attr('UNIT', group='mi')
+class ParseFileUnitTestCase(MiUnitTestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        # run() patches DataParticle.generate for the whole process
+        patcher = patch.object(DataParticle, 'generate', DataParticle.generate)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_file(self, name, lines):
+        file_path = os.path.join(self.temp_dir, name)
+        with open(file_path, 'w') as fh:
+            fh.write('\n'.join(lines) + '\n')
+        return file_path
+
+    def run_parse(self, files, jobs):
+        """
+        Parse the files to JSON, returns the particles written and the handler failure flag
+        """
+        out = os.path.join(self.temp_dir, 'out%d' % jobs)
+        write = parse_file.ParticleHandler.write
+        with patch.object(parse_file.ParticleHandler, 'write', autospec=True, side_effect=write) as handler_write:
+            parse_file.run(DRIVER, files, 'json', out, jobs=jobs)
+        particle_handler = handler_write.call_args[0][0]
+        with open(os.path.join(out, 'line.json')) as fh:
+            return json.load(fh), particle_handler.failure
+
+    def test_jobs(self):
+        files = [self.create_file('a.txt', ['1', '2', '3']), self.create_file('b.txt', ['4', '5'])]
+
+        serial = self.run_parse(files, 1)
+        parallel = self.run_parse(files, 2)
+
+        self.assertEqual(parallel, serial)
+        records, failure = parallel
+        self.assertEqual([(record['file'], record['value']) for record in records],
+                         [('a.txt', 1), ('a.txt', 2), ('a.txt', 3), ('b.txt', 4), ('b.txt', 5)])
+        self.assertFalse(failure)
+
+    def test_jobs_bad_record(self):
+        files = [self.create_file('a.txt', ['1', 'bad', '3']), self.create_file('b.txt', ['4', '5'])]
+
+        serial = self.run_parse(files, 1)
+        parallel = self.run_parse(files, 2)
+
+        # the particles before the bad record are kept and the failure reported
+        self.assertEqual(parallel, serial)
+        records, failure = parallel
+        self.assertEqual([record['value'] for record in records], [1, 4, 5])
+        self.assertTrue(failure)
+
+    def test_jobs_file_error(self):
+        files = [self.create_file('a.txt', ['crash']), self.create_file('b.txt', ['4', '5'])]
+
+        # the serial path stops at the first file which can not be parsed
+        with self.assertRaises(IOError):
+            self.run_parse(files, 1)
+
+        # a worker logs it and carries on with the other files
+        with patch.object(parse_file, 'log_summary') as log_summary:
+            records, failure = self.run_parse(files, 2)
+        self.assertEqual([record['value'] for record in records], [4, 5])
+        self.assertTrue(failure)
+        timings, errors, _ = log_summary.call_args[0]
+        self.assertEqual(sorted(timings), files)
+        self.assertEqual(errors, {files[0]: 'IOError: unreadable file'})